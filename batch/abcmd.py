@@ -16,6 +16,8 @@ import model_bcmd
 import steps
 import distance
 import inputs
+import distrib
+import surrogate
 
 # environment
 VERSION = 0.2
@@ -26,6 +28,7 @@ WORK = BUILD
 # defaults
 NPARTICLES=500
 NBATCH=1
+NASYNC=0
 BETA=1
 MODELKERNEL=0.7
 FINALEPSILON=1.5
@@ -38,6 +41,7 @@ CONFIG = { 'distance': DISTANCE,
            'build' : BUILD,
            'work' : None,
            'nbatch' : NBATCH,
+           'nasync' : NASYNC,
            'beta' : BETA,
            'param_select': PARAM_SELECT,
            'job' : None,
@@ -49,10 +53,12 @@ def process_args():
     ap.add_argument('--version', action='version', version='abcmd version %.1fa' % VERSION)
     ap.add_argument('jobfile', help='job specification file')
     ap.add_argument('datafile', help='CSV containing time series data')
+    ap.add_argument('--broker', help='distribute simulations to workers connecting on this address (listening on 127.0.0.1 unless HOST is given; needs BCMD_AUTHKEY set)', metavar='[HOST]:PORT')
+    ap.add_argument('--worker', help='run simulations for the broker at this address, instead of a job', metavar='HOST:PORT')
     
     args = ap.parse_args()
 
-    return args.jobfile, args.datafile
+    return args.jobfile, args.datafile, args.broker, args.worker
 
 
 # convert a vars or params list into the required dictionary format,
@@ -115,7 +121,9 @@ def process_inputs(jobfile, datafile):
     config = CONFIG
     
     job = inputs.readFile(jobfile)
-    data = inputs.readFile(datafile)
+    
+    # data columns are parsed as used, optionally caching them next to the file
+    data = inputs.readFile(datafile, cache=int(job['header'].get('data_cache', [[0]])[0][0]))
     
     timedata = data['timeseries']
     
@@ -196,6 +204,7 @@ def process_inputs(jobfile, datafile):
     config['baseSeq'], dummy = steps.readFiles(job['header'].get('init', [[]])[0])
     config['particles'] = int(job['header'].get('particles', [[NPARTICLES]])[0][0])
     config['nbatch'] = int(job['header'].get('nbatch', [[NBATCH]])[0][0])
+    config['nasync'] = int(job['header'].get('async', [[NASYNC]])[0][0])
     config['modelKernel'] = float(job['header'].get('modelKernel', [[MODELKERNEL]])[0][0])
     config['finalepsilon'] = float(job['header'].get('finalepsilon', [[FINALEPSILON]])[0][0])
     config['alpha'] = float(job['header'].get('alpha', [[ALPHA]])[0][0])    
@@ -203,12 +212,39 @@ def process_inputs(jobfile, datafile):
 
     config['timeout'] = int(job['header'].get('timeout', [[model_bcmd.TIMEOUT]])[0][0])
     
+    # optional surrogate screening of proposals: minimum plausibility and exploration
+    # rate, plus any earlier dsim results files to seed the emulator
+    config['screening'] = None
+    if 'surrogate' in job['header']:
+        spec = job['header']['surrogate'][0]
+        config['screening'] = { 'plausible': float(spec[0]) if len(spec) > 0 else surrogate.PLAUSIBLE,
+                                'explore': float(spec[1]) if len(spec) > 1 else surrogate.EXPLORE }
+    config['surrogate_seed'] = [ x for line in job['header'].get('surrogate_seed', []) for x in line ]
+    
     # ABC-SYSBIO distance funcs have the same names as ordinary ones but with suffix "Distance"
     # TODO: handle loglik sigma factory
     config['distance'] = getattr(distance, job['header'].get('distance', [[DISTANCE]])[0][0] + "Distance")
 
     return config
 
+# create the model wrapper -- separately from the rest, for use by distributed workers
+def setupModel ( modelname,
+                 program,
+                 times,
+                 vars,
+                 params,
+                 inputs,
+                 workdir,
+                 deleteWorkdir,
+                 baseSeq = [],
+                 timeout=model_bcmd.TIMEOUT,
+                 executor=None ):
+    return model_bcmd.model_bcmd( name=modelname, vars=vars, params=params,
+                                  inputs=inputs, times=times,
+                                  program=program, baseSeq=baseSeq,
+                                  workdir=workdir, deleteWorkdir=deleteWorkdir,
+                                  timeout=timeout, executor=executor )
+
 # set up elements ready to simulate
 # by this point any and all file parsing has taken place and default provided
 # -- we try not to enmesh this with a particular input structure, because duh
@@ -228,18 +264,26 @@ def setupABC ( modelname,
                beta=BETA,
                modelKernel=MODELKERNEL,
                distance=DISTANCE,
-               timeout=model_bcmd.TIMEOUT ):
+               timeout=model_bcmd.TIMEOUT,
+               nasync=NASYNC,
+               executor=None,
+               screening=None,       # surrogate.Screen settings, or None for no screening
+               seeds=[] ):           # dsim results files to seed the surrogate
     
-    model = model_bcmd.model_bcmd( name=modelname, vars=vars, params=params,
-                                   inputs=inputs, times=times,
-                                   program=program, baseSeq=baseSeq,
-                                   workdir=workdir, deleteWorkdir=deleteWorkdir,
-                                   timeout=timeout )
+    model = setupModel( modelname, program, times, vars, params, inputs,
+                        workdir, deleteWorkdir, baseSeq, timeout, executor )
     
     # it is not clear that we actually need a masked array, but...
     masked = numpy.transpose(numpy.ma.array( [ x['points'] for x in vars ] ))
     data = abcsbh.data.data( times, masked )
     
+    screens = None
+    if screening is not None:
+        screen = surrogate.forModel(model, **screening)
+        for filename in seeds:
+            print 'Seeded surrogate with %d simulations from %s' % (surrogate.seed(screen, filename, model, distance, data.values), filename)
+        screens = [ screen ]
+    
     io = abcsbh.input_output.input_output( abcIOname )
     io.create_output_folders([modelname], particles, pickling )
     
@@ -252,7 +296,9 @@ def setupABC ( modelname,
                                       modelKernel = modelKernel,
                                       debug = False,
                                       timing = False,
-                                      distancefn = distance )
+                                      distancefn = distance,
+                                      nasync = nasync,
+                                      surrogates = screens )
     
     return algorithm, io
 
@@ -266,12 +312,38 @@ def runABC ( algorithm, io, finalEpsilon, alpha ):
 # main entry point
 # provide a job file and a data file
 if __name__ == '__main__':
-    job, data = process_args()
+    job, data, broker, worker = process_args()
     config = process_inputs(job, data)
+    
+    # in worker mode, just run whatever the broker hands out
+    if worker:
+        model = setupModel( config['name'], config['program'], config['times'],
+                            config['vars'], config['params'], config['inputs'],
+                            distrib.workdir(config['model_io']), False,
+                            config['baseSeq'], config['timeout'] )
+        distrib.work(worker, distrib.simulation_task(model))
+        sys.exit()
+    
+    # async sampling runs its simulations as local processes, so it can't use workers
+    if broker and config['nasync'] > 0:
+        raise Exception('async sampling cannot be combined with --broker: set async: 0 to distribute batches')
+    
+    executor = None
+    if broker:
+        executor = distrib.RemoteSimulator(distrib.serve(broker))
+    
     algo, io = setupABC( config['name'], config['program'], config['times'],
                          config['vars'], config['params'], config['inputs'],
                          config['model_io'], False, True, config['abc_io'],
                          config['baseSeq'], config['particles'], config['nbatch'],
                          config['beta'], config['modelKernel'], config['distance'],
-                         config['timeout'] )
+                         config['timeout'], config['nasync'], executor,
+                         config['screening'], config['surrogate_seed'] )
     runABC( algo, io, [config['finalepsilon']], config['alpha'] )
+    
+    if algo.surrogates:
+        print algo.surrogates[0].report()
+    
+    if executor:
+        executor.broker.close()
+        print executor.broker.report()
@@ -2,6 +2,7 @@ import numpy
 from numpy import random as rnd
 
 import copy, time
+from multiprocessing import Queue
 
 import kernels
 import statistics
@@ -58,7 +59,8 @@ fit:
 """
 
 ## distances are stored as [nparticle][nbeta][d1, d2, d3 .... ]
-## trajectories are stored as [nparticle][nbeta][ species ][ times ]
+## trajectories are stored as [nparticle][nbeta][ times ][ species ]
+## -- usually in an input_output.trajectory_store, so they needn't be kept in memory
 
 class abcsmc_results:
     def __init__(self, 
@@ -75,8 +77,9 @@ class abcsmc_results:
         self.naccepted = naccepted
         self.sampled = sampled
         self.rate = rate
-        self.trajectories = copy.deepcopy(trajectories)
-        self.distances = copy.deepcopy(distances)
+        # these are built afresh for each population, so don't need copying
+        self.trajectories = trajectories
+        self.distances = distances
         self.margins = copy.deepcopy(margins)
         self.models = copy.deepcopy(models)
         self.weights = copy.deepcopy(weights)
@@ -100,7 +103,9 @@ class abcsmc:
                  kernel_type = 1,
                  kernelfn = kernels.getKernel,
                  kernelpdffn = kernels.getPdfParameterKernel,
-                 perturbfn = kernels.perturbParticle):
+                 perturbfn = kernels.perturbParticle,
+                 nasync = 0,      # particles to keep in flight asynchronously (each running beta simulations), or 0 for synchronous batches
+                 surrogates = None):  # per model surrogate.Screen (or None) to pre-screen proposals
         
         self.nmodel = len(models)
         self.models = copy.copy( models )
@@ -119,6 +124,7 @@ class abcsmc:
         self.margins_curr    = [0  for i in range(self.nmodel)] 
         
         self.b = [0  for i in range(0,nparticles)]
+        self.selection = [1.0  for i in range(0,nparticles)]   # probability of surrogate letting each particle through
         self.distances = []
         self.trajectories = []
 
@@ -126,17 +132,21 @@ class abcsmc:
         self.kernel_type = kernel_type
         self.kernelfn = kernels.getKernel
         self.kernelpdffn = kernels.getPdfParameterKernel
+        self.kernelpdfmatrixfn = kernels.getPdfParameterKernelMatrix
         self.perturbfn = kernels.perturbParticle
 
         self.beta = beta
         self.dead_models = []
         self.nbatch = nbatch
+        self.nasync = nasync
+        self.surrogates = surrogates
         self.debug = debug
         self.timing = timing
     
         self.modelprior = modelprior[:]
         self.modelKernel = modelKernel
         self.kernel_aux = [0 for i in range(0,nparticles)]
+        self.kernel_ids = numpy.zeros(nparticles, dtype=int)
 
         self.kernels = list()
         # self.kernels is a list of length the number of models
@@ -184,6 +194,7 @@ class abcsmc:
         all_start_time = time.time()
         for pop in range(len(epsilon)):
             start_time = time.time()
+            self.trajectories = io.trajectory_store(pop)
             if(pop==0 and self.sample_from_prior==True): 
                 results = self.iterate_one_population(epsilon[pop], prior=True)
             else:
@@ -220,6 +231,7 @@ class abcsmc:
             if final==True: done = True
 
             start_time = time.time()
+            self.trajectories = io.trajectory_store(pop)
             if(pop==0 and self.sample_from_prior==True): 
                 results = self.iterate_one_population(epsilon, prior=True)
             else:
@@ -291,13 +303,14 @@ class abcsmc:
 
         naccepted = 0
         sampled = 0
+        self.trajectories = io.trajectory_store()
 
         while(naccepted < self.nparticles):
             if self.debug == 2:print "\t****batch"
             sampled_models = self.sampleTheModelFromPrior()
             sampled_params = self.sampleTheParameterFromPrior(sampled_models)
                 
-            accepted_index, distances, traj = self.simulate_and_compare_to_data(sampled_models,sampled_params,this_epsilon=0,do_comp=False)
+            accepted_index, distances, traj, selection = self.simulate_and_compare_to_data(sampled_models,sampled_params,this_epsilon=0,do_comp=False)
 
             for i in range(self.nbatch):
                 if naccepted < self.nparticles:
@@ -312,8 +325,8 @@ class abcsmc:
                         self.parameters_curr[naccepted].append(sampled_params[i][p])
 
                     self.b[naccepted] = accepted_index[i]
-                    self.trajectories.append( copy.deepcopy(traj[i]) )
-                    self.distances.append( copy.deepcopy(distances[i]) )
+                    self.trajectories.append( traj[i] )
+                    self.distances.append( distances[i] )
                     
                     naccepted = naccepted + 1
 
@@ -335,37 +348,42 @@ class abcsmc:
         naccepted = 0
         sampled = 0
 
-        while(naccepted < self.nparticles):
-            if self.debug == 2:print "\t****batch"
-            if( prior == False):
-                sampled_models = self.sampleTheModel()
-                sampled_params = self.sampleTheParameter(sampled_models)
-            else:
-                sampled_models = self.sampleTheModelFromPrior()
-                sampled_params = self.sampleTheParameterFromPrior(sampled_models)
+        if self.nasync > 0:
+            naccepted, sampled = self.sample_population_async(next_epsilon, prior)
+
+        else:
+            while(naccepted < self.nparticles):
+                if self.debug == 2:print "\t****batch"
+                if( prior == False):
+                    sampled_models = self.sampleTheModel()
+                    sampled_params = self.sampleTheParameter(sampled_models)
+                else:
+                    sampled_models = self.sampleTheModelFromPrior()
+                    sampled_params = self.sampleTheParameterFromPrior(sampled_models)
                 
-            accepted_index, distances, traj = self.simulate_and_compare_to_data(sampled_models,sampled_params,next_epsilon)
+                accepted_index, distances, traj, selection = self.simulate_and_compare_to_data(sampled_models,sampled_params,next_epsilon)
 
-            for i in range(self.nbatch):
-                if naccepted < self.nparticles:
-                    sampled = sampled + 1
+                for i in range(self.nbatch):
+                    if naccepted < self.nparticles:
+                        sampled = sampled + 1
 
-                if naccepted < self.nparticles and accepted_index[i] > 0 : 
+                    if naccepted < self.nparticles and accepted_index[i] > 0 : 
                     
-                    self.model_curr[naccepted] = sampled_models[i]
-                    if self.debug == 2:print "\t****accepted", i, accepted_index[i], sampled_models[i]
+                        self.model_curr[naccepted] = sampled_models[i]
+                        if self.debug == 2:print "\t****accepted", i, accepted_index[i], sampled_models[i]
                     
-                    for p in range( self.models[ sampled_models[i] ].nparameters ):
-                        self.parameters_curr[naccepted].append(sampled_params[i][p])
+                        for p in range( self.models[ sampled_models[i] ].nparameters ):
+                            self.parameters_curr[naccepted].append(sampled_params[i][p])
 
-                    self.b[naccepted] = accepted_index[i]
-                    self.trajectories.append( copy.deepcopy(traj[i]) )
-                    self.distances.append( copy.deepcopy(distances[i]) )
+                        self.b[naccepted] = accepted_index[i]
+                        self.selection[naccepted] = selection[i]
+                        self.trajectories.append( traj[i] )
+                        self.distances.append( distances[i] )
                     
-                    naccepted = naccepted + 1
+                        naccepted = naccepted + 1
 
             
-            if self.debug == 2:print "\t****end  batch naccepted/sampled:", naccepted,  sampled
+                if self.debug == 2:print "\t****end  batch naccepted/sampled:", naccepted,  sampled
 
         # Finished loop over particles
         if self.debug == 2:print "**** end of population naccepted/sampled:", naccepted,  sampled
@@ -374,7 +392,7 @@ class abcsmc:
             self.computeParticleWeights()
         else:
             for i in range(self.nparticles):
-                self.weights_curr[i] = self.b[i]
+                self.weights_curr[i] = self.b[i] / self.selection[i]
         
         self.normalizeWeights()
         self.modelMarginals()
@@ -401,6 +419,7 @@ class abcsmc:
         self.margins_curr    = [0  for j in range(0,self.nmodel)] 
 
         self.b = [0  for i in range(0,self.nparticles)]
+        self.selection = [1.0  for i in range(0,self.nparticles)]
 
         #
         # Check for dead models
@@ -428,13 +447,17 @@ class abcsmc:
 
             else:
                 # only update the kernels if there are > 5 particles
-                if len(this_model_index) > 5:
+                # -- except for the local kernels, which must match the population particle for particle
+                if len(this_model_index) > 5 or (self.kernel_type in (4, 5) and len(this_model_index) > 0):
                     for it in range(len(this_model_index)):
                         this_population[it,:] = self.parameters_prev[ this_model_index[it] ][:]
                         this_weights[it] = self.weights_prev[ this_model_index[it] ]
                     tmp_kernel = self.kernelfn( self.kernel_type, self.kernels[mod], this_population, this_weights )
                     self.kernels[mod] = tmp_kernel[:]
 
+            # position of each particle within its model's population, for indexing the local kernels
+            self.kernel_ids[this_model_index] = numpy.arange(len(this_model_index))
+
         #
         # Kernel auxilliary information
         #
@@ -478,6 +501,10 @@ class abcsmc:
             for j in range( len(particle_data[4][i])):
                 self.kernels[i].append( particle_data[4][i][j] )
         
+        for mod in range(self.nmodel):
+            this_model_index = numpy.arange(len(self.model_prev))[ numpy.array(self.model_prev) == mod ]
+            self.kernel_ids[this_model_index] = numpy.arange(len(this_model_index))
+        
         self.sample_from_prior = False
 
     def simulate_and_compare_to_data(self, sampled_models, sampled_params, this_epsilon, do_comp=True):
@@ -485,6 +512,7 @@ class abcsmc:
         if self.debug == 2:print '\t\t\t***simulate_and_compare_to_data'
 
         ret = [0 for it in range(self.nbatch)]
+        selection = [1.0 for it in range(self.nbatch)]
         traj = [[] for it in range(self.nbatch) ]
         distances = [[] for it in range(self.nbatch)]
     
@@ -506,7 +534,27 @@ class abcsmc:
                 for i in range(n_to_simulate):
                     this_model_parameters.append( sampled_params[ mapping[i] ])
 
+                # proposals ruled out by the surrogate are rejected without simulating,
+                # and those let through record how likely that was, to correct their weights
+                screen = self.surrogates[ m ] if self.surrogates else None
+                if screen and do_comp:
+                    keep, prob = screen.select( this_model_parameters, this_epsilon )
+                    for i in numpy.nonzero(keep)[0]:
+                        selection[ mapping[i] ] = prob[i]
+                    mapping = mapping[ keep ]
+                    this_model_parameters = [ this_model_parameters[i] for i in numpy.nonzero(keep)[0] ]
+                    n_to_simulate = len( mapping )
+                    if n_to_simulate == 0:
+                        continue
+
                 #print "this_model_parameters", this_model_parameters
+                # where the model supports it, have hopeless simulations abandoned early
+                if hasattr(self.models[ m ], 'setBailout'):
+                    if do_comp and len(this_epsilon) == 1:
+                        self.models[ m ].setBailout(this_epsilon[0], self.distancefn)
+                    else:
+                        self.models[ m ].setBailout(None)
+                
                 sims = self.models[ m ].simulate( this_model_parameters, self.data.timepoints, n_to_simulate, self.beta )
                 if self.debug == 2:print '\t\t\tsimulation dimensions:', sims.shape
                 
@@ -533,23 +581,144 @@ class abcsmc:
                             
                         if self.debug == 2:print '\t\t\tdistance/this_epsilon/mapping/b:', distance, this_epsilon, mapping[i], ret[mapping[i]]
 
-                    traj[ mapping[i] ] = copy.deepcopy( this_traj )
-                    distances[ mapping[i] ] = copy.deepcopy( this_dist )
+                    traj[ mapping[i] ] = this_traj
+                    distances[ mapping[i] ] = this_dist
+
+                if screen and do_comp:
+                    screen.update( this_model_parameters, [ distances[ mapping[i] ] for i in range(n_to_simulate) ] )
                 
-        return ret[:], distances, traj    
+        return ret[:], distances, traj, selection
+
+    # asynchronous alternative to the batch loop in iterate_one_population, for models
+    # that support it (see model_bcmd.submit): keeps nasync particles in flight (so up
+    # to nasync * beta simulations), proposing a new particle as soon as one finishes,
+    # so cores don't sit idle waiting for the slowest simulation of a batch
+    # the model handles duplicates, caching and shared snapshots as for simulate
+    # results are processed as they arrive, but proposals are accepted strictly in the
+    # order they were made -- otherwise the population would be biased towards particles
+    # whose simulations happen to run quickly -- and the population is complete once the
+    # first nparticles proposals to be accepted are known, the rest being abandoned
+    def sample_population_async(self, next_epsilon, prior):
+        if self.debug == 2:print "\t****async sampling"
+
+        queue = Queue()
+        proposals = {}                  # proposal number -> details, in submission order
+        slots = {}                      # simulation slot in use -> proposal number
+        free = range(self.nasync)
+        submitted = 0
+        committed = 0
+        naccepted = 0
 
-    def sampleTheModelFromPrior(self):
-        ret = [0 for it in range(self.nbatch)]
+        for m in range(self.nmodel):
+            if hasattr(self.models[ m ], 'setBailout') and len(next_epsilon) == 1:
+                self.models[ m ].setBailout(next_epsilon[0], self.distancefn)
+
+        while naccepted < self.nparticles:
+            # top up the simulations in flight
+            while free:
+                slot = free.pop()
+                if prior == False:
+                    sampled_models = self.sampleTheModel(1)
+                    sampled_params = self.sampleTheParameter(sampled_models, 1)
+                else:
+                    sampled_models = self.sampleTheModelFromPrior(1)
+                    sampled_params = self.sampleTheParameterFromPrior(sampled_models, 1)
+
+                m = sampled_models[0]
+
+                # proposals ruled out by the surrogate are rejected without simulating,
+                # leaving the slot free for the next
+                screen = self.surrogates[ m ] if self.surrogates else None
+                selection = 1.0
+                if screen:
+                    keep, prob = screen.select( sampled_params, next_epsilon )
+                    if not keep[0]:
+                        proposals[submitted] = { 'model': m, 'params': sampled_params[0], 'procs': [],
+                                                 'accepted': 0, 'distances': [], 'traj': [] }
+                        submitted += 1
+                        free.append(slot)
+                        continue
+                    selection = prob[0]
+
+                procs = self.models[ m ].submit(queue, slot, sampled_params[0], self.beta)
+                proposals[submitted] = { 'model': m, 'params': sampled_params[0], 'procs': procs,
+                                         'sims': [ None for k in range(self.beta) ], 'selection': selection }
+                slots[slot] = submitted
+                submitted += 1
+
+            # wait for any simulation to finish
+            partial = queue.get()
+            number = slots[partial['n']]
+            prop = proposals[number]
+            prop['sims'][partial.get('beta', 0)] = partial['data']
+
+            if any([ x is None for x in prop['sims'] ]):
+                continue
+
+            # all the replicates are done, so the slot is free again
+            for proc in prop['procs']:
+                proc.join()
+            del slots[partial['n']]
+            free.append(partial['n'])
+
+            # let the model cache the results and pass them on to any duplicates
+            if hasattr(self.models[ prop['model'] ], 'collect'):
+                self.models[ prop['model'] ].collect(queue, partial['n'], prop['params'], numpy.array(prop['sims']))
+
+            prop['accepted'] = 0
+            prop['distances'] = []
+            prop['traj'] = []
+            for k in range(self.beta):
+                points = howToFitData( self.models[ prop['model'] ].fit, prop['sims'][k] )
+                distance = self.distancefn(points, self.data.values, prop['params'], prop['model'])
+                if evaluateDistance(distance, next_epsilon ):
+                    prop['accepted'] += 1
+                prop['distances'].append( distance )
+                prop['traj'].append( points )
+
+            screen = self.surrogates[ prop['model'] ] if self.surrogates else None
+            if screen:
+                screen.update( [ prop['params'] ], [ prop['distances'] ] )
+
+            # commit any completed proposals that are next in line
+            while committed in proposals and 'accepted' in proposals[committed] and naccepted < self.nparticles:
+                prop = proposals.pop(committed)
+                committed += 1
+
+                if prop['accepted'] > 0:
+                    self.model_curr[naccepted] = prop['model']
+                    if self.debug == 2:print "\t****accepted", committed - 1, prop['accepted'], prop['model']
+
+                    self.parameters_curr[naccepted] = prop['params'][:]
+                    self.b[naccepted] = prop['accepted']
+                    self.selection[naccepted] = prop['selection']
+                    self.trajectories.append( prop['traj'] )
+                    self.distances.append( prop['distances'] )
+
+                    naccepted = naccepted + 1
+
+        # proposals made after the last accepted one are no longer needed
+        for prop in proposals.values():
+            self.models[ prop['model'] ].cancel(prop['procs'])
+
+        if self.debug == 2:print "\t****end async sampling naccepted/sampled:", naccepted, committed
+
+        return naccepted, committed
+
+    def sampleTheModelFromPrior(self, count=None):
+        if count is None: count = self.nbatch
+        ret = [0 for it in range(count)]
         if self.nmodel > 1:
-            for i in range(self.nbatch):
+            for i in range(count):
                 ret[i] = statistics.w_choice( range(self.nmodel), self.modelprior )
         
         return ret[:]
    
-    def sampleTheParameterFromPrior(self, sampled_models):
+    def sampleTheParameterFromPrior(self, sampled_models, count=None):
+        if count is None: count = self.nbatch
         ret = []
  
-        for i in range(self.nbatch):
+        for i in range(count):
             #print "sampleTheParameterFromPrior", i, sampled_models[i], self.models[ sampled_models[i] ].name, self.models[ sampled_models[i] ].nparameters
 
             reti = [ 0 for it in range(self.models[ sampled_models[i] ].nparameters) ]
@@ -575,17 +744,18 @@ class abcsmc:
         return [x[:] for x in ret]
 
 
-    def sampleTheModel(self):
-        ret = [0 for it in range(self.nbatch)]
+    def sampleTheModel(self, count=None):
+        if count is None: count = self.nbatch
+        ret = [0 for it in range(count)]
     
         if self.nmodel > 1:
-            for i in range(self.nbatch):
+            for i in range(count):
                 ret[i] = statistics.w_choice( range(self.nmodel), self.margins_prev )
 
             if( len(self.dead_models) < self.nmodel-1 ):
             #if(0): 
                 # perturb models
-                for i in range(self.nbatch):
+                for i in range(count):
                     u = rnd.uniform(low=0, high=1)
                     if u > self.modelKernel:
                         # sample randomly from other (non dead) models
@@ -601,11 +771,12 @@ class abcsmc:
                         ret[i] = perturbed_model
         return ret[:]
     
-    def sampleTheParameter(self, sampled_models):
+    def sampleTheParameter(self, sampled_models, count=None):
+        if count is None: count = self.nbatch
         if self.debug == 2:print "\t\t\t***sampleTheParameter"
         ret = []
         
-        for i in range(self.nbatch):
+        for i in range(count):
             np = self.models[ sampled_models[i] ].nparameters
             reti = [ 0 for it in range(np) ]
 
@@ -621,7 +792,7 @@ class abcsmc:
                     #print reti[nn], self.parameters_prev[ p ][nn]
                     reti[nn] = self.parameters_prev[ p ][nn]
                 
-                prior_prob = self.perturbfn( reti, self.models[ sampled_models[i] ].prior, self.kernels[sampled_models[i]], self.kernel_type, self.special_cases[sampled_models[i]] )
+                prior_prob = self.perturbfn( reti, self.models[ sampled_models[i] ].prior, self.kernels[sampled_models[i]], self.kernel_type, self.special_cases[sampled_models[i]], self.kernel_ids[p] )
 
                 if self.debug == 2:print "\t\t\tsampled p prob:", prior_prob
                 if self.debug == 2:print "\t\t\tnew:", reti
@@ -634,56 +805,47 @@ class abcsmc:
     def computeParticleWeights(self):
         if self.debug == 2:print "\t***computeParticleWeights"
 
-        for k in range(self.nparticles):
-            this_model = self.model_curr[k]
-            this_param = self.parameters_curr[k]
-            
-            # calculate model prior probility 
-            mprob = self.modelprior[ this_model ]
-
-            np = len(self.parameters_curr[k])
-            # particle prior probability
-            pprob = 1
-            for n in range(0,np):
-                x = 1.0
-                if self.models[ this_model ].prior[n][0]==0:
-                    x=1
-
-                if self.models[ this_model ].prior[n][0]==1: 
-                    x=statistics.getPdfGauss(self.models[ this_model ].prior[n][1],
-                                             numpy.sqrt(self.models[ this_model ].prior[n][2]),
-                                             this_param[n])
-                
-                if self.models[ this_model ].prior[n][0]==2: 
-                    x=statistics.getPdfUniform(self.models[ this_model ].prior[n][1],
-                                               self.models[ this_model ].prior[n][2],
-                                               this_param[n])
-    
-                if self.models[ this_model ].prior[n][0]==3: 
-                    x=statistics.getPdfLognormal(self.models[ this_model ].prior[n][1],
-                                                 numpy.sqrt(self.models[ this_model ].prior[n][2]),
-                                                 this_param[n])
-                pprob = pprob*x
+        # the particles are processed a model at a time, with the kernel pdfs for all
+        # pairs of current and previous particles evaluated as a single matrix
+        model_curr = numpy.array(self.model_curr, dtype=int)
+        model_prev = numpy.array(self.model_prev, dtype=int)
+        weights_prev = numpy.array(self.weights_prev, dtype=float)
 
-            numer = self.b[k] * mprob * pprob
-        
-            denom_m = 0
-            for i in range(self.nmodel):
-                denom_m = denom_m + self.margins_prev[i]*getPdfModelKernel(this_model, i, self.modelKernel, self.nmodel, self.dead_models)
-            denom = 0
-            # print "Calculating denom\t", selected_model, sampleParameters
-            for j in range(self.nparticles):
+        for m in range(self.nmodel):
+            curr = numpy.arange(self.nparticles)[model_curr == m]
+            if len(curr) == 0:
+                continue
+            prev = numpy.arange(self.nparticles)[model_prev == m]
+
+            # calculate model prior probility 
+            mprob = self.modelprior[ m ]
 
-                if(int(this_model) == int(self.model_prev[j]) ):
-                    # print "\t", j, model_prev[j], weights_prev[j], parameters_prev[j]
-                    if self.debug == 2:
-                        print "\tj, weights_prev, kernelpdf", j, self.weights_prev[j],
-                        self.kernelpdffn(this_param, self.parameters_prev[j], self.models[this_model].prior, self.kernels[this_model], self.kernel_aux[j], self.kernel_type )
-                    denom = denom + self.weights_prev[j] * self.kernelpdffn(this_param, self.parameters_prev[j], self.models[this_model].prior, self.kernels[this_model], self.kernel_aux[j], self.kernel_type )
+            # particle prior probabilities
+            this_params = numpy.array([ self.parameters_curr[k] for k in curr ], dtype=float)
+            pprob = kernels.getPdfPriorVector(this_params, self.models[ m ].prior)
 
-                if self.debug == 2: print "\tnumer/denom_m/denom/m(t-1) : ", numer,denom_m, denom, self.margins_prev[this_model]
+            # particles the surrogate only let through by chance count for correspondingly more
+            numer = numpy.array([ self.b[k] / self.selection[k] for k in curr ]) * mprob * pprob
 
-            self.weights_curr[k] = numer/(denom_m*denom/self.margins_prev[this_model])
+            denom_m = 0
+            for i in range(self.nmodel):
+                denom_m = denom_m + self.margins_prev[i]*getPdfModelKernel(m, i, self.modelKernel, self.nmodel, self.dead_models)
+
+            denom = numpy.zeros(len(curr))
+            if len(prev):
+                kern = self.kernelpdfmatrixfn(this_params,
+                                              [ self.parameters_prev[j] for j in prev ],
+                                              self.models[m].prior,
+                                              self.kernels[m],
+                                              [ self.kernel_aux[j] for j in prev ],
+                                              self.kernel_type )
+                denom = numpy.dot(kern, weights_prev[prev])
+
+            if self.debug == 2: print "\tnumer/denom_m/denom/m(t-1) : ", numer,denom_m, denom, self.margins_prev[m]
+
+            weights = numer/(denom_m*denom/self.margins_prev[m])
+            for ii in range(len(curr)):
+                self.weights_curr[curr[ii]] = weights[ii]
         
     def normalizeWeights(self):
         n = sum( self.weights_curr )
@@ -4,16 +4,110 @@ import os, os.path
 import sys, pickle
 import numpy
 
+# number of particles per trajectory chunk file
+CHUNK = 100
+
+# chunked binary store for particle trajectories, so that a population's simulation
+# results can be written out as they are accepted rather than all held in memory
+# each particle's entry is an array of [nbeta][ times ][ species ]; particles whose
+# entries have the same shape (ie, from the same model) share chunk files, and an index
+# records where each one went, so that they can be read back individually without
+# loading the rest -- an existing store is opened for reading
+class trajectory_store:
+
+    def __init__(self, folder, chunk=CHUNK):
+        self.folder = folder
+        self.chunk = chunk
+        self.shapes = []            # entry shape for each chunk group
+        self.buffers = []           # pending entries for each group
+        self.nchunks = []           # chunks written for each group
+        self.index = []             # (group, chunk, row) for each particle
+        self.cached = (None, None)
+        
+        indexname = os.path.join(folder, 'index.npy')
+        if os.path.exists(indexname):
+            self.index = [ tuple(x) for x in numpy.load(indexname) ]
+            self.shapes = [ tuple(x) for x in numpy.load(os.path.join(folder, 'shapes.npy')) ]
+            self.buffers = [ [] for x in self.shapes ]
+            self.nchunks = [ max([ k for g, k, r in self.index if g == x ]) + 1 for x in range(len(self.shapes)) ]
+        elif not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def chunkname(self, group, chunk):
+        return os.path.join(self.folder, 'group_%d_chunk_%d.npy' % (group, chunk))
+
+    # add a particle's trajectories -- a list of beta arrays, as produced by abcsmc
+    def append(self, traj):
+        arr = numpy.asarray(traj, dtype=float)
+        if arr.shape in self.shapes:
+            group = self.shapes.index(arr.shape)
+        else:
+            group = len(self.shapes)
+            self.shapes.append(arr.shape)
+            self.buffers.append([])
+            self.nchunks.append(0)
+        
+        self.index.append((group, self.nchunks[group], len(self.buffers[group])))
+        self.buffers[group].append(arr)
+        if len(self.buffers[group]) >= self.chunk:
+            self.flush(group)
+
+    def flush(self, group):
+        if self.buffers[group]:
+            numpy.save(self.chunkname(group, self.nchunks[group]), numpy.array(self.buffers[group]))
+            self.nchunks[group] += 1
+            self.buffers[group] = []
+
+    # write out any pending entries and the index
+    def close(self):
+        for group in range(len(self.shapes)):
+            self.flush(group)
+        numpy.save(os.path.join(self.folder, 'index.npy'), numpy.array(self.index, dtype=int).reshape(-1, 3))
+        numpy.save(os.path.join(self.folder, 'shapes.npy'), numpy.array(self.shapes, dtype=int))
+
+    def __len__(self):
+        return len(self.index)
+
+    # entries are read back on demand, memory mapping the chunk they're in
+    def __getitem__(self, i):
+        group, chunk, row = self.index[i]
+        if chunk == self.nchunks[group]:
+            return self.buffers[group][row]
+        
+        if self.cached[0] != (group, chunk):
+            self.cached = ((group, chunk), numpy.load(self.chunkname(group, chunk), mmap_mode='r'))
+        return self.cached[1][row]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class input_output:
     
     def __init__(self, folder):
         self.folder = os.path.abspath(folder)
 
+    # open the trajectory store for a population, or for a run_simulations batch
+    # if population is None -- if it already exists, this can be used to read it back
+    def trajectory_store(self, population=None):
+        if population is None:
+            return trajectory_store(os.path.join(self.folder, 'trajectories'))
+        return trajectory_store(os.path.join(self.folder, 'traj_Population_%d' % (population + 1)))
+
+    # make sure the trajectories have been written to a store
+    def close_trajectories(self, population, trajectories):
+        if isinstance(trajectories, trajectory_store):
+            trajectories.close()
+        else:
+            store = self.trajectory_store(population)
+            for traj in trajectories:
+                store.append(traj)
+            store.close()
+
     # write rates, distances, trajectories    
     def write_data(self, population, results, timing, models, data):
         
-        beta = len(results.trajectories[0])
-        
         with open(os.path.join(self.folder, 'rates.txt'),"a") as rate_file:
             print >> rate_file, population+1, results.epsilon, results.sampled, results.rate, round(timing,2)
 
@@ -23,17 +117,8 @@ class input_output:
                 for j in range(len(results.distances[i])):
                     print >> distance_file, i+1, j, results.distances[i][j], results.models[i]
 
-        # trajectories are stored as [nparticle][nbeta][ species ][ times ]
-        with open(os.path.join(self.folder, 'traj_Population_%d.txt' % (population + 1)), 'a') as traj_file:
-            for i in range(len(results.trajectories)):
-                for j in range(len(results.trajectories[i])): 
-                    arr = results.trajectories[i][j]
-                    nrow, ncol = numpy.shape( arr )
-                    for ic in range(ncol):
-                        print >> traj_file, i, j, results.models[i], ic, 
-                        for ir in range(nrow):
-                            print >> traj_file, arr[ir,ic],
-                        print >> traj_file, ""
+        # trajectories are stored as [nparticle][nbeta][ times ][ species ]
+        self.close_trajectories(population, results.trajectories)
 
         if len(results.margins) > 1:
             with open(os.path.join(self.folder, 'ModelDistribution.txt'), 'a') as model_file:
@@ -78,19 +163,9 @@ class input_output:
     def write_data_simulation(self, population, results, timing, models, data):
 
         nparticles = len(results.trajectories)
-        beta = len(results.trajectories[0])
 
-        # trajectories are stored as [nparticle][nbeta][ species ][ times ]
-        with open(os.path.join(self.folder, 'trajectories.txt'), 'a') as traj_file:
-            for i in range(nparticles):
-                for j in range(beta): 
-                    arr = results.trajectories[i][j]
-                    nrow, ncol = numpy.shape( arr )
-                    for ic in range(ncol):
-                        print >> traj_file, i, j, results.models[i], ic, 
-                        for ir in range(nrow):
-                            print >> traj_file, arr[ir,ic],
-                        print >> traj_file, ""
+        # trajectories are stored as [nparticle][nbeta][ times ][ species ]
+        self.close_trajectories(None, results.trajectories)
 
         # dump out all the parameters
         with open(os.path.join(self.folder, 'particles.txt'), 'a') as param_file:
@@ -9,6 +9,7 @@
 import numpy
 from numpy import random as rnd
 from scipy.stats import norm
+from scipy.linalg import solve_triangular
 import statistics
 
 
@@ -22,7 +23,6 @@ import statistics
 # populations, weights refers to particles and weights from previous population for one model
 def getKernel(kernel_type, kernel, population, weights):
     pop_size = population.shape[0]
-    npar = population.shape[1]
 
     if kernel_type == 1:
     # component-wise uniform kernels
@@ -70,59 +70,29 @@ def getKernel(kernel_type, kernel, population, weights):
     if kernel_type == 4:
         # multi-variate normal kernel whose covariance is based on the K nearest neighbours of the particle
         k=int(kernel[1])
-        D={}
-        pop=list()
         if pop_size == 1:
             print "WARNING: getKernel : only one particle so adaptation is not possible"
-            pop_cur=list()
-            for param in range(npar):
-                pop_cur.append(population[0,param])
-                D[str(pop_cur)]=2*numpy.eye(len(kernel[0]))
+            D=2*numpy.eye(len(kernel[0]))[numpy.newaxis,:,:]
         else:
             # to compute the neighbours, restrain the population to the non constant parameters
-            for param in kernel[0]:
-                pop.append(population[:,param])
-            for n in range(pop_size):
-                # compute the index of the neighbours
-                kset = statistics.kNearestNeighEuc(n,pop,k)
-                # save the coordinate of the particule (with all componants)
-                pop_cur=list()            
-                for param in range(npar):
-                    pop_cur.append(population[n,param])
-                # construct the list of the neighbours given kset (restrained to the non constant components) and the corresponding weights
-                subpop=list()
-                subwei=list()
-                for param in range(0, len(pop)):
-                    subpop.append([])
-                    for j in range(len(kset)):
-                        subpop[param].append(pop[param][kset[j]])
-                for j in range(len(kset)):
-                    subwei.append(weights[kset[j]])
-                # compute the covariance and write it into the dictionnary
-                D[str(pop_cur)]=2*statistics.compute_cov(subpop,subwei)
+            pop=population[:,kernel[0]]
+            weights=numpy.asarray(weights, dtype=float)
+            # neighbours of all the particles at once, from a single KD-tree
+            kset = statistics.kNearestNeighTree(pop,k)
+            D=2*statistics.compute_cov_batch(pop[kset], weights[kset])
         kernel[2]=D
-	# kernel[2] is a dictionnary with pop_size keys. Each key is string(p) where p is a particle (with nparam dimension) of the previous population. The element of the dictionnary for a given key is a covaraince matrix of size len(kernel[0])*len(kernel[0])
+	# kernel[2] is an array of pop_size covariance matrices, each of size len(kernel[0])*len(kernel[0]), indexed by the position of the particle in the population
 
     if kernel_type==5:
         # multi-variate normal kernel whose covariance is the OCM
-        pop=list()
-        D={}
         if pop_size == 1:
             print "WARNING: getKernel : only one particle so adaptation is not possible"
-            pop_cur=list()
-            for param in range(npar):
-                pop_cur.append(population[0,param])
-                D[str(pop_cur)]=2*numpy.eye(len(kernel[0]))
+            D=2*numpy.eye(len(kernel[0]))[numpy.newaxis,:,:]
         else:
-            for param in kernel[0]:
-                pop.append(population[:,param])
-            for n in range(pop_size):
-                pop_cur=list()
-                for param in range(npar):
-                    pop_cur.append(population[n, param])
-                D[str(pop_cur)]=statistics.compute_optcovmat(pop, weights,pop_cur)
+            pop=population[:,kernel[0]]
+            D=statistics.compute_optcovmat_batch(pop, numpy.asarray(weights, dtype=float), pop)
         kernel[2]=D
-	# kernel[2] is a dictionnary with pop_size keys. Each key is string(p) where p is a particle (with nparam dimension) of the previous population. The element of the dictionnary for a given key is a covaraince matrix of size len(kernel[0])*len(kernel[0])
+	# kernel[2] is an array of pop_size covariance matrices, each of size len(kernel[0])*len(kernel[0]), indexed by the position of the particle in the population
 
     return kernel
 
@@ -131,7 +101,8 @@ def getKernel(kernel_type, kernel, population, weights):
 
 # Here params refers to one particle
 # The function changes params in place and returns the probability (which may be zero)
-def perturbParticle(params, priors, kernel, kernel_type, special_cases):
+# For kernel types 4 and 5, index is the position of the particle in the population the kernel was built from
+def perturbParticle(params, priors, kernel, kernel_type, special_cases, index=None):
     np = len( priors )
     prior_prob = 1
 
@@ -203,7 +174,7 @@ def perturbParticle(params, priors, kernel, kernel_type, special_cases):
             for n in kernel[0]:
                 mean.append(params[n])
             D=kernel[2]
-            tmp = statistics.mvnd_gen(mean,D[str(params)] )
+            tmp = statistics.mvnd_gen(mean,D[index] )
             ind=0
             for n in kernel[0]: 
                 params[n] = tmp[ind]
@@ -231,7 +202,8 @@ def perturbParticle(params, priors, kernel, kernel_type, special_cases):
 
 # Here params and params0 refer to one particle each.
 # Auxilliary is a vector size of nparameters
-def getPdfParameterKernel(params, params0, priors, kernel, auxilliary, kernel_type):
+# For kernel types 4 and 5, index is the position of params0 in the population the kernel was built from
+def getPdfParameterKernel(params, params0, priors, kernel, auxilliary, kernel_type, index=None):
     if kernel_type==1:
         prob=1
 	# n refers to the index of the parameter (integer between 0 and np-1)
@@ -274,7 +246,7 @@ def getPdfParameterKernel(params, params0, priors, kernel, auxilliary, kernel_ty
         for n in kernel[0]:
               p0.append(params0[n])
               p.append(params[n])
-       	kern = statistics.getPdfMultinormal(p0,D[str(params0)],p)
+       	kern = statistics.getPdfMultinormal(p0,D[index],p)
 	kern = kern/auxilliary
 	return kern
     
@@ -283,8 +255,11 @@ def getPdfParameterKernel(params, params0, priors, kernel, auxilliary, kernel_ty
 def getAuxilliaryInfo(kernel_type, models, parameters, model_objs, kernel ):
     nparticles = len(parameters)
     ret = []
+    # position of each particle within its model's population, which indexes the type 4/5 kernels
+    index = {}
 
     for k in range(nparticles):
+        index[models[k]] = index.get(models[k], -1) + 1
         ##print 'model:', models[k]
         this_prior = model_objs[models[k]].prior
         this_kernel = kernel[models[k]]
@@ -342,11 +317,8 @@ def getAuxilliaryInfo(kernel_type, models, parameters, model_objs, kernel ):
 		    low.append(0)
 		    up.append(float('inf'))
                 mean.append(parameters[k][n])
-            cur_part=list()
-            for n in range(nparam):
-                cur_part.append(parameters[k][n])
             D = this_kernel[2]
-            scale=D[str(cur_part)]
+            scale=D[index[models[k]]]
             ret.append(statistics.mvnormcdf(low,up,mean, scale))                
         else:
             ret = [0 for i in  range(nparticles)]
@@ -357,3 +329,136 @@ def getAuxilliaryInfo(kernel_type, models, parameters, model_objs, kernel ):
 
 
 
+
+# -- vectorised kernel evaluation, for computing the weights of a whole population at once
+
+# number of rows of the kernel matrix to evaluate at a time, to bound memory use
+CHUNK = 1000
+
+# kernel matrices larger than this (in elements) are evaluated in parallel
+PARALLEL_SIZE = 1e6
+
+# factorise a multivariate normal covariance for repeated pdf evaluation
+# the returned dictionary holds the Cholesky factor L if cov is positive definite,
+# and otherwise its inverse -- mimicking statistics.getPdfMultinormal, which may
+# well produce nonsense in that case, but at least consistent nonsense
+def factorMultinormal(cov):
+    cov = numpy.atleast_2d(cov)
+    factor = { 'k': cov.shape[0] }
+    try:
+        L = numpy.linalg.cholesky(cov)
+        factor['L'] = L
+        factor['logdet'] = 2 * numpy.sum(numpy.log(numpy.diag(L)))
+    except numpy.linalg.LinAlgError:
+        factor['inv'] = numpy.linalg.inv(cov)
+        factor['logdet'] = numpy.log(numpy.linalg.det(cov))
+    factor['lognorm'] = -0.5 * (factor['k'] * numpy.log(2 * numpy.pi) + factor['logdet'])
+    return factor
+
+# log pdf of a factorised multivariate normal at each row of diffs (ie, x - mean)
+def logPdfMultinormal(diffs, factor):
+    if 'L' in factor:
+        z = solve_triangular(factor['L'], diffs.T, lower=True)
+        a = numpy.sum(z * z, axis=0)
+    else:
+        a = numpy.sum(numpy.dot(diffs, factor['inv']) * diffs, axis=1)
+    return factor['lognorm'] - 0.5 * a
+
+# log pdf matrix of a factorised multivariate normal, with rows x [M x k]
+# and means y [N x k] -- via the expansion of the quadratic form, so that no
+# [M x N x k] array of differences is needed
+def logPdfMultinormalMatrix(x, y, factor):
+    if 'L' in factor:
+        zx = solve_triangular(factor['L'], x.T, lower=True).T
+        zy = solve_triangular(factor['L'], y.T, lower=True).T
+        a = numpy.sum(zx * zx, axis=1)[:,numpy.newaxis] + numpy.sum(zy * zy, axis=1) - 2 * numpy.dot(zx, zy.T)
+        a = numpy.maximum(a, 0)
+    else:
+        ax = numpy.dot(x, factor['inv'])
+        a = numpy.sum(ax * x, axis=1)[:,numpy.newaxis] + numpy.sum(numpy.dot(y, factor['inv']) * y, axis=1) - 2 * numpy.dot(ax, y.T)
+    return factor['lognorm'] - 0.5 * a
+
+# as getPdfParameterKernel, but for arrays of particles: params is [M x np] and params0
+# is [N x np], with auxilliary the corresponding N entries -- for kernel types 4 and 5,
+# params0 must be the whole population the kernel was built from, in the same order
+# returns an [M x N] matrix of kernel pdf values
+def getPdfParameterKernelMatrix(params, params0, priors, kernel, auxilliary, kernel_type):
+    params = numpy.atleast_2d(numpy.asarray(params, dtype=float))
+    p0 = numpy.atleast_2d(numpy.asarray(params0, dtype=float))
+    idx = list(kernel[0])
+    M = params.shape[0]
+    N = p0.shape[0]
+
+    if M * N > PARALLEL_SIZE and M > CHUNK:
+        return parallelPdfParameterKernelMatrix(params, params0, priors, kernel, auxilliary, kernel_type)
+
+    result = numpy.ones((M, N))
+    if not idx:
+        return result
+
+    if kernel_type == 1:
+        for ind in range(len(idx)):
+            n = idx[ind]
+            lo = p0[:,n] + kernel[2][ind][0]
+            hi = p0[:,n] + kernel[2][ind][1]
+            inside = (params[:,n][:,numpy.newaxis] >= lo) & (params[:,n][:,numpy.newaxis] <= hi)
+            result *= numpy.where(inside, 1/(hi - lo), 0.0)
+
+    elif kernel_type == 2:
+        aux = numpy.asarray(auxilliary, dtype=float)
+        for ind in range(len(idx)):
+            n = idx[ind]
+            scale = numpy.sqrt(kernel[2][ind])
+            d = params[:,n][:,numpy.newaxis] - p0[:,n]
+            result *= numpy.exp(-0.5 * d * d / (scale * scale)) / (scale * numpy.sqrt(2 * numpy.pi)) / aux[:,n]
+
+    elif kernel_type == 3:
+        # a single covariance, so a single factorisation
+        aux = numpy.asarray(auxilliary, dtype=float)
+        factor = factorMultinormal(kernel[2])
+        for start in range(0, M, CHUNK):
+            logpdf = logPdfMultinormalMatrix(params[start:(start + CHUNK), idx], p0[:,idx], factor)
+            result[start:(start + CHUNK), :] = numpy.exp(logpdf) / aux
+
+    elif kernel_type == 4 or kernel_type == 5:
+        # one covariance per previous particle, each factorised once and evaluated for all rows
+        aux = numpy.asarray(auxilliary, dtype=float)
+        D = kernel[2]
+        for j in range(N):
+            factor = factorMultinormal(D[j])
+            result[:, j] = numpy.exp(logPdfMultinormal(params[:, idx] - p0[j, idx], factor)) / aux[j]
+
+    return result
+
+# worker for parallelPdfParameterKernelMatrix
+def pdfParameterKernelMatrixRows(args):
+    return getPdfParameterKernelMatrix(*args)
+
+# evaluate the kernel matrix in chunks of rows across multiple processes
+def parallelPdfParameterKernelMatrix(params, params0, priors, kernel, auxilliary, kernel_type):
+    import multiprocessing
+    chunks = [ (params[start:(start + CHUNK)], params0, priors, kernel, auxilliary, kernel_type)
+               for start in range(0, params.shape[0], CHUNK) ]
+    pool = multiprocessing.Pool()
+    try:
+        parts = pool.map(pdfParameterKernelMatrixRows, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return numpy.vstack(parts)
+
+# prior pdf of each particle in the [M x np] array params
+def getPdfPriorVector(params, priors):
+    params = numpy.atleast_2d(numpy.asarray(params, dtype=float))
+    result = numpy.ones(params.shape[0])
+    for n in range(len(priors)):
+        x = params[:,n]
+        if priors[n][0] == 1:
+            scale = numpy.sqrt(priors[n][2])
+            result *= numpy.exp(-0.5 * (x - priors[n][1]) ** 2 / (scale * scale)) / (scale * numpy.sqrt(2 * numpy.pi))
+        elif priors[n][0] == 2:
+            result *= numpy.where((x > priors[n][2]) | (x < priors[n][1]), 0.0, 1.0/(priors[n][2] - priors[n][1]))
+        elif priors[n][0] == 3:
+            scale = numpy.sqrt(priors[n][2])
+            result *= numpy.exp(-0.5 * (numpy.log(x) - priors[n][1]) ** 2 / (scale * scale)) / (x * scale * numpy.sqrt(2 * numpy.pi))
+    return result
@@ -6,6 +6,7 @@ from numpy import linalg as LA
 import scipy
 import math
 import scipy.stats.mvn
+import scipy.spatial
 
 ################## multinomial sampling
 def w_choice(item,weight):
@@ -156,6 +157,16 @@ def kNearestNeighEuc(ind,S,k):
     return kmin
 
 
+####### Compute the k nearest neighbours of every point in the [n x d] array S, using a
+####### KD-tree built once for the whole set -- returns an [n x k] array of indices
+def kNearestNeighTree(S,k):
+    S = atleast_2d(S)
+    k = min(k, S.shape[0])
+    tree = scipy.spatial.cKDTree(S)
+    dist, kset = tree.query(S, k=k)
+    return kset.reshape(S.shape[0], k)
+
+
 ########### Compute the weighted covariance
 def compute_cov(population,w):
     dimvar = len(population)
@@ -182,6 +193,26 @@ def compute_cov(population,w):
 
 
 
+########### Compute weighted covariances of many sets of points at once
+########### points is [n x k x d] and w is [n x k], giving an [n x d x d] array
+def compute_cov_batch(points,w):
+    wsum = sum(w, axis=1)
+    m = einsum('nk,nkd->nd', w, points)/wsum[:,newaxis]
+    diff = points - m[:,newaxis,:]
+    return einsum('nk,nki,nkj->nij', w, diff, diff)/wsum[:,newaxis,newaxis]
+
+
+#### compute the optimal covariance matrices for every point of the [n x d] array
+#### p with respect to the weighted [N x d] population, giving an [n x d x d] array
+#### (expanding sum(w (x-p)(x-p)^T), so the population is only traversed once)
+def compute_optcovmat_batch(population,w,p):
+    wsum = sum(w)
+    S = dot(transpose(population)*w, population)
+    s = dot(w, population)
+    ps = einsum('ni,j->nij', p, s)
+    return (S[newaxis,:,:] - ps - transpose(ps, (0,2,1)) + wsum*einsum('ni,nj->nij', p, p))/wsum
+
+
 #### compute the optimal covariance matrix
 def compute_optcovmat(population,w,p):
     dimvar = len(population)
@@ -3,13 +3,18 @@
 # utility hack to merge the postprocessed elementaries from multiple Morris runs
 # we assume they've all been run with the same set of parameters and thus have
 # consistent columns
+# the runs' results files are likewise merged, in indexed form (see results.py),
+# with a leading run column holding the same ID as the elementaries
 
 import sys, os, os.path
+import results
 
 BRIEF='brief.txt'
 ELEMENTARIES='elementaries.txt'
 AGGREGATE='aggregate.txt'
 PREFIX_HEADER='ID\tinput'
+RESULTS='results.txt'
+AGGREGATE_RESULTS='aggregate_results.txt'
 
 def aggregate(sub, target, header, idx):
     print 'aggregating ' + sub
@@ -39,3 +44,13 @@ if __name__ == '__main__':
             aggregate(sub, f, header, idx)
             header=False
             idx = idx + 1
+
+    # results with the same column layout are merged into a single indexed file
+    # -- run IDs match the elementaries, since these are listed in the same order
+    found = [ os.path.join(sub, RESULTS) for sub in subdirs ]
+    found = [ x for x in found if os.path.isfile(x) or results.isCurrent(x) ]
+    if len(found) == len(subdirs) and found:
+        print 'merging results'
+        results.merge(found, os.path.join(dir, AGGREGATE_RESULTS))
+    elif found:
+        print 'results files missing for some runs, not merging'
@@ -97,6 +97,7 @@ def loglik(data1, data2, sigma=None):
 def loglikWithSigma(sigma):
     def f (data1, data2):
         return loglik(data1, data2, sigma)
+    f.batch = lambda data1, data2, axis=-2: batchLoglik(data1, data2, axis, sigma)
     return f
 
 def manhattan(data1, data2):
@@ -104,3 +105,84 @@ def manhattan(data1, data2):
 
 def meandist(data1, data2):
     return substitute(numpy.sqrt(numpy.mean((data1 - data2) * (data1 - data2))))
+
+
+# -- batch versions of the generic functions, which compute distances for a whole
+# array of traces at once, reducing along the time axis
+# data1 is broadcast against data2, so a single target can be compared with many
+# simulations; non-finite results are substituted as for the scalar versions
+
+def substituteAll(x):
+    x = numpy.array(x, dtype=float)
+    x[~numpy.isfinite(x)] = SUBSTITUTE
+    return x
+
+def batchEuclidean(data1, data2, axis=-2):
+    resid = data1 - data2
+    return substituteAll(numpy.sqrt(numpy.sum(resid * resid, axis=axis)))
+
+def batchManhattan(data1, data2, axis=-2):
+    return substituteAll(numpy.sum(numpy.fabs(data1 - data2), axis=axis))
+
+def batchMeandist(data1, data2, axis=-2):
+    resid = data1 - data2
+    return substituteAll(numpy.sqrt(numpy.mean(resid * resid, axis=axis)))
+
+def batchLoglik(data1, data2, axis=-2, sigma=None):
+    resid = data1 - data2
+    T = resid.shape[axis]
+    if sigma is None:
+        sigma = numpy.std(resid, axis=axis)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return substituteAll(T * numpy.log(2 * numpy.pi * sigma * sigma)/2 + numpy.sum(resid * resid, axis=axis)/(2 * sigma * sigma))
+
+# cosine similarity of corresponding traces, with zero norms marked by NaN
+def batchSimilarity(data1, data2, axis=-2):
+    data1, data2 = numpy.broadcast_arrays(data1, data2)
+    d = numpy.sum(data1 * data2, axis=axis)
+    n = numpy.sqrt(numpy.sum(data1 * data1, axis=axis)) * numpy.sqrt(numpy.sum(data2 * data2, axis=axis))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        c = numpy.clip(d/n, -1, 1)
+    c[n == 0] = numpy.nan
+    return c
+
+def batchCosine(data1, data2, axis=-2):
+    return substituteAll((1 - batchSimilarity(data1, data2, axis))/2)
+
+def batchAngular(data1, data2, axis=-2):
+    return substituteAll(numpy.arccos(batchSimilarity(data1, data2, axis))/numpy.pi)
+
+euclidean.batch = batchEuclidean
+manhattan.batch = batchManhattan
+meandist.batch = batchMeandist
+loglik.batch = batchLoglik
+cosine.batch = batchCosine
+angular.batch = batchAngular
+
+# approximate number of array elements to process at once
+CHUNK = 10000000
+
+# compute distances between target data and a whole set of simulations at once
+# target is [ times ][ species ], sims [ job ][ rep ][ times ][ species ]
+# funcs is a list of the generic distance functions above (or others, which will be
+# applied one trace at a time); jobs are processed in chunks to keep memory bounded
+# returns an array of [ func ][ job ][ rep ][ species ]
+def batch(target, sims, funcs, chunk=CHUNK):
+    target = numpy.asarray(target, dtype=float)
+    sims = numpy.asarray(sims, dtype=float)
+    njob, nrep, ntime, nspecies = sims.shape
+    result = numpy.zeros((len(funcs), njob, nrep, nspecies))
+    step = max(1, int(chunk // max(1, nrep * ntime * nspecies)))
+
+    for start in range(0, njob, step):
+        block = sims[start:start+step]
+        for ii in range(len(funcs)):
+            bf = getattr(funcs[ii], 'batch', None)
+            if bf:
+                result[ii, start:start+step] = bf(target, block)
+            else:
+                for jj in range(block.shape[0]):
+                    for rr in range(nrep):
+                        for ss in range(nspecies):
+                            result[ii, start+jj, rr, ss] = funcs[ii](target[:, ss], block[jj, rr, :, ss])
+    return result
@@ -0,0 +1,267 @@
+# distributed simulation via a simple TCP work queue
+# the master process runs a broker, which hands out simulation tasks to any number of
+# worker processes -- on this or other machines -- and collects their results
+# workers hold a lease on each task they're running, renewed by a heartbeat; if a
+# worker goes quiet its tasks are handed out again, and any duplicate results
+# that eventually turn up are discarded
+# transport is multiprocessing.managers, so only the standard library is required
+# -- but that means pickles, so anyone who can connect with the authkey can run
+# code on the broker and workers: there is no default key, it must be set in the
+# BCMD_AUTHKEY environment variable (or passed explicitly), and the broker only
+# listens on the loopback interface unless given a host to bind to
+
+import os, sys
+import time
+import socket
+import threading
+import collections
+import numpy
+from multiprocessing.managers import BaseManager
+
+# defaults
+PORT = 50123
+HOST = '127.0.0.1'
+LEASE = 60          # seconds without a heartbeat before a task is reassigned
+HEARTBEAT = 10      # seconds between worker heartbeats
+POLL = 1            # seconds between requests from an idle worker
+TIMEOUT = 600       # seconds to wait for results with no live workers before giving up
+
+# sentinel returned to workers when the broker is finished
+STOP = 'STOP'
+
+# sentinel returned by workers for a task that raised an exception
+FAILED = 'FAILED'
+
+# the key to use, failing if none has been set
+def get_authkey ( authkey=None ):
+    authkey = authkey or os.environ.get('BCMD_AUTHKEY')
+    if not authkey:
+        raise Exception('distributed mode needs a private authkey: set the BCMD_AUTHKEY environment variable')
+    return authkey
+
+# parse a [host]:port address, defaulting to the loopback interface (for the broker)
+# or the local host (for workers)
+def address(spec, host=HOST):
+    if spec is None:
+        return (host, PORT)
+    spec = str(spec)
+    if ':' in spec:
+        h, p = spec.rsplit(':', 1)
+        return (h or host, int(p or PORT))
+    return (spec, PORT)
+
+class Broker:
+    def __init__ ( self, lease=LEASE, timeout=TIMEOUT ):
+        self.lease = lease
+        self.timeout = timeout
+        self.lock = threading.Condition()
+        self.tasks = {}                     # task id -> payload, for unfinished tasks
+        self.pending = collections.deque()  # task ids awaiting a worker
+        self.leases = {}                    # task id -> (worker, expiry)
+        self.results = {}                   # task id -> result, until collected
+        self.next_id = 0
+        self.closed = False
+        self.dispatched = 0
+        self.redispatched = 0
+        self.duplicates = 0
+        self.workers = {}                   # worker -> time last heard from
+
+    # queue a task, returning its id
+    def submit ( self, payload ):
+        with self.lock:
+            tid = self.next_id
+            self.next_id += 1
+            self.tasks[tid] = payload
+            self.pending.append(tid)
+            return tid
+
+    def contact ( self, worker ):
+        self.workers[worker] = time.time()
+
+    # whether any worker has been heard from within the lease period
+    def alive ( self ):
+        limit = time.time() - self.lease
+        return any([ seen >= limit for seen in self.workers.values() ])
+
+    # return any tasks whose leases have run out to the queue
+    def reclaim ( self ):
+        now = time.time()
+        for tid, (worker, expiry) in self.leases.items():
+            if expiry < now:
+                del self.leases[tid]
+                if tid in self.tasks:
+                    print >> sys.stderr, 'lost contact with worker %s, reassigning task %d' % (worker, tid)
+                    self.pending.appendleft(tid)
+                    self.redispatched += 1
+
+    # hand out the next task to a worker, as (id, payload), or None if
+    # there's nothing to do right now, or STOP if the broker is finished
+    def fetch ( self, worker ):
+        with self.lock:
+            if self.closed:
+                return STOP
+            self.contact(worker)
+            self.reclaim()
+            while self.pending:
+                tid = self.pending.popleft()
+                if tid in self.tasks and tid not in self.leases:
+                    self.leases[tid] = (worker, time.time() + self.lease)
+                    self.dispatched += 1
+                    return (tid, self.tasks[tid])
+            return None
+
+    # renew the leases on a worker's tasks
+    def heartbeat ( self, worker, tids ):
+        with self.lock:
+            self.contact(worker)
+            expiry = time.time() + self.lease
+            for tid in tids:
+                if tid in self.leases and self.leases[tid][0] == worker:
+                    self.leases[tid] = (worker, expiry)
+            return not self.closed
+
+    # record a task's result -- only the first one received counts
+    def complete ( self, tid, result ):
+        with self.lock:
+            self.leases.pop(tid, None)
+            if tid not in self.tasks:
+                self.duplicates += 1
+                return False
+            del self.tasks[tid]
+            self.results[tid] = result
+            self.lock.notify_all()
+            return True
+
+    # wait for results of the given tasks, removing and returning them in order
+    # -- if no worker is heard from and no results arrive for the timeout period,
+    # nobody is going to do the work, so give up
+    def wait ( self, tids ):
+        with self.lock:
+            last = time.time()
+            received = 0
+            while True:
+                count = len([ tid for tid in tids if tid in self.results ])
+                if count == len(tids):
+                    break
+                if count > received or self.alive():
+                    received = count
+                    last = time.time()
+                elif time.time() - last > self.timeout:
+                    raise Exception('no workers for %d seconds, with %d of %d results outstanding' % (self.timeout, len(tids) - count, len(tids)))
+                self.reclaim()
+                self.lock.wait(POLL)
+            return [ self.results.pop(tid) for tid in tids ]
+
+    def close ( self ):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def report ( self ):
+        with self.lock:
+            return 'Broker: %d workers, %d tasks dispatched, %d reassigned, %d duplicate results discarded' % (len(self.workers), self.dispatched, self.redispatched, self.duplicates)
+
+class ServerManager(BaseManager): pass
+class ClientManager(BaseManager): pass
+ClientManager.register('get_broker')
+
+# start a broker serving on the given address, in a background thread
+# returns the broker, which can be used directly by the calling process
+def serve ( spec=None, authkey=None, lease=LEASE, timeout=TIMEOUT ):
+    authkey = get_authkey(authkey)
+    broker = Broker(lease, timeout)
+    ServerManager.register('get_broker', callable=lambda: broker)
+    manager = ServerManager(address=address(spec), authkey=authkey)
+    server = manager.get_server()
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    print 'Broker listening on %s:%d' % server.address
+    return broker
+
+def connect ( spec, authkey=None ):
+    manager = ClientManager(address=address(spec, 'localhost'), authkey=get_authkey(authkey))
+    manager.connect()
+    return manager.get_broker()
+
+# a private working directory for this worker under base, since several may share it
+def workdir ( base ):
+    return os.path.join(base, 'worker_%s_%d' % (socket.gethostname(), os.getpid()))
+
+# run tasks from the broker at spec, applying func to each payload and returning
+# the results, until the broker stops or goes away
+# a task that raises an exception is reported back as FAILED, rather than
+# taking the worker down with it
+def work ( spec, func, authkey=None, heartbeat=HEARTBEAT ):
+    name = '%s:%d' % (socket.gethostname(), os.getpid())
+    authkey = get_authkey(authkey)
+    broker = connect(spec, authkey)
+    print 'Worker %s connected to broker' % name
+
+    current = []
+    done = threading.Event()
+
+    # keep our leases alive while a (possibly long) task runs -- using a separate
+    # connection, since proxies can't be shared between threads
+    def beat():
+        try:
+            hb = connect(spec, authkey)
+            while not done.wait(heartbeat):
+                if current:
+                    hb.heartbeat(name, current[:])
+        except Exception as e:
+            print >> sys.stderr, 'worker heartbeat failed: %s' % e
+
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+
+    ntasks = 0
+    try:
+        while True:
+            task = broker.fetch(name)
+            if task == STOP:
+                break
+            if task is None:
+                time.sleep(POLL)
+                continue
+
+            tid, payload = task
+            current[:] = [tid]
+            try:
+                result = func(payload)
+            except Exception as e:
+                print >> sys.stderr, 'worker task %d failed: %s' % (tid, e)
+                result = FAILED
+            current[:] = []
+            broker.complete(tid, result)
+            ntasks += 1
+    except (EOFError, IOError, socket.error) as e:
+        print >> sys.stderr, 'lost connection to broker: %s' % e
+    finally:
+        done.set()
+
+    print 'Worker %s finished after %d tasks' % (name, ntasks)
+    return ntasks
+
+# simulation executor for model_bcmd, farming each particle out as a separate task
+class RemoteSimulator:
+    def __init__ ( self, broker ):
+        self.broker = broker
+
+    # as model_bcmd.runSimulations, with nspecies giving the shape of the NaN
+    # results that stand in for failed tasks
+    def simulate ( self, p, t, n, beta, do_perturb=True, nspecies=1 ):
+        tids = [ self.broker.submit({ 'params': list(p[jj]), 'beta': beta, 'do_perturb': do_perturb })
+                 for jj in range(n) ]
+        failed = numpy.nan * numpy.ones((beta, len(t), nspecies))
+        return numpy.array([ failed if isinstance(r, str) and r == FAILED else r
+                             for r in self.broker.wait(tids) ])
+
+# the worker side of RemoteSimulator, running the tasks with a local model
+def simulation_task ( model ):
+    def f ( payload ):
+        return model.runSimulations([ payload['params'] ], model.times, 1, payload['beta'], payload['do_perturb'])[0]
+    return f
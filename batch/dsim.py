@@ -12,6 +12,8 @@ import scipy.stats as stats
 import os, os.path, sys
 import time, datetime
 import argparse, pprint
+import bisect
+import itertools
 
 # we now delegate sensitivity analysis to an external library
 # initially still only supporting Morris, but this will soon change...
@@ -27,6 +29,8 @@ import steps
 import distance
 import inputs
 import posthoc
+import simcache
+import distrib
 
 # environment
 VERSION = 0.6
@@ -46,6 +50,19 @@ INTERFERENCE = 4
 SAVE_INTERVAL = 100
 DISTANCE = 'euclidean'
 DELTA = 1e-6
+DRYRUN_JOBS = 20    # jobs listed by a dry run
+
+# adaptive mode defaults
+COARSE = 3          # initial grid points per free param
+TOLERANCE = 0.05    # largest acceptable change between neighbours, relative to the overall range
+MAX_SIMS = 1000     # simulation budget
+MAX_DEPTH = 6       # maximum number of halvings of an initial grid cell in each dimension
+
+# param distributions that the adaptive mode can explore
+SCALED_DISTS = ('uniform', 'normal', 'lognormal')
+
+# job modes whose results are postprocessed into sensitivities
+POSTPROC_MODES = ('morris', 'fast', 'hessian')
 
 # suppress stray floating point warnings
 np.seterr(all='ignore')
@@ -120,6 +137,73 @@ def cartesian(arrays, out=None):
             out[j*m:(j+1)*m,1:] = out[0:m,1:]
     return out
 
+# job designs map a job index to its parameter vector on demand, so that
+# big designs don't have to be held in memory -- they support len, indexing,
+# slicing (returning a list of jobs) and iteration, much like a list of jobs
+class Design:
+    size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self.job(ii) for ii in xrange(*index.indices(self.size)) ]
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError('job index out of range')
+        return self.job(index)
+
+    def __iter__(self):
+        for ii in xrange(self.size):
+            yield self.job(ii)
+
+# a design that is already a list (or array) of jobs, eg from SALib
+class ListDesign(Design):
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.size = len(jobs)
+
+    def job(self, index):
+        return list(self.jobs[index])
+
+# all combinations of the given value arrays, in the same order as cartesian()
+class CartesianDesign(Design):
+    def __init__(self, arrays):
+        self.arrays = [ np.asarray(x) for x in arrays ]
+        self.size = reduce(lambda x, y: x * y, [ len(x) for x in self.arrays ], 1)
+
+    def job(self, index):
+        result = [ None ] * len(self.arrays)
+        for ii in range(len(self.arrays) - 1, -1, -1):
+            index, rem = divmod(index, len(self.arrays[ii]))
+            result[ii] = self.arrays[ii][rem]
+        return result
+
+# variations of one or two parameters at a time over their quantiles, with the rest
+# held at their defaults -- groups lists the parameter indices varied together
+class GroupDesign(Design):
+    def __init__(self, params, groups, divisions):
+        self.defaults = [ p['default'] for p in params ]
+        self.groups = groups
+        self.quants = [ [ quantiles(params[ii], divisions) for ii in group ] for group in groups ]
+
+        # starting index of each group's jobs
+        self.offsets = [ 0 ]
+        for qq in self.quants:
+            self.offsets.append(self.offsets[-1] + reduce(lambda x, y: x * y, [ len(q) for q in qq ], 1))
+        self.size = self.offsets[-1]
+
+    def job(self, index):
+        gg = bisect.bisect_right(self.offsets, index) - 1
+        index -= self.offsets[gg]
+        result = self.defaults[:]
+        for ii in range(len(self.groups[gg]) - 1, -1, -1):
+            index, rem = divmod(index, len(self.quants[gg][ii]))
+            result[self.groups[gg][ii]] = self.quants[gg][ii][rem]
+        return result
+
 # calculate a range of values to regularly sample a var (or param or input) distribution
 # for a uniform distribution we include the endpoints, for
 # log/normal we (obviously) don't, instead treating as (n+2) and dropping the ends
@@ -143,6 +227,156 @@ def quantiles(var, n):
     else:
         return np.array([])
 
+# value of a var at position u in [0,1] through its distribution -- linearly between
+# the bounds for uniform, otherwise over the same probability range as quantiles()
+def unit_value(var, u, margin):
+    dist = var.get('dist', '')
+    p = margin + u * (1 - 2 * margin)
+    if dist == 'uniform':
+        return var.get('min', 0) + u * (var.get('max', 1) - var.get('min', 0))
+    elif dist == 'normal':
+        return stats.norm.ppf(p, loc=var.get('mean', 0), scale=np.sqrt(var.get('var', 1)))
+    elif dist == 'lognormal':
+        return stats.lognorm.ppf(p, np.sqrt(var.get('var', 1)), scale=np.exp(var.get('mean', 0)))
+    elif dist == 'constant':
+        return var.get('value', np.nan)
+    elif dist == 'noinit':
+        return None
+    else:
+        return var.get('default', np.nan)
+
+# adaptively refined scan over the params with scalable distributions (the rest are held
+# fixed) -- starting from a coarse grid, each cell is a box in the unit cube with all its
+# corners simulated, and boxes are split in half wherever the distance or the outputs
+# change sharply between neighbouring corners, until no change exceeds the tolerance
+# or the simulation budget runs out
+# as a design it holds the jobs generated so far, which grows with each refinement
+class AdaptiveDesign(Design):
+    def __init__(self, params, config):
+        self.params = params
+        self.free = [ ii for ii in range(len(params)) if params[ii].get('dist') in SCALED_DISTS ]
+        self.margin = 1.0 / (config['divisions'] + 1)
+        self.tolerance = config['tolerance']
+        self.max_sims = config['max_sims']
+        self.weights = np.array([ config['weights'].get(var['name'], 1) for var in config['vars'] ])
+
+        coarse = max(config['coarse'], 2)
+        self.min_width = 1.0 / ((coarse - 1) * 2 ** config['max_depth'])
+
+        self.jobs = []          # parameter vectors, in job order
+        self.points = {}        # unit cube position -> job index
+        self.dists = []         # summed distance of each simulated job
+        self.signals = []       # mean outputs of each simulated job, as [ times ][ species ]
+
+        grid = np.linspace(0, 1, coarse)
+        for pos in itertools.product(grid, repeat=len(self.free)):
+            self.add(pos)
+        self.size = len(self.jobs)
+
+        # unrefined boxes, as (lo, hi) corner positions
+        self.boxes = []
+        if self.free:
+            cells = zip(grid[:-1], grid[1:])
+            self.boxes = [ tuple(zip(*cell)) for cell in itertools.product(cells, repeat=len(self.free)) ]
+
+    def job(self, index):
+        return self.jobs[index]
+
+    def key(self, pos):
+        return tuple([ round(x, 12) for x in pos ])
+
+    # queue the job at a position, if not already known
+    def add(self, pos):
+        key = self.key(pos)
+        if key in self.points:
+            return
+        self.points[key] = len(self.jobs)
+
+        job = [ unit_value(p, 0, self.margin) for p in self.params ]
+        for ii, u in zip(self.free, pos):
+            job[ii] = unit_value(self.params[ii], u, self.margin)
+        self.jobs.append(job)
+
+    # store the results and distances for the next batch of simulated jobs
+    def record(self, results, dists):
+        self.dists.extend(np.sum(np.mean(dists, axis=1) * self.weights, axis=1))
+        self.signals.extend(np.mean(results, axis=1))
+
+    # normalised change between two simulated jobs -- any difference in which
+    # outputs are finite (eg a failed simulation) counts as infinitely sharp
+    def change(self, a, b, drange, scale):
+        sa, sb = self.signals[a], self.signals[b]
+        fa, fb = np.isfinite(sa), np.isfinite(sb)
+        if np.any(fa != fb):
+            return np.inf
+
+        diff = np.where(fa, (sa - sb) / scale, 0)
+        ds = np.max(np.sqrt(np.mean(diff ** 2, axis=0)))
+
+        da, db = self.dists[a], self.dists[b]
+        dd = 0 if da == db else abs(da - db) / drange
+        return np.nanmax([dd, ds])
+
+    # largest change across the box and the dimension in which it occurs, considering
+    # only dimensions in which the box can still be split
+    def score(self, box, drange, scale):
+        lo, hi = box
+        best, dim = 0, None
+        for dd in range(len(lo)):
+            if hi[dd] - lo[dd] < 1.5 * self.min_width:
+                continue
+            for rest in itertools.product(*[ (lo[ii], hi[ii]) for ii in range(len(lo)) if ii != dd ]):
+                a = list(rest[:dd]) + [lo[dd]] + list(rest[dd:])
+                b = list(rest[:dd]) + [hi[dd]] + list(rest[dd:])
+                c = self.change(self.points[self.key(a)], self.points[self.key(b)], drange, scale)
+                if c > best:
+                    best, dim = c, dd
+        return best, dim
+
+    # split the boxes that exceed the tolerance, worst first, adding the new corner jobs
+    # within the budget -- returns the number of boxes split, 0 when the scan is done
+    def refine(self):
+        dists = np.array(self.dists)
+        finite = dists[np.isfinite(dists)]
+        drange = np.ptp(finite) if len(finite) else 0
+        drange = drange or 1
+
+        signals = np.array(self.signals)
+        with np.errstate(all='ignore'):
+            scale = np.nanmax(np.nanmax(signals, axis=1), axis=0) - np.nanmin(np.nanmin(signals, axis=1), axis=0)
+        scale[~(scale > 0)] = 1
+
+        scored = [ self.score(box, drange, scale) + (box,) for box in self.boxes ]
+        scored = [ x for x in scored if x[1] is not None and x[0] > self.tolerance ]
+        if not scored:
+            print 'Adaptive scan converged within tolerance %g' % self.tolerance
+            return 0
+        scored.sort(key=lambda x: -x[0])
+
+        split = 0
+        for best, dim, box in scored:
+            lo, hi = box
+            mid = 0.5 * (lo[dim] + hi[dim])
+            sides = [ (lo[ii], hi[ii]) if ii != dim else (mid,) for ii in range(len(lo)) ]
+            new = set([ self.key(pos) for pos in itertools.product(*sides) ]) - set(self.points)
+            if len(self.jobs) + len(new) > self.max_sims:
+                break
+
+            for pos in sorted(new):
+                self.add(pos)
+
+            self.boxes.remove(box)
+            self.boxes.append((lo, hi[:dim] + (mid,) + hi[dim+1:]))
+            self.boxes.append((lo[:dim] + (mid,) + lo[dim+1:], hi))
+            split += 1
+
+        self.size = len(self.jobs)
+        if split == 0:
+            print 'Adaptive scan stopped by the simulation budget of %d, largest change %g' % (self.max_sims, scored[0][0])
+        else:
+            print 'Split %d of %d boxes over tolerance, largest change %g' % (split, len(scored), scored[0][0])
+        return split
+
 # process command-line arguments
 def process_args():
     ap = argparse.ArgumentParser(description="Batch simulation jobs for BCMD models")
@@ -153,6 +387,8 @@ def process_args():
     ap.add_argument('-o', '--outdir', help='work/output directory (default: [BUILD]/[MODEL_NAME]_[TIMESTAMP]', metavar='DIR')
     ap.add_argument('-p', '--perturb', help='enable input perturbation', action='store_true')
     ap.add_argument('-d', '--dryrun', help='dump configuration details without simulating', action='store_true')
+    ap.add_argument('--broker', help='distribute simulations to workers connecting on this address (listening on 127.0.0.1 unless HOST is given; needs BCMD_AUTHKEY set)', metavar='[HOST]:PORT')
+    ap.add_argument('--worker', help='run simulations for the broker at this address, instead of a job', metavar='HOST:PORT')
     ap.add_argument('jobfile', help='job specification file')
     ap.add_argument('datafile', help='CSV containing time series data')
 
@@ -176,6 +412,8 @@ def process_args():
 
     config['perturb'] = args.perturb
     config['dryrun'] = args.dryrun
+    config['broker'] = args.broker
+    config['worker'] = args.worker
 
     return config
 
@@ -241,7 +479,9 @@ def process_inputs(config):
     print 'Processing inputs'
 
     job = inputs.readFile(config['jobfile'])
-    data = inputs.readFile(config['datafile'])
+    
+    # data columns are parsed as used, optionally caching them next to the file
+    data = inputs.readFile(config['datafile'], cache=int(job['header'].get('data_cache', [[0]])[0][0]))
 
     # there's scope for something silly to go wrong here, but for now
     # let's just assume it won't...
@@ -331,12 +571,21 @@ def process_inputs(config):
     config['interference'] = int(job['header'].get('interference', [[INTERFERENCE]])[0][0])
     config['save_interval'] = int(job['header'].get('save_interval', [[SAVE_INTERVAL]])[0][0])
     config['delta'] = float(job['header'].get('delta', [[DELTA]])[0][0])
+    config['coarse'] = int(job['header'].get('coarse', [[COARSE]])[0][0])
+    config['tolerance'] = float(job['header'].get('tolerance', [[TOLERANCE]])[0][0])
+    config['max_sims'] = int(job['header'].get('max_sims', [[MAX_SIMS]])[0][0])
+    config['max_depth'] = int(job['header'].get('max_depth', [[MAX_DEPTH]])[0][0])
 
     if 'delta' in job['header'] and len(job['header']['delta'][0]) > 1:
         config['relative_delta'] = job['header']['delta'][0][1] == 'relative'
 
     config['timeout'] = int(job['header'].get('timeout', [[model_bcmd.TIMEOUT]])[0][0])
 
+    # persistent simulation cache settings -- no directory disables caching
+    config['sim_cache'] = job['header'].get('sim_cache', [[None]])[0][0]
+    config['sim_cache_size'] = float(job['header'].get('sim_cache_size', [[simcache.SIZE]])[0][0])
+    config['sim_cache_age'] = float(job['header'].get('sim_cache_age', [[simcache.AGE]])[0][0])
+
     # hack alert -- option for non-finite distances to be replaced with some real value
     config['substitute'] = float(job['header'].get('substitute', [[distance.SUBSTITUTE]])[0][0])
     distance.SUBSTITUTE = config['substitute']
@@ -381,30 +630,26 @@ def make_jobs(config):
 
     if mode == 'cartesian':
         quants = [quantiles(p, config['divisions']) for p in params]
-        result = cartesian(quants)
+        result = CartesianDesign(quants)
     elif mode == 'morris':
-        result = morris(params, config)
+        result = ListDesign(morris(params, config))
     elif mode == 'fast':
-        result = fast(params, config)
+        result = ListDesign(fast(params, config))
     elif mode == 'hessian':
-        result = hessian(params, config)
+        result = ListDesign(hessian(params, config))
+    elif mode == 'sensitivity':
+        # only the start point is simulated -- the rest of the hessian
+        # stencil is applied to the linearised outputs afterwards
+        result = ListDesign(hessian(params, config)[:1])
+    elif mode == 'adaptive':
+        result = AdaptiveDesign(params, config)
+        if len(result) > config['max_sims']:
+            raise Exception('initial grid of %d jobs exceeds the simulation budget of %d' % (len(result), config['max_sims']))
     elif mode == 'pairwise':
-        result = []
-        for ii in range(len(params)):
-            qi = quantiles(params[ii], config['divisions'])
-            for jj in range(ii+1, len(params)):
-                qj = quantiles(params[jj], config['divisions'])
-                before = [x['default'] for x in params[:ii]]
-                between = [x['default'] for x in params[(ii+1):jj]]
-                after = [x['default'] for x in params[(jj+1):]]
-
-                result.extend([before + [x] + between + [y] + after for x in qi for y in qj])
+        pairs = [ (ii, jj) for ii in range(len(params)) for jj in range(ii+1, len(params)) ]
+        result = GroupDesign(params, pairs, config['divisions'])
     else:
-        result = []
-        for ii in range(len(params)):
-            before = [x['default'] for x in params[:ii]]
-            after = [x['default'] for x in params[(ii+1):]]
-            result.extend([ before + [x] + after for x in quantiles(params[ii], config['divisions'])])
+        result = GroupDesign(params, [ (ii,) for ii in range(len(params)) ], config['divisions'])
 
     # pprint.pprint(result)
 
@@ -484,6 +729,20 @@ def make_model(config):
 
     print 'Creating wrapper for model %s' % config['name']
 
+    # workers each need their own space for model i/o
+    if config['worker']:
+        config['model_io'] = distrib.workdir(config['model_io'])
+
+    executor = None
+    if config['broker']:
+        executor = distrib.RemoteSimulator(distrib.serve(config['broker']))
+
+    cache = None
+    if config['sim_cache']:
+        cache = simcache.SimulationCache( config['sim_cache'],
+                                          size=config['sim_cache_size'],
+                                          age=config['sim_cache_age'] )
+
     model = model_bcmd.model_bcmd( name=config['name'],
                                    vars=config['vars'],
                                    params=config['params'],
@@ -493,63 +752,118 @@ def make_model(config):
                                    baseSeq=config['baseSeq'],
                                    workdir=config['model_io'],
                                    timeout=config['timeout'],
+                                   cache=cache,
+                                   executor=executor,
                                    deleteWorkdir=False )
     return model
 
-# run jobs with model
+# summarise simulation reuse at the end of a run, and stop any broker
+def report_reuse(model):
+    if model.duplicates:
+        print 'Skipped %d duplicate simulations' % model.duplicates
+    if model.cache:
+        print model.cache.report()
+    if model.executor:
+        model.executor.broker.close()
+        print model.executor.broker.report()
+
+# run jobs with model, writing the results out batch by batch as they arrive
+# -- only the distances needed for postprocessing are kept in memory
 def run_jobs(model, jobs, config):
-    result = []
-
     print 'Running jobs'
+    nbatch = config['nbatch']
+    batches = (len(jobs) + nbatch - 1) // nbatch
+    needs_post = config.get('job_mode', JOB_MODE) in POSTPROC_MODES
+    dists = []
+
+    write_info(config)
+
+    print '%d jobs (%d batches of up to %d)' % (len(jobs), batches, nbatch)
+    with open(config['outfile'], 'w') as out:
+        write_header(out, jobs, config)
 
-    batches, excess = divmod(len(jobs), config['nbatch'])
-
-    print '%d jobs (%d batches of %d, with %d excess)' % (len(jobs), batches, config['nbatch'], excess)
-    for ii in range(batches):
-    	print 'Batch %d (%d to %d)' % (ii, ii * config['nbatch'], (ii+1) * config['nbatch'] - 1)
-        params = [ jobs[x] for x in range(ii * config['nbatch'], (ii+1) * config['nbatch']) ]
-        t0 = time.time()
-        print 'Start: %s' % time.asctime(time.localtime(t0))
-        result.append( model.simulate( params,
-                                       config['times'],
-                                       config['nbatch'],
-                                       config['beta'],
-                                       do_perturb=config['perturb'] ))
-        t1 = time.time()
-        print 'Completed: %s (%.2f seconds execution)' % (time.asctime(time.localtime(t0)), t1-t0)
-
-        # optionally save periodic intermediate results
-        # on the one hand this is potentially costly, on the other we'd rather
-        # not lose days of processing...
-        if config['save_interval'] > 0 and ii % config['save_interval'] == 0:
-            print 'Saving intermediate results'
-            output_results(jobs, np.vstack(result), config, True)
-
-    if excess:
-        print 'Running %d excess jobs' % excess
-        params = [ jobs[x] for x in range(batches * config['nbatch'], len(jobs)) ]
-        t0 = time.time()
-        print 'Start: %s' % time.asctime(time.localtime(t0))
-        result.append( model.simulate( params,
-                                       config['times'],
-                                       excess,
-                                       config['beta'],
-                                       do_perturb=config['perturb'] ))
-        t1 = time.time()
-        print 'Completed: %s (%.2f seconds execution)' % (time.asctime(time.localtime(t0)), t1-t0)
-
-
-    # merge into a single multidim array whose first dimension is the job index
-    # (ie, identifies the parameter set)
-    result = np.vstack(result)
-    print '%d result sets generated' % result.shape[0]
+        for ii in range(batches):
+            start = ii * nbatch
+            params = jobs[start:(start + nbatch)]
+            print 'Batch %d (%d to %d)' % (ii, start, start + len(params) - 1)
+            result = simulate_batch(model, params, config)
+
+            write_rows(out, jobs, start, result, config)
+            if needs_post:
+                dists.append(calc_distances(result, config))
+
+            # make sure the results so far are on disk every so often
+            # -- we'd rather not lose days of processing...
+            if config['save_interval'] > 0 and ii % config['save_interval'] == 0:
+                out.flush()
+
+    print '%d result sets generated' % len(jobs)
+
+    # for sensitivity jobs, calculate sensitivities for each output and dump those too
+    if needs_post:
+        postproc(jobs, np.vstack(dists), config)
+
+# run an adaptive job, simulating each round of refinement in batches and writing
+# the results out as they arrive, in the same form as run_jobs
+def run_adaptive(model, jobs, config):
+    print 'Running adaptive jobs'
+    nbatch = config['nbatch']
+
+    write_info(config)
+
+    with open(config['outfile'], 'w') as out:
+        write_header(out, jobs, config)
+
+        done = 0
+        rounds = 0
+        while True:
+            print 'Round %d: %d jobs (%d to %d)' % (rounds, len(jobs) - done, done, len(jobs) - 1)
+            for start in range(done, len(jobs), nbatch):
+                params = jobs[start:(start + nbatch)]
+                print 'Batch %d to %d' % (start, start + len(params) - 1)
+                result = simulate_batch(model, params, config)
+
+                write_rows(out, jobs, start, result, config)
+                jobs.record(result, calc_distances(result, config))
+            out.flush()
+
+            done = len(jobs)
+            rounds += 1
+            if not jobs.refine():
+                break
+
+    print '%d result sets generated in %d rounds' % (len(jobs), rounds)
+
+# simulate one batch of jobs, reporting the time taken
+def simulate_batch(model, params, config):
+    t0 = time.time()
+    print 'Start: %s' % time.asctime(time.localtime(t0))
+    result = model.simulate( params,
+                             config['times'],
+                             len(params),
+                             config['beta'],
+                             do_perturb=config['perturb'] )
+    t1 = time.time()
+    print 'Completed: %s (%.2f seconds execution)' % (time.asctime(time.localtime(t0)), t1-t0)
     return result
 
+# run the single job of a sensitivity mode job, getting the output sensitivities
+# to all params and vars along with the results
+# (the model must be built with these sensitivities, eg using bcmd.py --sens)
+def run_sensitivity(model, jobs, config):
+    print 'Running sensitivity job'
+    t0 = time.time()
+    print 'Start: %s' % time.asctime(time.localtime(t0))
+    signals, sens = model.sensitivities(np.array(jobs[0]), [p['name'] for p in config['params'] + config['vars']])
+    t1 = time.time()
+    print 'Completed: %s (%.2f seconds execution)' % (time.asctime(time.localtime(t0)), t1-t0)
+
+    # shape results as for run_jobs, with a single job and rep
+    return signals[np.newaxis, np.newaxis, :, :], sens
 
-# output the results
-# for the moment we just dump as tab-delim text to stdout
-# eventually there will probably be configurable options
-def output_results(jobs, results, config, intermediate=False):
+
+# write the info file, describing the job configuration
+def write_info(config):
     print 'Writing info file'
     with open(config['info'], 'w') as out:
         # this is tiresome, but needed to be able to read the file later
@@ -561,88 +875,99 @@ def output_results(jobs, results, config, intermediate=False):
         # ok, now we can restore it
         config['distance'] = distance
 
-    print 'Writing results file'
-    t0 = time.time()
-    print 'Start: %s' % time.asctime(time.localtime(t0))
-    with open(config['outfile'], 'w') as out:
-        nparams = len(jobs[0])
-        nbatch = config['nbatch']
-        ntimes = len(config['times'])
+# write the header lines of the results file: column names, times, inputs and targets
+def write_header(out, jobs, config):
+    nparams = len(jobs[0])
+
+    header = [ 'job', 'rep', 'species' ]
+    header.extend( [ p['name'] for p in config['params'] + config['vars'] ] )
+    header.extend( [ 't%d' % ii for ii in range(len(config['times'])) ] )
 
-        header = [ 'job', 'rep', 'species' ]
-        header.extend( [ p['name'] for p in config['params'] + config['vars'] ] )
-        header.extend( [ 't%d' % ii for ii in range(len(config['times'])) ] )
+    print >> out, '\t'.join(header)
 
-        print >> out, '\t'.join(header)
+    timeline = [ 'NA', 'NA', 't' ]
+    timeline.extend( ['NA'] * nparams )
+    timeline.extend( [ str(t) for t in config['times'] ] )
 
-        timeline = [ 'NA', 'NA', 't' ]
-        timeline.extend( ['NA'] * nparams )
-        timeline.extend( [ str(t) for t in config['times'] ] )
+    print >> out, '\t'.join(timeline)
 
-        print >> out, '\t'.join(timeline)
+    for input in config['inputs']:
+        inline = [ 'NA', 'NA', input['name'] + '_in' ]
+        inline.extend( ['NA'] * nparams )
+        inline.extend( [ str(v) for v in input['points'] ] )
+        print >> out, '\t'.join(inline)
 
-        for input in config['inputs']:
-            inline = [ 'NA', 'NA', input['name'] + '_in' ]
-            inline.extend( ['NA'] * nparams )
-            inline.extend( [ str(v) for v in input['points'] ] )
-            print >> out, '\t'.join(inline)
+    for var in config['vars']:
+        varline = [ 'NA', 'NA', var['name'] + '_out' ]
+        varline.extend( ['NA'] * nparams )
+        pts = var.get('points', [])
+        varline.extend( [ str(v) for v in pts ] )
+        varline.extend( ['NA'] * (len(config['times']) - len(pts)) )
+        print >> out, '\t'.join(varline)
+
+# write the result rows for a run of jobs starting at index start
+def write_rows(out, jobs, start, results, config):
+    for job in range(results.shape[0]):
+        params = [ str(p) for p in jobs[start + job] ]
+        for rep in range(results.shape[1]):
+            for species in range(results.shape[3]):
+                row = [ str(start + job), str(rep), config['vars'][species]['name'] ]
+                row.extend( params )
+                row.extend( [ str(v) for v in results[job, rep, :, species] ] )
 
-        for var in config['vars']:
-            varline = [ 'NA', 'NA', var['name'] + '_out' ]
-            varline.extend( ['NA'] * nparams )
-            pts = var.get('points', [])
-            varline.extend( [ str(v) for v in pts ] )
-            varline.extend( ['NA'] * (len(config['times']) - len(pts)) )
-            print >> out, '\t'.join(varline)
+                print >> out, '\t'.join(row)
 
-        for job in range(results.shape[0]):
-            for rep in range(results.shape[1]):
-                for species in range(results.shape[3]):
-                    row = [ str(job), str(rep), config['vars'][species]['name'] ]
-                    row.extend( [ str(p) for p in jobs[job] ] )
-                    row.extend( [ str(v) for v in results[job, rep, :, species] ] )
+# output a complete set of results in one go
+# for the moment we just dump as tab-delim text
+# eventually there will probably be configurable options
+def output_results(jobs, results, config):
+    write_info(config)
 
-                    print >> out, '\t'.join(row)
+    print 'Writing results file'
+    t0 = time.time()
+    print 'Start: %s' % time.asctime(time.localtime(t0))
+    with open(config['outfile'], 'w') as out:
+        write_header(out, jobs, config)
+        write_rows(out, jobs, 0, results, config)
 
     t1 = time.time()
     print 'Completed: %s (%.2f seconds to write)' % (time.asctime(time.localtime(t0)), t1-t0)
 
     # for sensitivity jobs, calculate sensitivities for each output and dump those too
-    if config.get('job_mode', JOB_MODE) in ('morris', 'fast', 'hessian')  and not intermediate:
-        postproc(jobs, results, config)
+    if config.get('job_mode', JOB_MODE) in POSTPROC_MODES:
+        postproc(jobs, calc_distances(results, config), config)
 
 
-# do postprocessing on the simulation results
-# -- ie, for each output, calculate distance metric and then work out sensitivity or hessian
-def postproc(jobs, results, config):
-    collated = {}
-    print 'Post-processing job results'
+# the target points for each var, with any posthoc transformations applied
+def targets(config):
+    result = []
     for var in config['vars']:
-        name = var['name']
         pts = var.get('points', np.zeros(len(config['times'])))
-
         for post in var.get('post'):
             pts = post(pts)
-        collated[name] = { 'target': pts,
-                           'distances': [] }
+        result.append(pts)
+    return result
 
-    summed = []
+# distances of a set of results from the targets, as [ job ][ rep ][ species ]
+def calc_distances(results, config):
+    return distance.batch(np.transpose(targets(config)), results, [config['distance']])[0]
 
-    print 'Calculating distances'
-    for job in range(results.shape[0]):
-        for rep in range(results.shape[1]):
-            sumdist = 0
-            for species in range(results.shape[3]):
-                name = config['vars'][species]['name']
-                cv = collated[name]
-                dist = config['distance'](cv['target'], results[job, rep, :, species])
-                cv['distances'].append(dist)
-                sumdist += dist * config['weights'].get(name, 1)
-            summed.append(sumdist)
+# do postprocessing on the simulation distances
+# -- ie, for each output, work out sensitivity or hessian
+def postproc(jobs, dists, config):
+    print 'Post-processing job results'
+    names = [ var['name'] for var in config['vars'] ]
+
+    # distances are listed job by job, then rep by rep, as for the results
+    collated = {}
+    for species in range(len(names)):
+        collated[names[species]] = { 'distances': list(dists[:, :, species].ravel()) }
+
+    weights = np.array([ config['weights'].get(name, 1) for name in names ])
+    summed = np.sum(dists * weights, axis=2).ravel()
 
     if config['job_mode']=='hessian':
-        summed
-        process_hessian(jobs, np.array(summed), config)
+        process_hessian(jobs, summed, config)
     else:
         process_SA(jobs, collated, config)
 
@@ -654,7 +979,7 @@ def process_SA(jobs, collated, config):
 
         if config['job_mode']=='morris':
             collated[var]['sensitivities'] = SALib.analyze.morris.analyze(config['problem'],
-                                                                          jobs,
+                                                                          np.array(jobs[:]),
                                                                           collated[var]['distances'],
                                                                           num_levels=config['divisions'],
                                                                           print_to_console=True,
@@ -724,6 +1049,37 @@ def process_hessian(jobs, summed, config):
             print >> f, '\t'.join([str(x) for x in hess[ii]])
 
 
+# estimate gradient and hessian of the summed distance from the output sensitivities
+# of a single run, by evaluating the hessian job stencil on the linearised signals
+# instead of simulating each point -- this neglects the second derivatives of the
+# model outputs, so the hessian is a Gauss-Newton style approximation
+def process_sensitivity(jobs, results, sens, config):
+    params = config['params'] + config['vars']
+    N = len(params)
+
+    print 'Post-processing sensitivities'
+    stencil = hessian(params, config)
+    base = np.array(stencil[0])
+
+    # linearised signals for every job at once, as [ job ][ rep ][ times ][ species ]
+    linear = results[0, 0] + np.einsum('tsp,jp->jts', sens, np.array(stencil) - base)
+    dists = calc_distances(linear[:, np.newaxis], config)[:, 0]
+    
+    weights = np.array([ config['weights'].get(var['name'], 1) for var in config['vars'] ])
+    summed = np.sum(dists * weights, axis=1)
+
+    denom = np.array([ p['delta'] - p['default'] for p in params ])
+    numer = summed[1:(N+1)] - summed[0]
+    numer[denom==0] = 0
+    denom[denom==0] = 1
+
+    with open(os.path.join(config['work'],'Gradient.txt'), 'wb') as f:
+        print >> f, '\t'.join([p['name'] for p in params])
+        print >> f, '\t'.join([str(x) for x in numer/denom])
+
+    process_hessian(stencil, summed, config)
+
+
 # main entry point
 # provide a job file and a data file
 if __name__ == '__main__':
@@ -731,15 +1087,31 @@ if __name__ == '__main__':
     if config:
         process_inputs(config)
         model = make_model(config)
+
+        # in worker mode, just run whatever the broker hands out
+        if model and config['worker']:
+            distrib.work(config['worker'], distrib.simulation_task(model))
+            sys.exit()
+
         jobs = make_jobs(config)
 
-        if model:
-            results = run_jobs(model, jobs, config)
+        if model and config['job_mode'] == 'sensitivity':
+            results, sens = run_sensitivity(model, jobs, config)
             output_results(jobs, results, config)
+            process_sensitivity(jobs, results, sens, config)
+            report_reuse(model)
+
+        elif model and config['job_mode'] == 'adaptive':
+            run_adaptive(model, jobs, config)
+            report_reuse(model)
+
+        elif model:
+            run_jobs(model, jobs, config)
+            report_reuse(model)
 
         else:
             print 'CONFIG:'
             pprint.pprint(config)
             print '----------'
-            print 'JOBS:'
-            pprint.pprint(jobs)
+            print 'JOBS: %d in total, first %d:' % (len(jobs), min(len(jobs), DRYRUN_JOBS))
+            pprint.pprint(list(itertools.islice(jobs, DRYRUN_JOBS)))
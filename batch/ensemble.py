@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# run a whole ensemble of parameter sets through a model at once, in vectorised NumPy,
+# using the module written by the bcmd compiler's -P option (see bparser/numpygen.py)
+# -- no C toolchain or subprocesses, so handy for quick exploratory scans and
+# screening ABC priors before committing to full simulations where the compiled
+# model isn't available
+# it is NOT a faster substitute for the compiled model: even spread across a large
+# ensemble, each member costs an order of magnitude more than a separate run of the
+# compiled program (for BrainSignals at n=1000, ~47ms against ~2.5ms), so anything
+# that can build and run the C model should do that instead
+# integration is by a linearly implicit Rosenbrock method (ROS2), which copes with
+# stiff systems and the algebraic equations of the mass matrix form, with the
+# Jacobian estimated by finite differences across all members in a single batch
+# of RHS calls; each member has its own adaptive step size, and members that fail
+# are dropped (their results are nan) without holding up the rest
+
+import sys, os, os.path
+import imp
+import numpy
+
+# defaults
+RTOL = 1e-6
+ATOL = 1e-8
+MAX_STEPS = 100000      # per output interval
+FIRST_STEP = 1e-3       # as a fraction of the first output interval
+
+# ROS2 coefficient
+GAMMA = 1 + 1 / numpy.sqrt(2)
+
+# step size controller limits
+SAFETY = 0.9
+MIN_FACTOR = 0.2
+MAX_FACTOR = 5
+
+# load a generated model module from its file
+def load(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return imp.load_source('bcmd_ensemble_' + name, filename)
+
+class Ensemble:
+    def __init__ ( self, module, n, rtol=RTOL, atol=ATOL, max_steps=MAX_STEPS ):
+        if isinstance(module, str):
+            module = load(module)
+        self.module = module
+        self.n = n
+        self.rtol = rtol
+        self.atol = atol
+        self.max_steps = max_steps
+
+        self.RPAR, self.Y = module.model_init(n)
+
+        # the error estimate only covers the differential variables: when an input
+        # changes, the algebraic ones jump to meet their constraints in one step,
+        # by an amount that doesn't shrink with the step size
+        self.differential = numpy.any(module.MASS != 0, axis=1)
+        if not numpy.any(self.differential):
+            self.differential[:] = True
+        self.failed = numpy.zeros(n, dtype=bool)
+        self.h = None
+
+    def index ( self, name ):
+        return self.module.SYMBOLS.index(name)
+
+    # assign a parameter or initial value, either one for all or one per member
+    def set ( self, name, values ):
+        self.RPAR[:, self.index(name)] = values
+        if name in self.module.ROOTS:
+            self.Y[:, self.module.ROOTS.index(name)] = values
+
+    # assign several parameters from a dict or a list of names and an [n, len(names)] array
+    def assign ( self, names, values=None ):
+        if values is None:
+            for name in names:
+                self.set(name, names[name])
+        else:
+            values = numpy.asarray(values)
+            for ii in range(len(names)):
+                self.set(names[ii], values[:, ii])
+
+    # current values of some fields (names or RPAR indices) for all members, as [n, len(fields)]
+    def values ( self, fields ):
+        indices = [ self.index(x) if isinstance(x, str) else x for x in fields ]
+        result = self.RPAR[:, indices].copy()
+        result[self.failed] = numpy.nan
+        return result
+
+    # bring RPAR up to date with the current state, including the intermediates
+    def refresh ( self ):
+        self.module.save_y(self.RPAR, self.Y)
+        with numpy.errstate(all='ignore'):
+            self.module.rhs(self.RPAR[:, 0].copy(), self.Y, self.RPAR)
+
+    # simulate from times[0], recording the given fields (default as the model)
+    # at each of the times, as an array [n, len(times), len(fields)]
+    # inputs optionally gives a sequence of values for some parameters, one per
+    # time (or an [n, len(times)] array), each assigned at the start of the
+    # interval that follows, as with inputs to the compiled model
+    def run ( self, times, fields=None, inputs=None ):
+        if fields is None:
+            fields = self.module.DEFAULT_FIELDS
+        inputs = inputs or {}
+        times = numpy.asarray(times, dtype=float)
+        result = numpy.empty((self.n, len(times), len(fields)))
+
+        self.RPAR[:, 0] = times[0]
+        self.apply(inputs, 0)
+        for kk in range(len(times)):
+            if kk > 0:
+                self.advance(times[kk-1], times[kk])
+                self.RPAR[:, 0] = times[kk]
+
+            self.refresh()
+            result[:, kk, :] = self.values(fields)
+
+            # the inputs for times[kk] hold over the interval that follows it
+            if kk > 0:
+                self.apply(inputs, kk)
+
+        return result
+
+    # assign the kk'th value of each input
+    def apply ( self, inputs, kk ):
+        for name in inputs:
+            values = numpy.asarray(inputs[name])
+            self.set(name, values[..., kk])
+        self.module.param_update(self.RPAR, self.Y)
+
+    # integrate all members from t0 to t1
+    def advance ( self, t0, t1 ):
+        if t1 <= t0:
+            return
+
+        t = numpy.empty(self.n)
+        t[:] = t0
+        if self.h is None:
+            self.h = numpy.empty(self.n)
+            self.h[:] = FIRST_STEP * (t1 - t0)
+        hmin = 1e-12 * max(abs(t1), abs(t1 - t0))
+
+        for step in range(self.max_steps):
+            active = numpy.nonzero((t < t1) & ~self.failed)[0]
+            if len(active) == 0:
+                return
+
+            h = numpy.minimum(self.h[active], t1 - t[active])
+            last = h >= (t1 - t[active]) * (1 - 1e-10)
+            h[last] = t1 - t[active][last]
+
+            ynew, err = self.step(t[active], h, self.Y[active], self.RPAR[active])
+
+            with numpy.errstate(all='ignore'):
+                ok = numpy.isfinite(err) & (err <= 1)
+                factor = SAFETY * err ** -0.5
+            factor[~numpy.isfinite(factor)] = MIN_FACTOR
+            factor = numpy.clip(factor, MIN_FACTOR, MAX_FACTOR)
+
+            done = active[ok]
+            self.Y[done] = ynew[ok]
+            t[done] = numpy.where(last[ok], t1, t[done] + h[ok])
+            self.h[active] = h * numpy.where(ok, factor, numpy.minimum(factor, 1))
+
+            lost = active[self.h[active] < hmin]
+            if len(lost):
+                print >> sys.stderr, 'ensemble: step size too small for %d members at t=%g, dropping them' % (len(lost), t0)
+                self.failed[lost] = True
+
+        remaining = (t < t1) & ~self.failed
+        print >> sys.stderr, 'ensemble: too many steps for %d members, dropping them' % numpy.sum(remaining)
+        self.failed[remaining] = True
+
+    # one ROS2 step for a subset of members, returning the new state and scaled error
+    def step ( self, t, h, y, RPAR ):
+        M = self.module.MASS
+        f = lambda tt, yy: self.module.rhs(tt, yy.copy(), RPAR)
+
+        with numpy.errstate(all='ignore'):
+            f0 = f(t, y)
+            J = self.jacobian(f, t, y, f0)
+            W = M[numpy.newaxis] - (GAMMA * h)[:, numpy.newaxis, numpy.newaxis] * J
+
+            k1 = solve(W, h[:, numpy.newaxis] * f0)
+            f1 = f(t + h, y + k1)
+            k2 = solve(W, h[:, numpy.newaxis] * f1 - 2 * numpy.dot(k1, M.T))
+
+            ynew = y + 1.5 * k1 + 0.5 * k2
+            scale = self.atol + self.rtol * numpy.maximum(numpy.abs(y), numpy.abs(ynew))
+            err = numpy.sqrt(numpy.mean(((0.5 * (k1 + k2)) / scale)[:, self.differential] ** 2, axis=1))
+
+        err[~numpy.all(numpy.isfinite(ynew), axis=1)] = numpy.inf
+        return ynew, err
+
+    # forward difference Jacobian for all members, as [m, nvars, nvars]
+    def jacobian ( self, f, t, y, f0 ):
+        nvars = y.shape[1]
+        J = numpy.empty((y.shape[0], nvars, nvars))
+        for jj in range(nvars):
+            delta = numpy.sqrt(numpy.finfo(float).eps) * numpy.maximum(numpy.abs(y[:, jj]), 1e-5)
+            yy = y.copy()
+            yy[:, jj] += delta
+            J[:, :, jj] = (f(t, yy) - f0) / delta[:, numpy.newaxis]
+        return J
+
+# solve the linear systems W x = b for a batch, leaving nan for any singular ones
+def solve ( W, b ):
+    try:
+        return numpy.linalg.solve(W, b[..., numpy.newaxis])[..., 0]
+    except numpy.linalg.LinAlgError:
+        x = numpy.empty(b.shape)
+        for ii in range(len(b)):
+            try:
+                x[ii] = numpy.linalg.solve(W[ii], b[ii])
+            except numpy.linalg.LinAlgError:
+                x[ii] = numpy.nan
+        return x
+
+# convenience wrapper: simulate an ensemble with the given parameter values (a dict
+# of name -> scalar or per-member values), returning the recorded fields at times
+def simulate ( module, n, params, times, fields=None, inputs=None, **kwargs ):
+    ens = Ensemble(module, n, **kwargs)
+    ens.assign(params)
+    return ens.run(times, fields, inputs)
@@ -0,0 +1,153 @@
+# simple differential evolution optimiser, for objectives that can evaluate a whole
+# population at once -- eg, by running all the simulations in parallel
+# the interface loosely mimics openopt's, so optim can use it interchangeably
+
+import sys
+import numpy as np
+import numpy.random as npr
+
+# defaults
+STRATEGY = 'rand1bin'
+STRATEGIES = ( 'rand1bin', 'best1bin', 'currenttobest1bin' )
+POPSIZE = 0         # 0 means 10 per dimension
+WEIGHT = 0.7        # differential weight, aka F
+CROSSOVER = 0.9     # crossover probability, aka CR
+MAX_ITER = 1000
+FTOL = 1e-6
+STALL = 0           # 0 means don't check for stalling
+
+# stop cases -- negative values indicate failure, as for openopt
+STOP_CONVERGED = 1
+STOP_STALLED = 2
+STOP_MAX_ITER = -7
+
+# minimal stand-in for the openopt result structure
+class result:
+    def __init__ ( self, xf, ff, istop, msg, niter, nevals ):
+        self.xf = xf
+        self.ff = ff
+        self.istop = istop
+        self.msg = msg
+        self.isFeasible = np.isfinite(ff)
+        self.niter = niter
+        self.nevals = nevals
+
+# f must take a list of candidate parameter vectors and return a corresponding
+# sequence of objective values (infinite or NaN values are treated as rejections)
+class DE:
+    def __init__ ( self,
+                   f,
+                   lb,
+                   ub,
+                   popsize=POPSIZE,
+                   weight=WEIGHT,
+                   crossover=CROSSOVER,
+                   maxIter=MAX_ITER,
+                   ftol=FTOL,
+                   stall=STALL,
+                   debug=False ):
+        self.f = f
+        self.lb = np.array(lb, dtype=float)
+        self.ub = np.array(ub, dtype=float)
+        self.popsize = popsize or 10 * len(self.lb)
+        self.weight = weight
+        self.crossover = crossover
+        self.maxIter = maxIter
+        self.ftol = ftol
+        self.stall = stall
+        self.debug = debug
+
+        if self.popsize < 4:
+            raise Exception('differential evolution needs a population of at least 4')
+
+    # evaluate the objective for a whole population, mapping non-finite values to inf
+    def evaluate ( self, pop ):
+        ff = np.array(self.f([ x for x in pop ]), dtype=float)
+        ff[~np.isfinite(ff)] = np.inf
+        return ff
+
+    # generate one trial vector for each population member
+    def mutate ( self, pop, fit, strategy ):
+        N, D = pop.shape
+        best = pop[np.argmin(fit)]
+        trials = np.empty_like(pop)
+
+        for ii in range(N):
+            others = [ x for x in range(N) if x != ii ]
+            r1, r2, r3 = npr.choice(others, 3, replace=False)
+
+            if strategy == 'best1bin':
+                donor = best + self.weight * (pop[r1] - pop[r2])
+            elif strategy == 'currenttobest1bin':
+                donor = pop[ii] + self.weight * (best - pop[ii]) + self.weight * (pop[r1] - pop[r2])
+            else:
+                donor = pop[r1] + self.weight * (pop[r2] - pop[r3])
+
+            # binomial crossover, guaranteeing at least one donor element
+            cross = npr.uniform(size=D) < self.crossover
+            cross[npr.randint(D)] = True
+            trials[ii] = np.where(cross, donor, pop[ii])
+
+        # bounce out-of-bounds elements back to a random point between the
+        # parent value and the bound, which keeps some memory of the parent
+        low = trials < self.lb
+        trials[low] = self.lb[np.where(low)[1]] + npr.uniform(size=np.sum(low)) * (pop[low] - self.lb[np.where(low)[1]])
+        high = trials > self.ub
+        trials[high] = self.ub[np.where(high)[1]] - npr.uniform(size=np.sum(high)) * (self.ub[np.where(high)[1]] - pop[high])
+
+        return trials
+
+    # run the optimisation, starting from a random population (including x0, if given)
+    # solver selects the mutation strategy; plot is accepted for compatibility with
+    # openopt but otherwise ignored, while debug (or the debug constructor arg) logs
+    # progress to stderr each iteration
+    def solve ( self, solver=STRATEGY, x0=None, plot=0, debug=0 ):
+        if solver not in STRATEGIES:
+            print >> sys.stderr, "unknown DE strategy '%s', using '%s'" % (solver, STRATEGY)
+            solver = STRATEGY
+
+        D = len(self.lb)
+        pop = self.lb + npr.uniform(size=(self.popsize, D)) * (self.ub - self.lb)
+        if x0 is not None:
+            pop[0] = np.clip(x0, self.lb, self.ub)
+
+        fit = self.evaluate(pop)
+        nevals = self.popsize
+        best = np.min(fit)
+        since = 0
+
+        istop = STOP_MAX_ITER
+        msg = 'max iterations limit has been reached'
+        niter = 0
+
+        for it in range(int(self.maxIter)):
+            niter = it + 1
+            trials = self.mutate(pop, fit, solver)
+            tfit = self.evaluate(trials)
+            nevals += self.popsize
+
+            better = tfit <= fit
+            pop[better] = trials[better]
+            fit[better] = tfit[better]
+
+            if debug or self.debug:
+                print >> sys.stderr, 'DE iter %d: best %g, mean %g' % (it, np.min(fit), np.mean(fit[np.isfinite(fit)]) if np.any(np.isfinite(fit)) else np.inf)
+
+            if np.min(fit) < best:
+                best = np.min(fit)
+                since = 0
+            else:
+                since += 1
+
+            if np.all(np.isfinite(fit)) and np.std(fit) <= self.ftol * np.abs(np.mean(fit)):
+                istop = STOP_CONVERGED
+                msg = 'population objective spread below ftol'
+                break
+
+            if self.stall and since >= self.stall:
+                istop = STOP_STALLED
+                msg = 'no improvement in %d iterations' % self.stall
+                break
+
+        ib = np.argmin(fit)
+        return result(pop[ib], fit[ib], istop, msg, niter, nevals)
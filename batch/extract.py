@@ -1,11 +1,35 @@
 #!/usr/bin/env python
 
 # yet another very simple hack to extract rows from a TXT/CSV file based on the value of (for the moment) one column
+# dsim results files are read via their indexed form (see results.py), which is built
+# on first use, so repeated extractions from the same file don't rescan all the text
 
 import sys, os, os.path
+import results
+
+# whether a file looks like dsim results, judging by its header
+def isResults (src):
+    if results.isCurrent(src):
+        return True
+    with open(src) as s:
+        head = s.readline().strip().split('\t')
+    return results.SPECIES in head and results.T0 in head
 
 def extract (src, dst, col, val):
     print 'opening files'
+    if isResults(src):
+        res = results.indexed_results(src)
+        if col != results.SPECIES and col not in res.columns:
+            print 'error: column "%s" not found in header' % col
+            return
+
+        print 'extracting...'
+        rows = res.select(col, val)
+        with open(dst, 'w') as d:
+            res.writeTSV(d, rows)
+        print 'done (%d rows)' % len(rows)
+        return
+
     with open(src) as s, open(dst, 'w') as d:
         line = s.readline().strip()
         # crude delimiter identification
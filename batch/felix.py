@@ -9,6 +9,7 @@ import numpy.random as rng
 import scipy.interpolate as spi
 import scipy.stats as sst
 import scipy.signal as sig
+import scipy.ndimage as ndi
 
 # for the moment, we keep these locally rather than requiring separate installation
 import wavepy as wv
@@ -17,21 +18,76 @@ import lowess
 # our signal generator module
 import siggen
 
+# rolling statistics are computed over blocks of this many windows at a time, which
+# bounds the memory used and the rounding error accumulated by the cumulative sums
+WINDOW_BLOCK = 4096
+
 # calculate a running function of some data -- SD by default
 # currently uses a shuffled-extension policy for boundaries, may add other options later
 def running ( x, margin=10, func=np.std ):
-    before = x[range(margin)]
-    after = x[range(len(x) - margin, len(x))]
+    x = np.asarray(x, dtype=float)
+    before = x[:margin].copy()
+    after = x[len(x) - margin:].copy()
     rng.shuffle(before)
     rng.shuffle(after)
     padded = np.concatenate((before,x,after))
     
-    result = np.zeros(len(x))
-    for ii in range(len(x)):
-        result[ii] = func(padded[range(ii, ii + 2 * margin + 1)])
+    return rolling(padded, 2 * margin + 1, func)
+
+# func applied to every window of width samples in x, returning len(x) - width + 1 values
+# functions with a rolling equivalent in ROLLING below take linear time; any other is
+# called on a block of strided windows at once, with an axis argument if it accepts one
+def rolling ( x, width, func=np.std ):
+    x = np.asarray(x, dtype=float)
+    n = len(x) - width + 1
+    result = np.zeros(max(n, 0))
+    fast = ROLLING.get(func)
+    
+    for start in range(0, n, WINDOW_BLOCK):
+        block = x[start:(start + WINDOW_BLOCK + width - 1)]
+        if fast is not None:
+            result[start:(start + len(block) - width + 1)] = fast(block, width)
+        else:
+            wins = windows(block, width)
+            try:
+                result[start:(start + len(wins))] = func(wins, axis=1)
+            except TypeError:
+                result[start:(start + len(wins))] = np.apply_along_axis(func, 1, wins)
     
     return result
 
+# all windows of width samples in 1d array x, as a strided view rather than a copy
+def windows ( x, width ):
+    x = np.ascontiguousarray(x)
+    return np.lib.stride_tricks.as_strided(x, shape=(len(x) - width + 1, width), strides=(x.strides[0], x.strides[0]))
+
+def rolling_sum ( x, width ):
+    cs = np.concatenate(([0], np.cumsum(x)))
+    return cs[width:] - cs[:-width]
+
+def rolling_mean ( x, width ):
+    return rolling_sum(x, width) / float(width)
+
+# centred first, to limit cancellation between the two means
+def rolling_var ( x, width ):
+    xc = x - np.mean(x)
+    mu = rolling_mean(xc, width)
+    return np.maximum(rolling_mean(xc * xc, width) - mu * mu, 0)
+
+def rolling_std ( x, width ):
+    return np.sqrt(rolling_var(x, width))
+
+# the extremes use scipy's linear-time running max/min filters, taking the windows
+# that lie wholly within x
+def rolling_max ( x, width ):
+    return ndi.maximum_filter1d(x, width, origin=-(width//2))[:(len(x) - width + 1)]
+
+def rolling_min ( x, width ):
+    return ndi.minimum_filter1d(x, width, origin=-(width//2))[:(len(x) - width + 1)]
+
+ROLLING = { np.std: rolling_std, np.var: rolling_var, np.mean: rolling_mean,
+            np.sum: rolling_sum, np.max: rolling_max, np.min: rolling_min }
+
 # segment a data array (assumed non-negative) based on a simple threshold
 # main use case is that x is the output of running(), above, but this is not required
 # TODO: allow elimination of small intervals
@@ -61,19 +117,20 @@ def fit_spline ( x, t=None, smoothness=None ):
 # consequences as above, but no model is returned (lowess currently doesn't create one)
 # span is the smoothing span, in (0, 1], controlling the smoothness
 # iter is the number of robustness iterations -- higher may be less biased, but slower
-def fit_lowess ( x, t=None, span=0.3, iter=4 ):
+# delta, if > 0, is the spacing in t of the points actually fitted, interpolating between
+def fit_lowess ( x, t=None, span=0.3, iter=4, delta=0.0 ):
     if t is None:
         t = np.linspace(0,1,len(x))
-    base = lowess.lowess(t, x, f=span, iter=iter)
+    base = lowess.lowess(t, x, f=span, iter=iter, delta=delta)
     return { 'baseline':base, 'signal': x - base, 't':t }
 
 # calculate offset for a segment wrt to the previous one by a mean value determined
 # from some portion of each according to the ad hoc rules in Table 1 of the paper
 def find_offset ( x1, x2, hz=20, alpha=None, beta=None ):
     if alpha is None:
-        alpha = np.round(hz/3)
+        alpha = int(np.round(hz/3))
     if beta is None:
-        beta = np.round(hz * 2)
+        beta = int(np.round(hz * 2))
     
     l1 = len(x1)
     if l1 < alpha:
@@ -81,7 +138,7 @@ def find_offset ( x1, x2, hz=20, alpha=None, beta=None ):
     elif l1 < beta:
         a = np.mean(x1[(-alpha):])
     else:
-        theta1 = np.ceil(l1/10)
+        theta1 = int(np.ceil(l1/10))
         a = np.mean(x1[(-theta1):])
     
     l2 = len(x2)
@@ -90,11 +147,22 @@ def find_offset ( x1, x2, hz=20, alpha=None, beta=None ):
     elif l2 < beta:
         b = np.mean(x2[:alpha])
     else:
-        theta2 = np.ceil(l2/10)
+        theta2 = int(np.ceil(l2/10))
         b = np.mean(x2[:theta2])
     
     return a-b
 
+# correct a single segment: bad ones have a fitted spline subtracted, good ones are
+# left alone -- returns the corrected piece and the fit, if any
+# bad segments too short for a cubic spline just have their mean subtracted
+def correct_segment ( x, bad, smoothness=None ):
+    if bad and len(x) <= 3:
+        return x - np.mean(x), None
+    if bad:
+        fit = fit_spline(x, smoothness=smoothness)
+        return fit['signal'], fit
+    return x, None
+
 # combined artefact removal algorithm
 def mara ( x, margin, thresh, hz=20, smoothness=None, func=np.std, alpha=None, beta=None, intermediates=True ):
     criterion = running(x, margin, func)
@@ -104,11 +172,7 @@ def mara ( x, margin, thresh, hz=20, smoothness=None, func=np.std, alpha=None, b
     fits = [None] * nn
     
     for ii in range(len(segs['start'])):
-        if segs['bad'][ii]:
-            fits[ii] = fit_spline(x[segs['start'][ii]:(segs['end'][ii]+1)], smoothness=smoothness)
-            pieces[ii] = fits[ii]['signal']
-        else:
-            pieces[ii] = x[segs['start'][ii]:(segs['end'][ii]+1)]
+        pieces[ii], fits[ii] = correct_segment(x[segs['start'][ii]:(segs['end'][ii]+1)], segs['bad'][ii], smoothness)
     
     offsets = [0] * nn
     for ii in range(1, nn):
@@ -119,7 +183,7 @@ def mara ( x, margin, thresh, hz=20, smoothness=None, func=np.std, alpha=None, b
     
     if intermediates:
         return { 'criterion' : criterion,
-                 'segments' : seg,
+                 'segments' : segs,
                  'pieces' : pieces,
                  'fits' : fits,
                  'shifts' : offsets,
@@ -127,6 +191,126 @@ def mara ( x, margin, thresh, hz=20, smoothness=None, func=np.std, alpha=None, b
     else:
         return final
 
+# streaming version of mara, for recordings too long to hold in memory
+# chunks of signal are pushed in as they arrive, and each push returns whatever
+# corrected signal is final so far -- flush returns the rest at the end
+# output lags input by margin samples plus the length of the open segment, since a
+# segment can't be corrected until it ends; max_segment caps this, closing a segment
+# once it reaches that length and treating the remainder as a new segment (a good
+# segment's continuation just keeps the same shift) -- without it, the output is the
+# same as mara's for the same random state
+class MaraStream:
+    def __init__ ( self, margin, thresh, hz=20, smoothness=None, func=np.std, alpha=None, beta=None, max_segment=None ):
+        self.margin = margin
+        self.thresh = thresh
+        self.hz = hz
+        self.smoothness = smoothness
+        self.func = func
+        self.alpha = alpha
+        self.beta = beta
+        self.max_segment = max_segment
+        
+        self.head = np.zeros(0)     # initial samples, until there are enough to pad the start
+        self.context = None         # trailing samples needed by the next windows
+        self.seg = []               # raw chunks of the open segment
+        self.seglen = 0
+        self.bad = None
+        self.continued = False      # whether the open segment continues a capped one
+        self.prev = None            # previous corrected piece
+        self.shift = 0
+        self.out = []
+    
+    def push ( self, chunk ):
+        chunk = np.asarray(chunk, dtype=float)
+        if self.context is None:
+            self.head = np.concatenate((self.head, chunk))
+            if len(self.head) < self.margin:
+                return np.zeros(0)
+            before = self.head[:self.margin].copy()
+            rng.shuffle(before)
+            chunk = np.concatenate((before, self.head))
+            self.context = np.zeros(0)
+            self.head = None
+        
+        self.context = np.concatenate((self.context, chunk))
+        self.criterion()
+        return self.collect()
+    
+    def flush ( self ):
+        if self.context is None:
+            raise Exception('stream too short: need at least %d samples' % self.margin)
+        after = self.context[len(self.context) - self.margin:].copy()
+        rng.shuffle(after)
+        self.context = np.concatenate((self.context, after))
+        self.criterion()
+        if self.seglen:
+            self.close(False)
+        return self.collect()
+    
+    # criterion for every sample whose window is now complete
+    def criterion ( self ):
+        width = 2 * self.margin + 1
+        if len(self.context) < width:
+            return
+        crit = rolling(self.context, width, self.func)
+        self.feed(self.context[self.margin:(self.margin + len(crit))], crit)
+        self.context = self.context[len(crit):]
+    
+    # add samples to the open segment, closing it wherever the criterion crosses the threshold
+    def feed ( self, x, crit ):
+        thrx = crit > self.thresh
+        bounds = np.concatenate(([0], 1 + np.flatnonzero(np.diff(thrx)), [len(x)]))
+        for ii in range(len(bounds) - 1):
+            bad = thrx[bounds[ii]]
+            if bad != self.bad:
+                if self.seglen:
+                    self.close(False)
+                else:
+                    self.continued = False
+                self.bad = bad
+            
+            run = x[bounds[ii]:bounds[ii+1]]
+            while len(run):
+                take = len(run)
+                if self.max_segment is not None:
+                    take = min(take, self.max_segment - self.seglen)
+                self.seg.append(run[:take])
+                self.seglen += take
+                run = run[take:]
+                if self.max_segment is not None and self.seglen >= self.max_segment:
+                    self.close(True)
+    
+    # correct the open segment and shift it into line with the previous one
+    def close ( self, capped ):
+        piece, fit = correct_segment(np.concatenate(self.seg), self.bad, self.smoothness)
+        if self.prev is None:
+            self.shift = 0
+        elif not (self.continued and not self.bad):
+            self.shift = find_offset(self.prev, piece, self.hz, self.alpha, self.beta)
+        piece = piece + self.shift
+        
+        self.out.append(piece)
+        self.prev = piece
+        self.continued = capped
+        self.seg = []
+        self.seglen = 0
+    
+    def collect ( self ):
+        result = np.concatenate(self.out) if self.out else np.zeros(0)
+        self.out = []
+        return result
+
+# generator wrapping MaraStream over an iterable of chunks
+def mara_stream ( chunks, margin, thresh, **kwargs ):
+    stream = MaraStream(margin, thresh, **kwargs)
+    for chunk in chunks:
+        result = stream.push(chunk)
+        if len(result):
+            yield result
+    result = stream.flush()
+    if len(result):
+        yield result
+
 # simulate a NIRI signal as a mixture of sinusoidal and noise componente
 # defaults are as described in the paper
 # f is frequency in Hz, mu is component amplitude, gamma is gaussian noise sd
@@ -151,7 +335,7 @@ def niri ( n=5000,
 def ma1 ( n=5000, jumps=6, mu=0, dv=3 ):
     result = np.zeros(n)
     for ii in range(jumps):
-        idx = np.floor(rng.rand(1)[0] * n)
+        idx = int(np.floor(rng.rand(1)[0] * n))
         off = rng.randn(1)[0] * dv + mu
         if rng.rand(1)[0] < 0.5:
             result[:idx] += off
@@ -163,7 +347,7 @@ def ma1 ( n=5000, jumps=6, mu=0, dv=3 ):
 def ma2 ( n=5000, spikes=6, mu=0, dv=5 ):
     result = np.zeros(n)
     for ii in range(spikes):
-        idx = np.floor(rng.rand(1)[0] * n)
+        idx = int(np.floor(rng.rand(1)[0] * n))
         result[idx] = rng.randn(1)[0] * dv + mu
     return result
 
@@ -203,15 +387,17 @@ def test ( margin=15, thresh=0.5, hz=20, smth=None, n=5000, jumps=6, spikes=6,
     return { 'signal': signal, 'off': off, 'combo': combo, 'clean': clean,  'stats': st }
 
 # Felix's slightly dubious dispersion measure -- product of std dev and MAD (why?)
-def std_mad ( x ):
-    return np.std(x) * mad(x)
+def std_mad ( x, axis=None ):
+    return np.std(x, axis=axis) * mad(x, axis=axis)
 
 # median absolute deviation
 # why this isn't defined in SciPy be default I have no idea
-# here we define only for a 1d array
 # default scale factor taken from R -- this may not match the Matlab original
-def mad ( x, scale=1.4826 ):
-    return scale * np.median(np.abs(x - np.median(x)))
+def mad ( x, scale=1.4826, axis=None ):
+    med = np.median(x, axis=axis)
+    if axis is not None:
+        med = np.expand_dims(med, axis)
+    return scale * np.median(np.abs(x - med), axis=axis)
 
 # Felix's multiscale SD discontinuity detection
 def msddd ( x, alpha=1e-5, kmin=1, kmax=52, step=10 ):
@@ -226,25 +412,23 @@ def msddd ( x, alpha=1e-5, kmin=1, kmax=52, step=10 ):
 def mswdd ( x, alpha=1e-5, nlevels=6, boundary=100, prop=0.1 ):
     # pad to the next power of two in size
     N = len(x)
-    maxlevs = np.ceil(np.log2(N))
+    maxlevs = int(np.ceil(np.log2(N)))
     newlen = 2 ** (1 + maxlevs)
     padlen = newlen - N
-    boundary = np.min((boundary, np.floor(prop * N)))
-    padbefore = rng.choice(x[0:boundary], np.ceil(padlen/2))
-    padafter = rng.choice(x[(N-boundary+1):N], np.floor(padlen/2))
+    boundary = int(min(boundary, np.floor(prop * N)))
+    padbefore = rng.choice(x[0:boundary], int(np.ceil(padlen/2.0)))
+    padafter = rng.choice(x[(N-boundary+1):N], padlen//2)
     padded = np.concatenate((padbefore, x, padafter))
     
     # get wavelet transform
-    J = np.min((nlevels + 1, maxlevs + 1))
-    vsg = wv.dwt.swt(padded, J, 'db1')[0].reshape(vsg, (J, newlen))
+    J = min(nlevels + 1, maxlevs + 1)
+    vsg = wv.dwt.swt(padded, J, 'db1')[0].reshape((-1, newlen))
 
     # shift rows to align the scale levels
-    shift = newlen/2
+    shift = newlen//2
     for ii in range(1, vsg.shape[0]):
-        idx = range(newlen - shift, newlen)
-        idx.extend(range(newlen - shift))
-        vsg[ii,] = vsg[ii, idx]
-        shift = shift/2
+        vsg[ii,] = np.roll(vsg[ii,], shift)
+        shift = shift//2
     
     # drop 1st (DC) row and padding
     vsg = vsg[1:,len(padbefore):(len(padbefore)+N)]
@@ -266,35 +450,50 @@ def discontinuities ( vsg, alpha=1e-5 ):
     return { 'vsg':vsg, 'vout':vout, 'idx1':idx1, 'idx2':idx2, 'asr':asr }
 
 # return index of outliers in a data set, as determined by a Thompson tau test
+# the data are sorted once: the point furthest from the median is always at one end
+# of what remains, so each round just trims the ends and reads the quantiles off
 def find_outliers ( x, alpha=1e-5 ):
     result = []
-    X = x.copy()
-    
-    mr = np.median(X)
-    q23 = np.percentile(X, [25, 75])
-    sr = (q23[1] - q23[0]) / 1.349
+    x = np.asarray(x)
+    order = np.argsort(x, kind='mergesort')
+    X = x[order]
+    lo, hi = 0, len(X)
     
-    val = np.max(np.abs(X - mr))
-    
-    while len(X) > 2 and val > sr * tau(len(X), alpha):
-        # indices of outlier value in original array
-        result.extend(np.flatnonzero(np.abs(x - mr) == val))
+    while hi - lo > 2:
+        mr = sorted_percentile(X[lo:hi], 50)
+        sr = (sorted_percentile(X[lo:hi], 75) - sorted_percentile(X[lo:hi], 25)) / 1.349
+        val = max(mr - X[lo], X[hi-1] - mr)
         
-        # remove outliers from working array
-        X = X[np.flatnonzero(np.flatnonzero(np.abs(X - mr) < val))]
-
-        # rinse and repeat
-        mr = np.median(X)
-        q23 = np.percentile(X, [25, 75])
-        sr = (q23[1] - q23[0]) / 1.349
+        if not val > sr * tau(hi - lo, alpha):
+            break
+        
+        # remove every point at that distance, from either end
+        newlo, newhi = lo, hi
+        while newlo < newhi and mr - X[newlo] >= val:
+            newlo += 1
+        while newhi > newlo and X[newhi-1] - mr >= val:
+            newhi -= 1
+        
+        # indices of outlier values in original array
+        result.extend(order[lo:newlo])
+        result.extend(order[newhi:hi])
+        lo, hi = newlo, newhi
     
     return result
 
+# percentile of already sorted data, interpolated as np.percentile does
+def sorted_percentile ( X, q ):
+    pos = (len(X) - 1) * q / 100.0
+    ii = int(np.floor(pos))
+    if ii + 1 >= len(X):
+        return X[-1]
+    return X[ii] + (X[ii+1] - X[ii]) * (pos - ii)
+
 # test value for the Thompson outlier test
 # N is the data count, alpha the significance level
 def tau ( N, alpha=1e-5 ):
     t = sst.t.ppf(alpha/2, N-2)
-    return t * (1 - N) / (np.sqrt(N) * sqrt(N - 2 + t * t))
+    return t * (1 - N) / (np.sqrt(N) * np.sqrt(N - 2 + t * t))
 
 # command-line invocation -- currently runs test with all defaults
 # dumping results to stdout as tab-delim text, stats to stderr
@@ -4,6 +4,16 @@
 
 import sys, os, os.path
 import csv
+import collections
+import numpy as np
+
+# pandas' C parser is much the fastest way to pull columns out of a big file,
+# but we can manage without
+try:
+    import pandas
+    PANDAS = True
+except ImportError:
+    PANDAS = False
 
 # this is a nasty hack whereby we guarantee that there will be no
 # collision between a time field imported from a braincirc input
@@ -11,6 +21,10 @@ import csv
 # from those names...
 LOCAL_TIME = ' t'
 
+# numeric columns parsed from a delimited file can be cached as .npy files in
+# a directory alongside it, named after the file with this suffix
+CACHE_SUFFIX = '.cache'
+
 # plausible input types to support:
 #
 #   csv, txt ...
@@ -26,20 +40,181 @@ def float_or_str(s):
     except ValueError:
         return s
 
+# guess the dialect of a delimited file from its start, leaving f rewound
+def sniff(f, default_dialect=csv.excel_tab):
+    try:
+        dialect = csv.Sniffer().sniff(f.read(1024), delimiters='\t,;')
+    except csv.Error as e:
+        #print e
+        dialect = default_dialect
+        
+    f.seek(0)
+    return dialect
+
+# lazily loaded columns of a delimited file, as a dictionary keyed by the header names
+# each column is only parsed when first asked for, so a job that uses a handful of
+# columns from a file with hundreds doesn't pay for the rest
+# columns that are entirely numeric are float arrays, others are lists converted
+# with float_or_str, as from readCSV
+# if cache is set, parsed numeric columns are saved as .npy files in a directory next
+# to the file, and memory-mapped from there next time, if newer than the file
+class Columns(collections.MutableMapping):
+    def __init__(self, filename, default_dialect=csv.excel_tab, cache=False):
+        self.filename = filename
+        self.cache = cache
+        self.loaded = {}
+        
+        with open(filename, 'rU') as f:
+            self.dialect = sniff(f, default_dialect)
+            header = next(csv.reader(f, dialect=self.dialect), [])
+        
+        # as with DictReader, the last of any duplicate names wins
+        self.index = dict([(name, ii) for ii, name in enumerate(header)])
+        self.names = [name for ii, name in enumerate(header) if self.index[name] == ii]
+    
+    def __contains__(self, name):
+        return name in self.loaded or name in self.index
+    
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            if name not in self.index:
+                raise KeyError(name)
+            self.load([name])
+        return self.loaded[name]
+    
+    def __setitem__(self, name, value):
+        self.loaded[name] = value
+    
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.loaded.pop(name, None)
+        if name in self.index:
+            del self.index[name]
+            self.names.remove(name)
+    
+    def __iter__(self):
+        for name in self.names:
+            yield name
+        for name in self.loaded:
+            if name not in self.index:
+                yield name
+    
+    def __len__(self):
+        return len(self.names) + len([name for name in self.loaded if name not in self.index])
+    
+    # parse any of the named columns not already loaded, in a single pass over the file
+    def load(self, names):
+        wanted = [name for name in names if name not in self.loaded and name in self.index]
+        
+        for name in wanted[:]:
+            cached = self.cached(name)
+            if cached is not None:
+                self.loaded[name] = cached
+                wanted.remove(name)
+        
+        if not wanted:
+            return
+        
+        indices = sorted([self.index[name] for name in wanted])
+        columns = self.parse(indices)
+        
+        for name in wanted:
+            col = columns[indices.index(self.index[name])]
+            self.loaded[name] = col
+            if self.cache and isinstance(col, np.ndarray):
+                self.save(name, col)
+    
+    # parse the given columns, as a list in the same order
+    def parse(self, indices):
+        if PANDAS:
+            frame = pandas.read_csv(self.filename, sep=self.dialect.delimiter, header=0,
+                                    usecols=indices, quotechar=self.dialect.quotechar,
+                                    skipinitialspace=self.dialect.skipinitialspace,
+                                    na_filter=False, engine='c')
+            return [ self.convert(frame.iloc[:, ii].values) for ii in range(len(indices)) ]
+        
+        try:
+            values = np.loadtxt(self.filename, delimiter=self.dialect.delimiter, skiprows=1,
+                                usecols=indices, ndmin=2)
+            return [ values[:, ii] for ii in range(len(indices)) ]
+        except ValueError:
+            pass
+        
+        # something non-numeric (or quoted), so do it the slow way
+        columns = [ [] for ii in indices ]
+        with open(self.filename, 'rU') as f:
+            reader = csv.reader(f, dialect=self.dialect)
+            next(reader, None)
+            for row in reader:
+                for jj in range(len(indices)):
+                    columns[jj].append(row[indices[jj]] if indices[jj] < len(row) else '')
+        return [ self.convert(np.array(col, dtype=object)) for col in columns ]
+    
+    # float array if the values are all numbers, otherwise list of float_or_str values
+    def convert(self, values):
+        if values.dtype.kind in 'biuf':
+            return values.astype(float)
+        values = [float_or_str(x) for x in values]
+        if all([isinstance(x, float) for x in values]):
+            return np.array(values)
+        return values
+    
+    def cachefile(self, name):
+        return os.path.join(self.filename + CACHE_SUFFIX, '%d.npy' % self.index[name])
+    
+    # cached column, memory-mapped copy-on-write, or None if absent or stale
+    def cached(self, name):
+        if not self.cache:
+            return None
+        path = self.cachefile(name)
+        try:
+            if os.path.getmtime(path) < os.path.getmtime(self.filename):
+                return None
+            return np.load(path, mmap_mode='c')
+        except (IOError, OSError, ValueError):
+            return None
+    
+    # caching is only an optimisation, so failure to write is silently ignored
+    # (written under a temporary name and renamed, in case of concurrent jobs)
+    def save(self, name, col):
+        path = self.cachefile(name)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(temp, 'wb') as f:
+                np.save(f, col)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            pass
+
 # attempt to read a CSV/TXT file as a dictionary, keyed by the header names
 # columns are lists, converted into floats where possible, otherwise left as strings
-def readCSV(filename, wrap_timeseries=True, default_dialect=csv.excel_tab):
+# if lazy, the result is instead a Columns object, parsing each column only when
+# it is first used -- optionally caching the parsed numbers (see above)
+# if a list of columns is given, only those are read (and returned in a plain
+# dictionary, as for Columns), any not in the file being ignored
+def readCSV(filename, wrap_timeseries=True, default_dialect=csv.excel_tab, columns=None, lazy=False, cache=False):
+    if lazy or columns is not None:
+        result = Columns(filename, default_dialect, cache)
+        if columns is not None:
+            result.load(columns)
+            result = dict([(name, result[name]) for name in columns if name in result])
+    else:
+        result = readAllCSV(filename, default_dialect)
+    
+    if wrap_timeseries:
+        return {'timeseries': result}
+    else:
+        return result
+
+# read every column of a CSV/TXT file as a list
+def readAllCSV(filename, default_dialect=csv.excel_tab):
     result = {}
     
     with open(filename, 'rU') as f:
-        try:
-            dialect = csv.Sniffer().sniff(f.read(1024), delimiters='\t,;')
-        except csv.Error as e:
-            #print e
-            dialect = default_dialect
-            
-        f.seek(0)
-        
+        dialect = sniff(f, default_dialect)
         dr = csv.DictReader(f, dialect=dialect)
         
         for row in dr:
@@ -51,16 +226,15 @@ def readCSV(filename, wrap_timeseries=True, default_dialect=csv.excel_tab):
                 else:
                     result[kk] = [val]
     
-    if wrap_timeseries:
-        return {'timeseries': result}
-    else:
-        return result
+    return result
 
 # attempt to read a braincirc input file
 # this is closely based on the equivalent function in steps.py, and
 # eventually I'll try to unify the two, but for the moment the
 # outputs are a bit different (as is the intent)
 # (we optionally also support bcmd-style comments, since that doesn't really conflict)
+# the data section becomes a float array if every row has the same length, otherwise
+# a list of lists of floats as before
 def readBraincirc(filename, bcmd_comments=True):
     indata = False
     header = {}
@@ -76,7 +250,7 @@ def readBraincirc(filename, bcmd_comments=True):
                 continue
             
             if indata:
-                data.append([float(d) for d in line.split()])
+                data.append(line.split())
                 
             elif line.startswith('******'):
                 indata = True
@@ -102,35 +276,46 @@ def readBraincirc(filename, bcmd_comments=True):
                 except (ValueError, KeyError):
                     print >> sys.stderr, 'Unable to interpret line: "%s" (skipping)' % line
     
+    # conversion in one go is much quicker than value by value
+    if data and len(set([len(row) for row in data])) == 1:
+        data = np.array(data, dtype=float)
+    else:
+        data = [[float(d) for d in row] for row in data]
+    
     # for input files doing stepwise parameter assignments, attempt to transpose data
     # into a dictionary with a vector of values for each field, like the CSV input
-    if data and 'chosen_param' in header:
+    if len(data) and 'chosen_param' in header:
         if 'time_step' in header:
             tt = float(header['time_step'][0][0])
-            timeseries[LOCAL_TIME] = [x * tt for x in range(len(data))]
+            timeseries[LOCAL_TIME] = np.arange(len(data)) * tt
             tsnames = header['chosen_param'][0]
         else:
             # time steps are being specified explicitly
-            tsnames = [LOCAL_TIME] + header['chosen_param']
-        
-        for name in tsnames: timeseries[name] = []
+            tsnames = [LOCAL_TIME] + header['chosen_param'][0]
         
-        for row in data:
+        if isinstance(data, np.ndarray) and data.shape[1] >= len(tsnames):
             for ii in range(len(tsnames)):
-                if ii > len(row):
-                    timeseries[tsnames[ii]].append('NA')
-                else:
-                    timeseries[tsnames[ii]].append(row[ii])
+                timeseries[tsnames[ii]] = data[:, ii]
+        else:
+            for name in tsnames: timeseries[name] = []
+            
+            for row in data:
+                for ii in range(len(tsnames)):
+                    if ii >= len(row):
+                        timeseries[tsnames[ii]].append('NA')
+                    else:
+                        timeseries[tsnames[ii]].append(row[ii])
     
     return { 'header': header, 'data':data, 'pvals':pvals, 'timeseries':timeseries }
 
 # despatch to relevant file reader based on file extension
 # (might get more sophisticated later, but probably won't)
-def readFile(name, wrap_csv=True):
+# delimited files are read lazily unless otherwise specified
+def readFile(name, wrap_csv=True, lazy=True, cache=False):
     if name.lower().endswith('.dat') or name.lower().endswith('job'):
         return readBraincirc(name)
     if name.lower().endswith('.csv') or name.lower().endswith('.txt') or name.lower().endswith('.out'):
-        return readCSV(name, wrap_csv)
+        return readCSV(name, wrap_csv, lazy=lazy, cache=cache)
     
     # that's all we know about so far...
     return 'Unknown type for file: %s' % name
@@ -202,4 +387,4 @@ if __name__ == '__main__':
     import pprint
     
     for file in sys.argv[1:]:
-        pprint.pprint(readFile(file))
+        pprint.pprint(readFile(file, lazy=False))
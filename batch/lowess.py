@@ -1,36 +1,139 @@
 # adaptation of the lowess function from BioPython to work in isolation
+# rather than weighting every point against every other, the data are sorted and each
+# local regression only visits the window of neighbours with non-zero weight, which
+# takes O(n*k) time for k = f*n, and memory bounded by BLOCK
 import numpy as np
 import numpy.random as rng
 
-def lowess(x, y, f=2. / 3., iter=3):
+# maximum number of (fit point, neighbour) weights held at once
+BLOCK = 2 ** 20
+
+# f is the smoothing span, as a fraction of the data, and iter the number of fitting
+# passes, all but the first reweighted for robustness against outliers
+# if delta > 0, the regression is only computed at points at most delta apart in x,
+# with linear interpolation between them, as in Cleveland's original lowess
+def lowess(x, y, f=2. / 3., iter=3, delta=0.0):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
     n = len(x)
-    r = int(np.ceil(f * n))
-    h = [np.sort(abs(x - x[ii]))[r] for ii in xrange(n)]
-    w = np.clip(abs(([x] - np.transpose([x])) / h), 0.0, 1.0)
-    w = 1 - w * w * w
-    w = w * w * w
+    
+    order = np.argsort(x, kind='mergesort')
+    xs = x[order]
+    ys = y[order]
+    
+    r = min(int(np.ceil(f * n)), n - 1)
+    anchors = anchor_points(xs, delta)
+    h = neighbour_distance(xs, anchors, r)
+    
+    # window of neighbours within h of each anchor
+    xa = xs[anchors]
+    lo = np.searchsorted(xs, xa - h, side='right')
+    hi = np.searchsorted(xs, xa + h, side='left')
+    tied = h <= 0
+    lo[tied] = np.searchsorted(xs, xa[tied], side='left')
+    hi[tied] = np.searchsorted(xs, xa[tied], side='right')
+    h[tied] = 1
+    
     yest = np.zeros(n)
     delta = np.ones(n)
     for iteration in xrange(iter):
-        for ii in xrange(n):
-            weights = delta * w[:, ii]
-            weights_mul_x = weights * x
-            b1 = np.dot(weights, y)
-            b2 = np.dot(weights_mul_x, y)
-            A11 = sum(weights)
-            A12 = sum(weights_mul_x)
-            A21 = A12
-            A22 = np.dot(weights_mul_x, x)
-            determinant = A11 * A22 - A12 * A21
-            beta1 = (A22 * b1 - A12 * b2) / determinant
-            beta2 = (A11 * b2 - A21 * b1) / determinant
-            yest[ii] = beta1 + beta2 * x[ii]
-        residuals = y - yest
+        fit = local_fit(xs, ys, delta, xa, h, lo, hi)
+        if len(anchors) < n:
+            yest[:] = np.interp(xs, xa, fit)
+        else:
+            yest[:] = fit
+        
+        if iteration == iter - 1:
+            break
+        residuals = ys - yest
         s = np.median(abs(residuals))
+        if s <= 0:
+            break
         delta[:] = np.clip(residuals / (6 * s), -1, 1)
         delta[:] = 1 - delta * delta
         delta[:] = delta * delta
-    return yest
+    
+    result = np.zeros(n)
+    result[order] = yest
+    return result
+
+# indices of the points (of sorted xs) at which to compute the regression: every one
+# if delta is 0, otherwise the furthest point within delta of the last, always moving
+# on by at least one and always including the final point
+def anchor_points(xs, delta):
+    n = len(xs)
+    if delta <= 0 or n < 3:
+        return np.arange(n)
+    
+    anchors = [0]
+    last = 0
+    while last < n - 1:
+        last = max(last + 1, np.searchsorted(xs, xs[last] + delta, side='right') - 1)
+        anchors.append(last)
+    return np.array(anchors)
+
+# distance from each anchor to its r'th nearest neighbour (counting itself as the
+# 0th) -- in sorted data the r+1 nearest neighbours are a contiguous run, so this
+# bisects for the start of that run, for all the anchors at once
+def neighbour_distance(xs, anchors, r):
+    n = len(xs)
+    xa = xs[anchors]
+    first = np.maximum(0, anchors - r)
+    last = np.minimum(anchors, n - 1 - r)
+    
+    # first start at which the run reaches at least as far right as left
+    a = first.copy()
+    b = last + 1
+    while np.any(a < b):
+        active = a < b
+        mid = np.minimum((a + b) // 2, last)
+        right = xs[mid + r] - xa >= xa - xs[mid]
+        b = np.where(active & right, mid, b)
+        a = np.where(active & ~right, mid + 1, a)
+    
+    h = np.inf * np.ones(len(anchors))
+    for start in (a, a - 1):
+        ok = (start >= first) & (start <= last)
+        s = np.where(ok, start, first)
+        h = np.where(ok, np.minimum(h, np.maximum(xa - xs[s], xs[s + r] - xa)), h)
+    return h
+
+# tricube-weighted linear regression about each anchor over its window, centred on the
+# anchor so that the fitted value is just the intercept -- degenerate windows (only one
+# distinct x) fall back to the weighted mean
+def local_fit(xs, ys, delta, xa, h, lo, hi):
+    fit = np.zeros(len(xa))
+    width = max(int(np.max(hi - lo)), 1)
+    rows = max(BLOCK // width, 1)
+    offsets = np.arange(width)
+    
+    for start in xrange(0, len(xa), rows):
+        end = min(start + rows, len(xa))
+        idx = lo[start:end, np.newaxis] + offsets
+        inside = idx < hi[start:end, np.newaxis]
+        idx = np.minimum(idx, len(xs) - 1)
+        
+        xc = xs[idx] - xa[start:end, np.newaxis]
+        w = np.clip(abs(xc) / h[start:end, np.newaxis], 0.0, 1.0)
+        w = 1 - w * w * w
+        w = w * w * w
+        weights = w * delta[idx] * inside
+        
+        weights_mul_x = weights * xc
+        b1 = np.sum(weights * ys[idx], axis=1)
+        b2 = np.sum(weights_mul_x * ys[idx], axis=1)
+        A11 = np.sum(weights, axis=1)
+        A12 = np.sum(weights_mul_x, axis=1)
+        A22 = np.sum(weights_mul_x * xc, axis=1)
+        determinant = A11 * A22 - A12 * A12
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            linear = (A22 * b1 - A12 * b2) / determinant
+            mean = b1 / A11
+        ok = determinant > 1e-12 * A11 * A22
+        fit[start:end] = np.where(ok, linear, mean)
+    
+    return fit
 
 # simple test driver
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+# LRU cache for optimisation objectives, so that (nearly) repeated parameter
+# vectors don't cost another model run
+# keys are the parameter vector quantised to a number of significant digits,
+# qualified by a signature identifying the model, inputs and data, which means
+# one cache -- and one cache file -- can safely be shared between jobs
+
+import os, os.path, sys
+import collections
+import cPickle as pickle
+
+# defaults
+SIZE = 10000
+DIGITS = 10
+SAVE_INTERVAL = 100     # save after this many new entries, if there's a file
+
+class ObjectiveCache:
+    def __init__ ( self, size=SIZE, digits=DIGITS, filename=None, save_interval=SAVE_INTERVAL ):
+        self.size = size
+        self.digits = digits
+        self.filename = filename
+        self.save_interval = save_interval
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = 0
+
+        if filename and os.path.exists(filename):
+            self.load()
+
+    # quantised key for parameter vector p in the context identified by signature
+    def key ( self, signature, p ):
+        return (signature, tuple([ float('%.*g' % (self.digits, x)) for x in p ]))
+
+    # look up a key, returning None if it's absent
+    def get ( self, key ):
+        if key in self.entries:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put ( self, key, value ):
+        if key in self.entries:
+            self.entries.pop(key)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        self.unsaved += 1
+        if self.filename and self.save_interval and self.unsaved >= self.save_interval:
+            self.save()
+
+    # wrap a single-vector objective function
+    def wrap ( self, f, signature ):
+        def g ( p ):
+            key = self.key(signature, p)
+            value = self.get(key)
+            if value is None:
+                value = f(p)
+                self.put(key, value)
+            return value
+        return g
+
+    # wrap a batch objective function, which takes a list of vectors and returns a
+    # list of values -- only the distinct vectors not already cached are passed on
+    def wrapBatch ( self, f, signature ):
+        def g ( pp ):
+            keys = [ self.key(signature, p) for p in pp ]
+            values = [ self.get(key) for key in keys ]
+            todo = collections.OrderedDict()
+            for ii in range(len(pp)):
+                if values[ii] is None and keys[ii] not in todo:
+                    todo[keys[ii]] = ii
+            if todo:
+                fresh = dict(zip(todo.keys(), f([ pp[ii] for ii in todo.values() ])))
+                for key in todo:
+                    self.put(key, fresh[key])
+                values = [ fresh[key] if value is None else value for key, value in zip(keys, values) ]
+            return values
+        return g
+
+    def load ( self ):
+        try:
+            with open(self.filename, 'rb') as f:
+                entries = pickle.load(f)
+            for key in entries:
+                self.entries[key] = entries[key]
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        except Exception as e:
+            print >> sys.stderr, 'unable to load objective cache from %s: %s' % (self.filename, e)
+
+    # write the cache to its file, if it has one, via a temp file so that
+    # an interrupted save doesn't lose the previous contents
+    def save ( self ):
+        if not self.filename:
+            return
+
+        temp = self.filename + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, self.filename)
+            self.unsaved = 0
+        except Exception as e:
+            print >> sys.stderr, 'unable to save objective cache to %s: %s' % (self.filename, e)
+
+    def report ( self ):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0
+        return 'Objective cache: %d hits, %d misses (%.1f%% hit rate), %d entries' % (self.hits, self.misses, rate, len(self.entries))
@@ -8,6 +8,10 @@ import csv
 import os
 import copy
 import sys
+import subprocess
+import hashlib
+import signal
+import collections
 
 import steps
 import distance
@@ -18,6 +22,15 @@ from multiprocessing import Process, Queue
 # default timeout, in seconds
 TIMEOUT = 30
 
+# distance functions that the model runtime can mirror for early termination,
+# mapped to its metric name and whether all the vars are pooled into one distance
+RUNTIME_METRICS = { 'euclidean': ('euclidean', False),
+                    'manhattan': ('manhattan', False),
+                    'meandist': ('mean', False),
+                    'euclideanDistance': ('euclidean', True),
+                    'manhattanDistance': ('manhattan', True),
+                    'meanDistance': ('mean', True) }
+
 # translate prior specs into the (abcsmc) expected numeric triplets
 def translate_prior( param ):
     prior = [0, 0, 0]
@@ -57,22 +70,35 @@ def sample(n, triplet):
         result[:] = numpy.random.lognormal(triplet[1], numpy.sqrt(triplet[2]), n)
     return result
 
+# a reproducible description of a function for signature hashing, including any
+# values captured by closures such as those from posthoc.get or distance.loglikWithSigma
+def describe( f ):
+    cells = getattr(f, 'func_closure', None) or []
+    return (getattr(f, '__name__', repr(f)), repr([ c.cell_contents for c in cells ]))
+
+# outer function to compute the shared state for a particle's beta replicates
+# and queue its snapshot name, for use when running multiple processes in parallel
+def snapshot_proc (n, params, queue, do_perturb, obj):
+    state = obj.particleState(n, params, do_perturb=do_perturb)
+    queue.put({'n': n, 'state': state})
+
 # outer function to run a single model invocation and queue its results
 # for use when running multiple processes in parallel
-def bcmd_proc (beta, n, params, queue, do_perturb, obj):
-    # create the input file
-    seq = obj.baseSeq[:]
-    seq += steps.abcParamSequence(obj.initnames, params)
-    seq += steps.makeSteadySequence(True)
-    seq += steps.abcAbsoluteSequence(obj.times, obj.perturb(do_perturb), obj.vars, outhead=False)
-    input = os.path.join(obj.workdir, '%s_%d_%d.input' % (obj.name, n, beta))
-    steps.writeSequence(seq, input)
+# (if a particle state is given, the parameter setup is taken from it rather than repeated)
+def bcmd_proc (beta, n, params, queue, do_perturb, obj, state=None):
+    # create the input file -- the same one a single run would use
+    input = obj.writeInput(beta, n, params, do_perturb, state=state)
 
     output = os.path.join(obj.workdir, '%s_%d_%d.out' % (obj.name, n, beta))
     
+    # start from the particle state if we have one, otherwise the base state (if any)
+    command = obj.command(input, output, state=(state or obj.baseState()))
+    if obj.bailout:
+        command += obj.bailout
+    
     if obj.suppress:
         # invoke the model
-        succ = abortable.call([obj.program, '-i', input, '-o', output], stdout=obj.DEVNULL, stderr=obj.DEVNULL, timeout=obj.timeout )    
+        succ = abortable.call(command, stdout=obj.DEVNULL, stderr=obj.DEVNULL, timeout=obj.timeout )    
     else:
         # create files to hold log values
         stdoutname = os.path.join(obj.workdir, '%s_%d_%d.stdout' % (obj.name, n, beta))
@@ -84,13 +110,15 @@ def bcmd_proc (beta, n, params, queue, do_perturb, obj):
         except IOError: f_err = None
     
         # invoke the model
-        succ = abortable.call([obj.program, '-i', input, '-o', output], stdout=f_out, stderr=f_err, timeout=obj.timeout )
+        succ = abortable.call(command, stdout=f_out, stderr=f_err, timeout=obj.timeout )
    
         if f_out: f_out.close()
         if f_err: f_err.close()
 
     # read the results
     result = numpy.zeros([len(obj.times), obj.nspecies])
+    if obj.bailout:
+        result.fill(numpy.nan)
     ii = 0
     if succ:
         with open(output, 'rb') as tabfile:
@@ -103,7 +131,32 @@ def bcmd_proc (beta, n, params, queue, do_perturb, obj):
         result[:] = float('nan')
     
     # send them back to the master process
-    queue.put({'n': n, 'data': result})
+    queue.put({'n': n, 'beta': beta, 'data': result})
+
+# as bcmd_proc, but in a process group of its own, so that the run can be
+# cancelled along with the model program it invokes -- see submit and cancel
+def async_proc (beta, n, params, queue, do_perturb, obj):
+    os.setpgrp()
+    bcmd_proc(beta, n, params, queue, do_perturb, obj)
+
+# as async_proc, but running the particle's parameter setup once, as snapshot_proc
+# does, and starting all its beta replicates from there
+def async_particle_proc (beta, n, params, queue, do_perturb, obj):
+    os.setpgrp()
+    state = obj.particleState(n, params, do_perturb=do_perturb)
+    procs = [ Process(target=bcmd_proc, args=(ii, n, params, queue, do_perturb, obj, state)) for ii in range(beta) ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+# abandon runs started by model_bcmd.submit that are no longer wanted
+def cancel (procs):
+    for proc in procs:
+        if proc.is_alive():
+            try: os.killpg(proc.pid, signal.SIGTERM)
+            except OSError: pass
+        proc.join()
 
 class model_bcmd:
 
@@ -122,7 +175,12 @@ class model_bcmd:
                   suppress=True,           # suppress stdout and stderr in subprocesses
                   reseed=True,             # reseed the random number generator
                   steady=1000,
+                  steady_method='integrate', # or 'solve' or 'settle' -- see steps.makeSteadySequence
+                  steady_tol=None,         # residual threshold for solve/settle, None for the model default
+                  snapshots=True,          # run shared sequence prefixes once and start the remainder from saved state
                   timeout=TIMEOUT,
+                  cache=None,              # simcache.SimulationCache for reusing deterministic results
+                  executor=None,           # runs simulations elsewhere instead, eg distrib.RemoteSimulator
                   debug=False
                 ):
         
@@ -150,6 +208,7 @@ class model_bcmd:
         self.fixvals = numpy.array([ x['default'] for x in fixed ])
         
         self.have_perturbations = any([ p.get('dist', '') in ['normal', 'uniform'] for p in inputs ])
+        self.series = {}
         
         # we'll always arrange for output to match data, so default behaviour should be correct
         self.fit = None
@@ -170,7 +229,19 @@ class model_bcmd:
         
         self.reseed = reseed
         self.steady = steady
+        self.steady_method = steady_method
+        self.steady_tol = steady_tol
+        self.snapshots = snapshots
+        self.base_state = None
+        self.symbol_names = None
+        self.bailout = None
         self.timeout = timeout
+        self.cache = cache
+        self.executor = executor
+        self.duplicates = 0
+        self.sim_signature = None
+        self.inflight = {}
+        self.inflight_queue = None
         self.debug = debug
     
     # destructor -- clean up
@@ -185,10 +256,12 @@ class model_bcmd:
     # for the moment we assume n=1, beta=1
     # if no comparison data has been provided, reference level is 0 (ie distance = signal)
     # result is the weighted sum of distances (or just the straight sum if weights aren't provided)
+    # if a cache (memo.ObjectiveCache) is given, evaluations are looked up there first
     def optimisable ( self,
                       dist=distance.euclidean,
                       weights=[],
-                      debug=False ):
+                      debug=False,
+                      cache=None ):
         if debug:
             def f ( p ):
                 print >> sys.stderr, p
@@ -204,52 +277,188 @@ class model_bcmd:
                                       n=1,
                                       beta=1,
                                       do_perturb=False )
-                tot = 0
-                for ii in range(len(self.vars)):
-                    target = self.vars[ii].get('points',0)
-                    signal = sim[0,0,:,ii]
-                    for post in self.vars[ii]['post']:
-                        signal = post(signal)
-                    
-                    dd = dist(signal, target)
-                    
-                    if self.debug:
-                        print >> sys.stderr, 'distance due to %s: %f' % (self.vnames[ii], dd)
-                
-                    if weights and len(weights) > ii:
-                        tot += weights[ii] * dd
-                    else:
-                        tot += dd
-                        
-                if self.debug:
-                    print >> sys.stderr, 'total distance: %f' % tot
-                return tot
+                return self.totalDistance(sim[0,0,:,:], dist, weights)
+            
+            if cache:
+                return cache.wrap(f, self.signature(dist, weights))
         
         return f
     
+    # as optimisable, but the returned function takes a list of parameter vectors and
+    # returns a list of distances, running up to nbatch of the simulations in parallel
+    def batchOptimisable ( self,
+                           dist=distance.euclidean,
+                           weights=[],
+                           nbatch=1,
+                           cache=None ):
+        def f ( pp ):
+            result = []
+            for start in range(0, len(pp), nbatch):
+                chunk = [ numpy.concatenate((p,self.vdefaults)) for p in pp[start:(start + nbatch)] ]
+                sim = self.simulate ( chunk,
+                                      t=self.times,
+                                      n=len(chunk),
+                                      beta=1,
+                                      do_perturb=False )
+                result.extend([ self.totalDistance(sim[ii,0,:,:], dist, weights) for ii in range(len(chunk)) ])
+            return result
+        
+        if cache:
+            return cache.wrapBatch(f, self.signature(dist, weights))
+        return f
+    
+    # a hash identifying everything other than the optimised parameter values
+    # that determines the result of an objective function -- ie, the model program,
+    # inputs, target data, fixed parameters and distance settings
+    def signature ( self, dist, weights ):
+        sha = hashlib.sha1(self.simSignature())
+        sha.update(repr([ [ (x['name'], list(numpy.atleast_1d(x.get('points', 0))), [ describe(p) for p in x['post'] ]) for x in self.vars ],
+                          self.vdefaults, describe(dist), list(weights), self.bailout ]))
+        return sha.hexdigest()
+    
+    # a hash identifying everything other than the parameter values that determines
+    # the result of a (deterministic) simulation -- ie, the model program and its setup
+    # -- which is all fixed at construction, so this is only worked out once
+    # the bailout threshold is deliberately left out: a run that completes gives the
+    # same results whatever the threshold, and abandoned runs aren't cached (see cacheable)
+    def simSignature ( self ):
+        if self.sim_signature is None:
+            sha = hashlib.sha1()
+            with open(self.program, 'rb') as f:
+                sha.update(f.read())
+            
+            sha.update(repr([ list(self.times),
+                              [ (x['name'], list(x.get('points', []))) for x in self.inputs ],
+                              self.initnames, self.fixnames, list(self.fixvals),
+                              self.baseSeq, self.steady, self.steady_method, self.steady_tol ]))
+            self.sim_signature = sha.hexdigest()
+        return self.sim_signature
+    
+    # whether simulation results are worth caching -- failed runs aren't, since they may
+    # just have timed out, and nor are runs with any NaNs when bailing out, since they
+    # may have been abandoned under a threshold that won't apply next time
+    def cacheable ( self, sims ):
+        if self.bailout:
+            return not numpy.any(numpy.isnan(sims))
+        return not numpy.all(numpy.isnan(sims))
+    
+    # the weighted sum of distances between a simulation's outputs
+    # (a [len(t) x nspecies] array) and the target var values
+    def totalDistance ( self, sim, dist, weights=[] ):
+        tot = 0
+        for ii in range(len(self.vars)):
+            target = self.vars[ii].get('points',0)
+            signal = sim[:,ii]
+            for post in self.vars[ii]['post']:
+                signal = post(signal)
+            
+            dd = dist(signal, target)
+            
+            if self.debug:
+                print >> sys.stderr, 'distance due to %s: %f' % (self.vnames[ii], dd)
+        
+            if weights and len(weights) > ii:
+                tot += weights[ii] * dd
+            else:
+                tot += dd
+                
+        if self.debug:
+            print >> sys.stderr, 'total distance: %f' % tot
+        return tot
+    
     # set up, call out to run the actual simulation(s), read and collate the results
+    # if the simulations are deterministic, repeated parameter vectors are only run once,
+    # and results are looked up in (and added to) the cache, if there is one
     def simulate( self,
                   p,                    # parameter values drawn by abcsmc (a list of n lists)
                   t,                    # the time points to simulate -- we're going to make the possibly-wrong assumption that these always stay as originally specified
                   n,                    # number of parallel simulations, as passed into abcsmc
                   beta,                 # number of runs with a particular param draw -- potentially useful if perturbing, since that makes the model non-deterministic
                   do_perturb=True ):    # include perturbations if in spec (set False to override)
+        if do_perturb and self.have_perturbations:
+            return self.runSimulations(p, t, n, beta, do_perturb)
+        
+        result = numpy.zeros([n, beta, len(t), self.nspecies])
+        keys = [ self.simKey(p[jj], beta) for jj in range(n) ]
+        
+        # distinct jobs that need running, with their positions in the batch
+        todo = collections.OrderedDict()
+        for jj in range(n):
+            if keys[jj] in todo:
+                todo[keys[jj]].append(jj)
+                self.duplicates += 1
+                continue
+            
+            cached = self.cache.get(keys[jj]) if self.cache else None
+            if cached is not None and cached.shape == result.shape[1:]:
+                result[jj] = cached
+            else:
+                todo[keys[jj]] = [jj]
+        
+        if todo:
+            first = [ todo[key][0] for key in todo ]
+            fresh = self.runSimulations([ p[jj] for jj in first ], t, len(first), beta, do_perturb)
+            for ii, key in enumerate(todo):
+                for jj in todo[key]:
+                    result[jj] = fresh[ii]
+                
+                if self.cache and self.cacheable(fresh[ii]):
+                    self.cache.put(key, fresh[ii])
+        
+        return result
+    
+    # identifies a deterministic simulation, for duplicate checks and cache lookups
+    def simKey( self, params, beta ):
+        if self.cache:
+            return self.cache.key(self.simSignature(), params, beta)
+        return tuple(numpy.asarray(params, dtype=float))
+    
+    # as simulate, but always running every simulation requested
+    def runSimulations( self, p, t, n, beta, do_perturb=True ):
+        if self.executor:
+            return self.executor.simulate(p, t, n, beta, do_perturb, self.nspecies)
+        
         result = numpy.zeros([n, beta, len(t), self.nspecies])
         
+        # make sure any base state is computed up front, rather than in every subprocess
+        self.baseState()
+        
+        # the beta replicates for a particle share its parameter setup, so
+        # if there are several, run that once and start each of them from there
+        shared = self.snapshots and beta > 1
+        
         if n == 1:
+            state = None
+            if shared:
+                state = self.particleState(0, p[0], do_perturb=do_perturb)
+            
             for ii in range(beta):
-                input = self.writeInput(ii, 0, p[0], do_perturb)
+                input = self.writeInput(ii, 0, p[0], do_perturb, state=state)
                 if self.debug:
                     print >> sys.stderr, 'simulate: running job %d' % ii
-                output = self.run(ii, 0, input)
+                output = self.run(ii, 0, input, state=(state or self.baseState()))
                 result[0, ii, :, :] = self.readResults(output)
         else:
+            states = [None] * n
+            if shared:
+                processes = []
+                queue = Queue()
+                for jj in range(n):
+                    processes.append(Process(target=snapshot_proc,
+                                             args=(jj, p[jj], queue, do_perturb, self)))
+                for proc in processes:
+                    proc.start()
+                
+                for jj in range(n):
+                    partial = queue.get()
+                    states[partial['n']] = partial['state']
+            
             for ii in range(beta):
                 processes = []
                 queue = Queue()
                 for jj in range(n):
                     processes.append(Process(target=bcmd_proc,
-                                             args=(ii, jj, p[jj], queue, do_perturb, self)))
+                                             args=(ii, jj, p[jj], queue, do_perturb, self, states[jj])))
                 for proc in processes:
                     proc.start()
                 
@@ -259,30 +468,181 @@ class model_bcmd:
         
         return result
     
+    # start the beta replicates for a single particle in the background, without waiting
+    # for them to finish -- results are put on the queue as for bcmd_proc, tagged with
+    # slot n, which identifies the working files and so must not be shared by runs in flight
+    # returns the list of processes, which can be abandoned with cancel
+    # as in simulate, deterministic runs are only done once: results in the cache are
+    # queued straight away, and a particle already running in another slot (for the
+    # same queue) is not started again, its results being copied over by collect --
+    # either way, no processes are started; otherwise, with snapshots enabled, the
+    # replicates share a single run of the particle's setup
+    # there's no asynchronous equivalent for an executor, so one can't be used here
+    def submit( self, queue, n, params, beta=1, do_perturb=True ):
+        if self.executor:
+            raise Exception('asynchronous simulation is not supported with a remote executor')
+        
+        if queue is not self.inflight_queue:
+            self.inflight = {}
+            self.inflight_queue = queue
+        
+        key = None
+        if not (do_perturb and self.have_perturbations):
+            key = self.simKey(params, beta)
+            if key in self.inflight:
+                self.inflight[key].append(n)
+                self.duplicates += 1
+                return []
+            
+            cached = self.cache.get(key) if self.cache else None
+            if cached is not None and cached.shape == (beta, len(self.times), self.nspecies):
+                for ii in range(beta):
+                    queue.put({'n': n, 'beta': ii, 'data': cached[ii]})
+                return []
+            
+            self.inflight[key] = [n]
+        
+        self.baseState()
+        if self.snapshots and beta > 1:
+            procs = [ Process(target=async_particle_proc, args=(beta, n, params, queue, do_perturb, self)) ]
+        else:
+            procs = [ Process(target=async_proc, args=(ii, n, params, queue, do_perturb, self)) for ii in range(beta) ]
+        for proc in procs:
+            proc.start()
+        return procs
+    
+    # take delivery of the beta results for a particle submitted in slot n, as an
+    # array [beta, times, species] -- caching them, and passing them on to any
+    # duplicates of it waiting in other slots
+    def collect( self, queue, n, params, sims, do_perturb=True ):
+        if do_perturb and self.have_perturbations:
+            return
+        
+        key = self.simKey(params, len(sims))
+        slots = self.inflight.pop(key, []) if queue is self.inflight_queue else []
+        for slot in slots:
+            if slot != n:
+                for ii in range(len(sims)):
+                    queue.put({'n': slot, 'beta': ii, 'data': sims[ii]})
+        
+        if self.cache and slots and self.cacheable(sims):
+            self.cache.put(key, numpy.array(sims))
+    
+    def cancel( self, procs ):
+        cancel(procs)
+    
     # write a BCMD input for our configured simulation
+    # if a particle state is given, the parameter setup is assumed to be covered by it
     # returns the name of the file
-    def writeInput(self, id_beta, id_n, params, do_perturb=True):
-        seq = self.baseSeq[:]
-        
-        names = self.initnames + self.fixnames
-        vals = numpy.concatenate((params, self.fixvals))
+    def writeInput(self, id_beta, id_n, params, do_perturb=True, state=None):
+        if state:
+            seq = []
+        else:
+            seq = self.prefixSequence(params)
         
-        seq += steps.abcParamSequence(names, vals)
-        seq += steps.abcAbsoluteSequence(self.times, self.perturb(do_perturb), self.vars, outhead=False, steady=self.steady)
+        seq.append(self.inputSeries(do_perturb, self.suffixSteady(state, do_perturb, self.steady)))
         
         filename = os.path.join(self.workdir, '%s_%d_%d.input' % (self.name, id_n, id_beta))
         steps.writeSequence(seq, filename)
         
         return filename
     
-    # run the BCMD model with the generated input file
+    # the input time series part of a simulation's step sequence, after steadying
+    # for the given duration -- unless the inputs are perturbed this is the same
+    # for every simulation, so it's only built once (per duration) and shared
+    def inputSeries(self, do_perturb=True, steady=1000):
+        if do_perturb and self.have_perturbations:
+            return steps.abcAbsoluteSeries(self.times, self.perturb(do_perturb), self.vars, outhead=False,
+                                           steady=steady, steady_method=self.steady_method)
+        
+        if steady not in self.series:
+            self.series[steady] = steps.abcAbsoluteSeries(self.times, self.inputs, self.vars, outhead=False,
+                                                          steady=steady, steady_method=self.steady_method)
+        return self.series[steady]
+    
+    # the parameter setup part of a simulation's step sequence, preceded by
+    # the base sequence unless there's a base state to start from instead
+    def prefixSequence(self, params):
+        if self.baseState():
+            seq = []
+        else:
+            seq = self.baseSeq[:]
+        
+        seq += steps.abcParamSequence(self.initnames + self.fixnames, numpy.concatenate((params, self.fixvals)))
+        return seq
+    
+    # the steadying duration for the part of a simulation that follows a particle state:
+    # if the inputs aren't perturbed, the initial steadying is the same for every replicate,
+    # so it gets included in the particle state and doesn't need repeating
+    def suffixSteady(self, state, do_perturb, steady=1000):
+        if state and not (do_perturb and self.have_perturbations):
+            return 0
+        return steady
+    
+    # get the state snapshot at the end of the base sequence, running it if necessary
+    # returns the name of the snapshot file, or None if there isn't one
+    def baseState(self):
+        if not (self.snapshots and self.baseSeq):
+            return None
+        
+        if self.base_state is None or not os.path.exists(self.base_state):
+            self.base_state = self.snapshot(self.baseSeq, '%s_base' % self.name)
+            
+            # if this fails the model probably predates snapshot support,
+            # so don't keep trying -- just fall back to running everything
+            if self.base_state is None:
+                print >> sys.stderr, 'unable to snapshot base sequence, running full sequences instead'
+                self.snapshots = False
+        
+        return self.base_state
+    
+    # get the state snapshot after a particle's parameter setup, ready for
+    # running its beta replicates from -- see also prefixSequence and suffixSteady
+    # returns the name of the snapshot file, or None if this fails
+    def particleState(self, id_n, params, do_perturb=True):
+        seq = self.prefixSequence(params)
+        
+        if self.steady and not (do_perturb and self.have_perturbations):
+            seq += self.inputSeries(False, self.steady).steps(1)
+        
+        return self.snapshot(seq, '%s_%d' % (self.name, id_n), state=self.baseState())
+    
+    # run a step sequence with no output, saving the final model state
+    # returns the name of the snapshot file, or None if the run failed
+    def snapshot(self, seq, stem, state=None):
+        input = os.path.join(self.workdir, '%s.prefix' % stem)
+        output = os.path.join(self.workdir, '%s.prefix.out' % stem)
+        save = os.path.join(self.workdir, '%s.state' % stem)
+        
+        # the model only writes the snapshot if the run succeeds, so
+        # make sure we aren't fooled by one left over from before
+        if os.path.exists(save):
+            os.remove(save)
+        
+        steps.writeSequence(seq, input)
+        
+        if self.suppress:
+            abortable.call(self.command(input, output, state=state, save=save),
+                           stdout=self.DEVNULL, stderr=self.DEVNULL, timeout=self.timeout )
+        else:
+            abortable.call(self.command(input, output, state=state, save=save),
+                           stdout=None, stderr=None, timeout=self.timeout )
+        
+        if os.path.exists(save):
+            return save
+        return None
+    
+    # run the BCMD model with the generated input file, optionally starting from a saved state
     # returns the name of the (coarse) results file
-    def run(self, id_beta, id_n, input):
+    def run(self, id_beta, id_n, input, state=None):
         outname = os.path.join(self.workdir, '%s_%d_%d.out' % (self.name, id_n, id_beta))
+        command = self.command(input, outname, state=state)
+        if self.bailout:
+            command += self.bailout
         
         if self.suppress:
             # invoke the model program as a subprocess
-            succ = abortable.call([self.program, '-i', input, '-o', outname], stdout=self.DEVNULL, stderr=self.DEVNULL, timeout=self.timeout )
+            succ = abortable.call(command, stdout=self.DEVNULL, stderr=self.DEVNULL, timeout=self.timeout )
         else:
             stdoutname = os.path.join(self.workdir, '%s_%d_%d.stdout' % (self.name, id_n, id_beta))
             stderrname = os.path.join(self.workdir, '%s_%d_%d.stderr' % (self.name, id_n, id_beta))
@@ -296,19 +656,106 @@ class model_bcmd:
             except IOError: f_err = None
         
             # invoke the model program as a subprocess
-            succ = abortable.call([self.program, '-i', input, '-o', outname], stdout=f_out, stderr=f_err, timeout=self.timeout )
+            succ = abortable.call(command, stdout=f_out, stderr=f_err, timeout=self.timeout )
         
             if f_out: f_out.close()
             if f_err: f_err.close()
         return outname
     
     
-    # read the specified results file and return its data as a [len(t) x nspecies] numpy array
+    # construct the command line to invoke the model program,
+    # optionally starting from a state snapshot and/or saving one at the end
+    def command(self, input, output, state=None, save=None):
+        args = [self.program, '-i', input, '-o', output]
+        if self.steady_tol is not None:
+            args += ['-T', str(self.steady_tol)]
+        if state:
+            args += ['-r', state]
+        if save:
+            args += ['-w', save]
+        return args
+    
+    # ask the model program to abandon simulations as soon as their distance from
+    # the target var data exceeds threshold, or the solver fails -- the results of
+    # abandoned runs are padded with NaNs, so any subsequent distance will reject them
+    # a threshold of None turns this off again
+    # returns False if the runtime can't mirror the distance calculation, in which
+    # case every simulation is run in full as usual
+    def setBailout(self, threshold, dist=distance.euclidean, weights=[]):
+        self.bailout = None
+        if threshold is None:
+            return True
+        
+        metric = RUNTIME_METRICS.get(getattr(dist, '__name__', None))
+        if metric is None or any([ x.get('post') for x in self.vars ]):
+            return False
+        
+        # as for optimisable, a var with no points has a target of 0 throughout
+        cols = []
+        for x in self.vars:
+            pts = numpy.atleast_1d(x.get('points', 0))
+            if len(pts) == 1:
+                pts = numpy.repeat(pts, len(self.times))
+            cols.append(pts)
+        
+        target = os.path.join(self.workdir, '%s.target' % self.name)
+        with open(target, 'w') as f:
+            for row in numpy.transpose(cols):
+                print >> f, '\t'.join([ repr(float(v)) for v in row ])
+        
+        self.bailout = [ '-t', target, '-M', metric[0], '-x', repr(float(threshold)) ]
+        if metric[1]:
+            self.bailout += [ '-P' ]
+        if weights:
+            self.bailout += [ '-W', ','.join([ repr(float(w)) for w in weights ]) ]
+        return True
+    
+    # get the names of all symbols in the model, as listed by the program itself
+    def symbols(self):
+        if self.symbol_names is None:
+            proc = subprocess.Popen([self.program, '-s'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            listing, dummy = proc.communicate()
+            self.symbol_names = [ line.split('\t')[0] for line in listing.splitlines() if line ]
+        return self.symbol_names
+    
+    # run a single simulation with parameter values p (including var initial values, as for
+    # simulate), also outputting the sensitivities of each var to each of the named parameters
+    # -- the model must have been compiled with those sensitivities (bcmd.py --sens), any
+    # that are not available are reported as zero
+    # returns a tuple of arrays: the signals [len(t) x nspecies] and their
+    # sensitivities [len(t) x nspecies x len(names)]
+    def sensitivities(self, p, names):
+        known = set(self.symbols())
+        fields = [ 'd%s/d%s' % (v, q) for q in names for v in self.vnames ]
+        present = [ x for x in fields if x in known ]
+        
+        if len(present) < len(fields):
+            print >> sys.stderr, 'model %s lacks %d of %d requested sensitivities, these will be zero' % (self.name, len(fields) - len(present), len(fields))
+        
+        seq = self.prefixSequence(p)
+        seq.append(steps.abcAbsoluteSeries(self.times, self.inputs, self.vars + [ {'name':x} for x in present ],
+                                           outhead=False, steady=self.steady, steady_method=self.steady_method))
+        input = os.path.join(self.workdir, '%s_sens.input' % self.name)
+        steps.writeSequence(seq, input)
+        
+        table = self.readResults(self.run(0, 0, input, state=self.baseState()), self.nspecies + len(present))
+        
+        sens = numpy.zeros([len(self.times), self.nspecies, len(names)])
+        for ii in range(len(present)):
+            qq, vv = divmod(fields.index(present[ii]), self.nspecies)
+            sens[:, vv, qq] = table[:, self.nspecies + ii]
+        
+        return table[:, :self.nspecies], sens
+    
+    # read the specified results file and return its data as a [len(t) x ncols] numpy array
+    # (by default, ncols is the number of species)
     # output should be a tab-delim text file; we assume consistency with our input spec
     # (this may be incorrect if spec includes output fields not in model -- probably ought
     # to do an initial sanity check on the model symbol table...)
-    def readResults(self, output):
-        result = numpy.zeros([len(self.times), self.nspecies])
+    def readResults(self, output, ncols=None):
+        result = numpy.zeros([len(self.times), ncols or self.nspecies])
+        if self.bailout:
+            result.fill(numpy.nan)
         ii = 0
         with open(output, 'rb') as tabfile:
             reader = csv.reader(tabfile, delimiter='\t')
@@ -8,15 +8,14 @@ import os, os.path, sys
 import time, datetime
 import argparse, pprint
 
-# optimisation
-import openopt
-
 # local BCMD-related modules
 import model_bcmd
 import steps
 import distance
 import inputs
 import posthoc
+import evolve
+import memo
 
 # add location of pswarm_py.so to search path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pylib')))
@@ -34,13 +33,14 @@ PARAM_SELECT = '*'
 DISTANCE = 'euclidean'
 MAX_ITER = 1e3
 STEADY = 1000
+STEADY_METHOD = 'integrate'
 
 CONFIG = { 'build': BUILD,
            'work': None,
            'info': INFO,
-           'job_mode': JOB_MODE,   # it probably doesn't make sense for this to be anything other than GLP, but...
+           'job_mode': JOB_MODE,   # it probably doesn't make sense for this to be anything other than GLP or DE, but...
            'solver': SOLVER,
-           'nbatch': 1,            # we don't support parallel execution at present
+           'nbatch': 1,            # parallel simulations, only supported by DE mode at present
            'beta': 1,              # ditto
            'param_select': PARAM_SELECT,
            'weights': {},
@@ -139,7 +139,9 @@ def process_vars(vars, aliases, data):
 def process_inputs(config):
 
     job = inputs.readFile(config['jobfile'])
-    data = inputs.readFile(config['datafile'])
+    
+    # data columns are parsed as used, optionally caching them next to the file
+    data = inputs.readFile(config['datafile'], cache=int(job['header'].get('data_cache', [[0]])[0][0]))
     
     # there's scope for something silly to go wrong here, but for now
     # let's just assume it won't...
@@ -227,8 +229,34 @@ def process_inputs(config):
     config['solver'] = job['header'].get('solver', [[SOLVER]])[0][0]
     
     config['steady'] = float(job['header'].get('steady', [[STEADY]])[0][0])
+    config['steady_method'] = job['header'].get('steady_method', [[STEADY_METHOD]])[0][0]
+    config['steady_tol'] = None
+    if 'steady_tol' in job['header']:
+        config['steady_tol'] = float(job['header']['steady_tol'][0][0])
     config['max_iter'] = int(job['header'].get('max_iter', [[MAX_ITER]])[0][0])
     
+    # settings for the native DE optimiser
+    config['nbatch'] = int(job['header'].get('nbatch', [[1]])[0][0])
+    config['popsize'] = int(job['header'].get('popsize', [[evolve.POPSIZE]])[0][0])
+    config['de_weight'] = float(job['header'].get('de_weight', [[evolve.WEIGHT]])[0][0])
+    config['de_crossover'] = float(job['header'].get('de_crossover', [[evolve.CROSSOVER]])[0][0])
+    config['ftol'] = float(job['header'].get('ftol', [[evolve.FTOL]])[0][0])
+    config['stall'] = int(job['header'].get('stall', [[evolve.STALL]])[0][0])
+    
+    # optionally abandon simulations once their distance exceeds a threshold
+    config['threshold'] = None
+    if 'threshold' in job['header']:
+        config['threshold'] = float(job['header']['threshold'][0][0])
+    
+    # objective cache settings -- a size of 0 disables caching
+    config['cache_size'] = int(job['header'].get('cache_size', [[memo.SIZE]])[0][0])
+    config['cache_digits'] = int(job['header'].get('cache_digits', [[memo.DIGITS]])[0][0])
+    config['cache_file'] = job['header'].get('cache_file', [[None]])[0][0]
+    
+    # openopt solver names mean nothing to DE, so use its own default strategy unless specified
+    if config['job_mode'] == 'DE' and 'solver' not in job['header']:
+        config['solver'] = evolve.STRATEGY
+    
     if 'sigma' in job['header']:
         config['sigma'] = float(job['header']['sigma'][0][0])
     
@@ -269,11 +297,22 @@ def make_model(config):
                                    workdir=config['model_io'],
                                    deleteWorkdir=False,
                                    debug=config['debug'],
-                                   steady=config['steady'])
+                                   steady=config['steady'],
+                                   steady_method=config['steady_method'],
+                                   steady_tol=config['steady_tol'])
     return model
 
+# create the objective cache, if any
+def make_cache(config):
+    if config['dryrun'] or config['cache_size'] <= 0:
+        return None
+    
+    return memo.ObjectiveCache( size=config['cache_size'],
+                                digits=config['cache_digits'],
+                                filename=config['cache_file'] )
+
 # create optimiser
-def make_optimiser(config, model):
+def make_optimiser(config, model, cache=None):
     if not model: return None
     
     # run with dummy values -- this doesn't really belong here, but temporarily...
@@ -288,10 +327,19 @@ def make_optimiser(config, model):
 
     mode = config.get('job_mode', JOB_MODE)
     weights = [ config['weights'].get(x['name'], 1) for x in config['vars'] ]
+    
+    if config['threshold'] is not None:
+        if not model.setBailout(config['threshold'], config['distance'], weights):
+            print >> sys.stderr, 'threshold ignored: distance function or posthoc transformations not supported by model runtime'
+    
+    # openopt is only needed for its own job modes, so DE can be used without it installed
+    if mode in ('GLP', 'NLP', 'NSP'):
+        import openopt
+    
     if mode == 'GLP':
         lb = [ x.get('min', 0) for x in config['params'] ]
         ub = [ x.get('max', 0) for x in config['params'] ]
-        return openopt.GLP( model.optimisable(config['distance'], weights=weights),
+        return openopt.GLP( model.optimisable(config['distance'], weights=weights, cache=cache),
                             lb = lb,
                             ub = ub,
                             # TODO, possibly: support A and b args to define linear constraints
@@ -299,7 +347,7 @@ def make_optimiser(config, model):
     elif mode == 'NLP':
         lb = [ x.get('min', 0) for x in config['params'] ]
         ub = [ x.get('max', 0) for x in config['params'] ]
-        return openopt.NLP( model.optimisable(config['distance'], weights=weights),
+        return openopt.NLP( model.optimisable(config['distance'], weights=weights, cache=cache),
                             lb = lb,
                             ub = ub,
                             # TODO, possibly: support A and b args to define linear constraints
@@ -307,11 +355,25 @@ def make_optimiser(config, model):
     elif mode == 'NSP':
         lb = [ x.get('min', 0) for x in config['params'] ]
         ub = [ x.get('max', 0) for x in config['params'] ]
-        return openopt.NSP( model.optimisable(config['distance'], weights=weights),
+        return openopt.NSP( model.optimisable(config['distance'], weights=weights, cache=cache),
                             lb = lb,
                             ub = ub,
                             # TODO, possibly: support A and b args to define linear constraints
                             maxIter = config['max_iter'] )
+    elif mode == 'DE':
+        # evaluates a whole generation per call, nbatch simulations at a time
+        lb = [ x.get('min', 0) for x in config['params'] ]
+        ub = [ x.get('max', 0) for x in config['params'] ]
+        return evolve.DE( model.batchOptimisable(config['distance'], weights=weights, nbatch=config['nbatch'], cache=cache),
+                          lb = lb,
+                          ub = ub,
+                          popsize = config['popsize'],
+                          weight = config['de_weight'],
+                          crossover = config['de_crossover'],
+                          maxIter = config['max_iter'],
+                          ftol = config['ftol'],
+                          stall = config['stall'],
+                          debug = config['debug'] )
     return None
 
 # run optimiser
@@ -328,12 +390,17 @@ if __name__ == '__main__':
     if config:
         process_inputs(config)
         model = make_model(config)
-        optimiser = make_optimiser(config, model)
+        cache = make_cache(config)
+        optimiser = make_optimiser(config, model, cache)
         
         if optimiser:
         
             rr = optimise(config, model, optimiser)
             
+            if cache:
+                cache.save()
+                print cache.report()
+            
             # for the moment we just print the results here
             # -- which may be superfluous, since OO will print stuff as well
             
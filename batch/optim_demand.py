@@ -103,16 +103,24 @@ def datafile_append(config):
 
 
 def looped_process(config):
+    # one objective cache serves all the data files -- its entries are
+    # specific to the data, but a persistent cache file lets reruns and
+    # restarts skip evaluations already done
+    cache = None
     while len(config['inputfiles']) != 0:
         datafile_append(config)
         if config:
             optim.process_inputs(config)
             print("\n~~ Output from file %s\n" % config['datafile'])
             model = optim.make_model(config)
-            optimiser = optim.make_optimiser(config, model)
+            if cache is None:
+                cache = optim.make_cache(config)
+            optimiser = optim.make_optimiser(config, model, cache)
             if optimiser:
 
                 rr = optim.optimise(config, model, optimiser)
+                if cache:
+                    cache.save()
 
                 # for the moment we just print the results here
                 # -- which may be superfluous, since OO will print stuff as well
@@ -132,6 +140,9 @@ def looped_process(config):
                 print('CONFIG:')
                 pprint.pprint(config)
 
+    if cache:
+        print(cache.report())
+
 if __name__ == '__main__':
     config = process_args()
     looped_process(config)
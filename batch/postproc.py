@@ -6,6 +6,7 @@ import pprint
 
 import distance
 import inputs
+import results
 
 # sensitivity analyses
 import SALib.analyze.morris
@@ -102,25 +103,45 @@ def calcDistances(dir, config):
     saFile = os.path.join(dir, SENSITIVITIES)
     jobsFile = os.path.join(dir, JOBS)
 
-    if os.path.isfile(resultsfile):
-        # set up a bunch of stuff we'll need
-        header = None
-        speciesIndex = -1
-        t0Index = -1
-
-        # stuff we will need to extract from the header
+    if os.path.isfile(resultsfile) or results.isCurrent(resultsfile):
+        # the results are read via their indexed form, which is built if necessary
+        res = results.indexed_results(resultsfile)
+        t0Index = res.header.index(T0)
+        params = res.params
 
         # NB: in a potentially-confusing move, we key the measurements list by the target
         # species, on the basis that that's what we actually care about -- the _out
         # suffix is just a way to get that data into this dict
-        # -- in any case, we attempt to load external data here, but don't fill
-        # in defaults until later, when we know how long the result traces are...
+        # -- in any case, we attempt to load external data here, then fill in
+        # defaults, since we know how long the result traces are
         measured = getMeasured(dir, config)
 
+        # add a default zero array for all measured, in case they're not provided
+        UNMEASURED = numpy.zeros(len(res.columns) - res.t0Index)
+        for name in config['target']:
+            # distance funcs fail with mismatched lengths, so we replace
+            # an external traces that aren't the right length -- this should
+            # inlude any absentees
+            if len(measured[name]) == 0:
+                measured[name] = UNMEASURED
+            elif len(measured[name]) != len(UNMEASURED):
+                print 'incorrect length (%d) for variable %s, substituting zero default' % (len(measured[name]), name)
+                measured[name] = UNMEASURED
+
+        # measured data
+        for name in config['target']:
+            for index in res.speciesRows(name + OUT_SUFFIX):
+                # when there is no measured data, the row will be filled with NA
+                # since we cannot measure distances in that case, we ignore it
+                # and keep the default zeros instead
+                trace = numpy.array(res.traces(index))
+                if not numpy.any(numpy.isnan(trace)):
+                    print 'using measured data %s from results file as target for %s' % (name + OUT_SUFFIX, name)
+                    measured[name] = trace
+
         # assume that all species are run with the same list of jobs
         # and we'll use those for the first target
-        jobs = []
-        params = None
+        jobs = numpy.array(res.paramValues(res.speciesRows(config['target'][0])))
 
         distances = {}
         for species in config['target']:
@@ -128,62 +149,33 @@ def calcDistances(dir, config):
             for dist in DIST_HEADS:
                 distances[species][dist] = []
 
+        codes = dict([ (res.code(species), species) for species in config['target'] ])
+
         # calculate and write out distances for all jobs (species will be interleaved, as in the original results)
-        with open(resultsfile) as results, open(distancesfile, 'w') as distOut:
-
-            for line in results:
-                row = line.strip().split('\t')
-
-                # header row
-                if speciesIndex < 0:
-                    header = row
-                    speciesIndex = row.index(SPECIES)
-                    t0Index = row.index(T0)
-                    params = row[(speciesIndex+1):t0Index]
-
-                    print >> distOut, '\t'.join(row[:t0Index] + DIST_HEADS)
-
-                    # add a default zero array for all measured, in case they're not provided
-                    UNMEASURED = numpy.zeros(len(row[t0Index:]))
-                    for name in config['target']:
-                        # distance funcs fail with mismatched lengths, so we replace
-                        # an external traces that aren't the right length -- this should
-                        # inlude any absentees
-                        if len(measured[name]) == 0:
-                            measured[name] = UNMEASURED
-                        elif len(measured[name]) != len(UNMEASURED):
-                            print 'incorrect length (%d) for variable %s, substituting zero default' % (len(measured[name]), name)
-                            measured[name] = UNMEASURED
-
-                else:
-                    species = row[speciesIndex]
-
-                    # measured data
-                    if species in config['measured']:
-
-                        # when there is no measured data, the row will be filled with NA
-                        # since we cannot measure distances in that case, we ignore it
-                        # and keep the default zeros instead
-                        if not 'NA' in row[t0Index:]:
-                            # see note above about keying -- we strip the suffix here
-                            print 'using measured data %s from results file as target for %s' % (species, species[:-len(OUT_SUFFIX)])
-                            measured[species[:-len(OUT_SUFFIX)]] = numpy.array([float(x) for x in row[t0Index:]])
-
-                    # simulation data -- calculate distances and write out
-                    elif species in config['target']:
-
-                        # extract the job details (first species only)
-                        if species==config['target'][0]:
-                            jobs.append(numpy.array([float(x) for x in row[(speciesIndex+1):t0Index]]))
-
-                        # calculate the range of distance metrics between this sim and the measured data
-                        simdata = numpy.array([float(x) for x in row[t0Index:]])
-                        dists = [ df(measured[species], simdata) for df in DIST_FUNCS ]
-                        print >> distOut, '\t'.join(row[:t0Index] + [str(d) for d in dists])
-
-                        # save as vectors per metric per species, for possible use as a sensitivity Y
-                        for ii in range(len(dists)):
-                            distances[species][DIST_HEADS[ii]].append(dists[ii])
+        # -- a chunk of rows at a time, calculating each species' distances in bulk
+        with open(distancesfile, 'w') as distOut:
+            print >> distOut, '\t'.join(res.header[:t0Index] + DIST_HEADS)
+
+            for start, cc, data in res.chunks():
+                cc = numpy.asarray(cc)
+                dists = {}
+                for code in codes:
+                    idx = numpy.nonzero(cc == code)[0]
+                    if len(idx):
+                        sims = data[idx, res.t0Index:]
+                        block = distance.batch(measured[codes[code]][:, numpy.newaxis],
+                                               sims[:, numpy.newaxis, :, numpy.newaxis],
+                                               DIST_FUNCS)[:, :, 0, 0]
+                        for jj in range(len(idx)):
+                            dists[idx[jj]] = block[:, jj]
+
+                for ii in sorted(dists):
+                    species = codes[cc[ii]]
+                    print >> distOut, '\t'.join(res.format(start + ii)[:t0Index] + [str(d) for d in dists[ii]])
+
+                    # save as vectors per metric per species, for possible use as a sensitivity Y
+                    for jj in range(len(DIST_HEADS)):
+                        distances[species][DIST_HEADS[jj]].append(dists[ii][jj])
 
         # write the jobs list
         with open(jobsFile, 'w') as jf:
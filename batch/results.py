@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# indexed binary form of dsim results files, for fast random access to big runs
+# the TSV is converted once into a raw matrix of all the numeric columns (NA -> nan),
+# which is memory mapped, plus an integer code per row identifying its species and
+# a metadata file with the column and species names -- rows can then be served
+# by range, species or column value without rescanning and reparsing the text
+
+import sys, os, os.path
+import json
+import numpy
+
+# notable headers, as written by dsim
+SPECIES = 'species'
+T0 = 't0'
+NA = 'NA'
+INTEGERS = ('run', 'job', 'rep')
+
+# rows to convert or scan at a time
+CHUNK = 10000
+
+DATA_SUFFIX = '.dat'
+CODES_SUFFIX = '.species.npy'
+META_SUFFIX = '.meta'
+
+# the binary files are named from the TSV's stem, eg results.txt -> results.dat etc
+def stem(filename):
+    return os.path.splitext(filename)[0]
+
+# whether there's an indexed version of a TSV at least as new as it
+def isCurrent(filename):
+    meta = stem(filename) + META_SUFFIX
+    if not os.path.isfile(meta):
+        return False
+    if readMeta(stem(filename)) is None:
+        return False
+    if not os.path.isfile(filename):
+        return True
+    return os.path.getmtime(meta) >= os.path.getmtime(filename)
+
+# the metadata is plain JSON, so reading it can't run anything
+def writeMeta(base, header, species, rows):
+    with open(base + META_SUFFIX, 'w') as f:
+        json.dump({ 'header': header, 'species': species, 'rows': rows }, f)
+
+# returns the metadata dict, or None if it can't be read (eg, from an older version)
+def readMeta(base):
+    try:
+        with open(base + META_SUFFIX) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return { 'header': [ x.encode('utf-8') for x in meta['header'] ],
+             'species': [ x.encode('utf-8') for x in meta['species'] ],
+             'rows': int(meta['rows']) }
+
+# convert a TSV results file to indexed form, a chunk of rows at a time
+def convert(filename):
+    base = stem(filename)
+    print 'indexing results file %s' % filename
+
+    species = []
+    lookup = {}
+    codes = []
+    rows = 0
+
+    with open(filename) as src, open(base + DATA_SUFFIX, 'wb') as dst:
+        header = src.readline().rstrip('\r\n').split('\t')
+        sIndex = header.index(SPECIES)
+
+        def flush(block):
+            if block:
+                # numpy.where widens the dtype if need be, where assigning into a
+                # narrow one would truncate to 'na'
+                arr = numpy.array(block)
+                numpy.where(arr == NA, 'nan', arr).astype(float).tofile(dst)
+
+        block = []
+        for line in src:
+            row = line.rstrip('\r\n').split('\t')
+            name = row.pop(sIndex)
+            if name not in lookup:
+                lookup[name] = len(species)
+                species.append(name)
+            codes.append(lookup[name])
+            block.append(row)
+            rows += 1
+
+            if len(block) >= CHUNK:
+                flush(block)
+                block = []
+        flush(block)
+
+    numpy.save(base + CODES_SUFFIX, numpy.array(codes, dtype=numpy.int32))
+    writeMeta(base, header, species, rows)
+    print 'indexed %d rows' % rows
+
+class indexed_results:
+
+    # open a results file, converting it first if there's no up to date index
+    def __init__(self, filename):
+        if not isCurrent(filename):
+            convert(filename)
+
+        base = stem(filename)
+        meta = readMeta(base)
+
+        self.header = meta['header']
+        self.species = meta['species']
+        self.nrows = meta['rows']
+
+        # numeric columns are the header minus the species
+        self.sIndex = self.header.index(SPECIES)
+        self.columns = self.header[:self.sIndex] + self.header[(self.sIndex+1):]
+        self.t0Index = self.columns.index(T0)
+        self.params = self.header[(self.sIndex+1):self.header.index(T0)]
+
+        self.codes = numpy.load(base + CODES_SUFFIX, mmap_mode='r')
+        if self.nrows:
+            self.data = numpy.memmap(base + DATA_SUFFIX, dtype=float, mode='r', shape=(self.nrows, len(self.columns)))
+        else:
+            self.data = numpy.zeros((0, len(self.columns)))
+
+    def __len__(self):
+        return self.nrows
+
+    def column(self, name):
+        return self.columns.index(name)
+
+    # time course values of the given rows
+    def traces(self, rows):
+        return self.data[rows, self.t0Index:]
+
+    # parameter values of the given rows
+    def paramValues(self, rows):
+        return self.data[rows, (self.sIndex):self.t0Index]
+
+    # species codes and numeric data for a range of rows
+    def rows(self, start, stop):
+        return self.codes[start:stop], self.data[start:stop]
+
+    # iterate over all rows in chunks, yielding (start, codes, data)
+    def chunks(self, chunk=CHUNK):
+        for start in range(0, self.nrows, chunk):
+            codes, data = self.rows(start, start + chunk)
+            yield start, codes, data
+
+    def code(self, name):
+        if name in self.species:
+            return self.species.index(name)
+        return -1
+
+    # indices of all rows for the named species
+    def speciesRows(self, name):
+        return numpy.nonzero(numpy.asarray(self.codes) == self.code(name))[0]
+
+    # indices of all rows with the given value in the named column, matching as
+    # a string for the species and a number (or NA) for anything else
+    def select(self, column, value):
+        if column == SPECIES:
+            return self.speciesRows(value)
+
+        col = self.column(column)
+        value = float('nan') if value == NA else float(value)
+        found = []
+        for start, codes, data in self.chunks():
+            if numpy.isnan(value):
+                hits = numpy.isnan(data[:, col])
+            else:
+                hits = data[:, col] == value
+            found.append(start + numpy.nonzero(hits)[0])
+
+        if found:
+            return numpy.concatenate(found)
+        return numpy.zeros(0, dtype=int)
+
+    # text fields for a row, in the original column order
+    def format(self, index):
+        fields = [ NA if numpy.isnan(x) else str(x) for x in self.data[index] ]
+        for ii in range(self.sIndex):
+            if self.columns[ii] in INTEGERS and fields[ii] != NA:
+                fields[ii] = '%d' % self.data[index, ii]
+        fields.insert(self.sIndex, self.species[self.codes[index]])
+        return fields
+
+    # write the header and the given rows as TSV
+    def writeTSV(self, out, rows):
+        print >> out, '\t'.join(self.header)
+        for index in rows:
+            print >> out, '\t'.join(self.format(index))
+
+# merge the indexed forms of several results files with the same columns into a
+# single indexed file, with an extra leading column identifying the source
+def merge(filenames, dest, column='run'):
+    sources = [ indexed_results(filename) for filename in filenames ]
+    base = stem(dest)
+    species = []
+
+    with open(base + DATA_SUFFIX, 'wb') as dst:
+        codes = []
+        for ii in range(len(sources)):
+            src = sources[ii]
+            if src.columns != sources[0].columns:
+                print >> sys.stderr, 'columns of %s do not match, skipping' % filenames[ii]
+                continue
+
+            remap = numpy.zeros(len(src.species), dtype=numpy.int32)
+            for jj in range(len(src.species)):
+                if src.species[jj] not in species:
+                    species.append(src.species[jj])
+                remap[jj] = species.index(src.species[jj])
+
+            for start, cc, data in src.chunks():
+                block = numpy.empty((data.shape[0], data.shape[1] + 1))
+                block[:, 0] = ii + 1
+                block[:, 1:] = data
+                block.tofile(dst)
+                codes.append(remap[numpy.asarray(cc)])
+
+    codes = numpy.concatenate(codes) if codes else numpy.zeros(0, dtype=numpy.int32)
+    numpy.save(base + CODES_SUFFIX, codes.astype(numpy.int32))
+    writeMeta(base, [column] + sources[0].header, species, len(codes))
+    return indexed_results(dest)
+
+def printUsage():
+    print 'Usage: ' + sys.argv[0] + ' FILE [FILE ...]'
+    print '    FILE = dsim results file to convert to indexed form'
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        printUsage()
+    else:
+        for filename in sys.argv[1:]:
+            convert(filename)
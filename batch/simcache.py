@@ -0,0 +1,106 @@
+# persistent, content-addressed cache of simulation results, so that repeated
+# parameter vectors -- within a run or across runs -- don't get simulated again
+# each entry is a separate .npy file named by the hash of its key, which combines
+# a signature for the model program and simulation setup (see model_bcmd.simSignature)
+# with the exact parameter values, so one cache directory can be shared by any jobs
+# the cache is bounded by total size and entry age, evicting the least recently used
+
+import os, os.path, sys
+import time
+import hashlib
+import tempfile
+import numpy
+
+# defaults
+SIZE = 1000         # megabytes, or 0 for no limit
+AGE = 30            # days since last use, or 0 for no limit
+EVICT_INTERVAL = 100    # check the limits after this many new entries
+
+SUFFIX = '.npy'
+
+class SimulationCache:
+    def __init__ ( self, directory, size=SIZE, age=AGE, evict_interval=EVICT_INTERVAL ):
+        self.directory = directory
+        self.size = size * 1024 * 1024
+        self.age = age * 24 * 60 * 60
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.unchecked = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.evict()
+
+    # content key for a parameter vector and replicate count in the context identified by signature
+    def key ( self, signature, p, beta=1 ):
+        sha = hashlib.sha1(signature)
+        sha.update(numpy.asarray(p, dtype=float).tostring())
+        sha.update(str(beta))
+        return sha.hexdigest()
+
+    def filename ( self, key ):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    # look up a key, returning None if it's absent or unreadable
+    def get ( self, key ):
+        name = self.filename(key)
+        if os.path.isfile(name):
+            try:
+                value = numpy.load(name)
+                os.utime(name, None)
+                self.hits += 1
+                return value
+            except Exception as e:
+                print >> sys.stderr, 'unable to load cached simulation %s: %s' % (key, e)
+        self.misses += 1
+        return None
+
+    # store an entry, via a temp file so that concurrent readers never see a partial one
+    def put ( self, key, value ):
+        try:
+            fd, temp = tempfile.mkstemp(suffix=SUFFIX, dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, value)
+            os.rename(temp, self.filename(key))
+            self.stored += 1
+        except Exception as e:
+            print >> sys.stderr, 'unable to cache simulation %s: %s' % (key, e)
+
+        self.unchecked += 1
+        if self.evict_interval and self.unchecked >= self.evict_interval:
+            self.evict()
+
+    # discard entries not used within the age limit, then the least recently used
+    # until the total is within the size limit
+    def evict ( self ):
+        self.unchecked = 0
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+                except OSError:
+                    pass
+
+        entries.sort()
+        total = sum([ x[1] for x in entries ])
+        now = time.time()
+        for mtime, size, path in entries:
+            if not ((self.age and now - mtime > self.age) or (self.size and total > self.size)):
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+                total -= size
+            except OSError:
+                pass
+
+    def report ( self ):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0
+        return 'Simulation cache: %d hits, %d misses (%.1f%% hit rate), %d stored, %d evicted' % (self.hits, self.misses, rate, self.stored, self.evicted)
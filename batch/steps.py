@@ -3,6 +3,7 @@ import sys
 import os
 import re
 import math
+import numpy as np
 
 # functions for creating and managing the step sequences that drive
 # a simulation run, and reading & writing the corresponding files
@@ -10,6 +11,11 @@ import math
 
 # (might also read & convert input files from BRAINCIRC, if I can be bothered)
 
+# step types used to bring the model to a steady state,
+# keyed by the method names accepted by makeSteadySequence
+# ('integrate' is just an ordinary absolute step)
+STEADY_TYPES = { 'solve':'~', 'settle':'~~' }
+
 # read a BCMD input file and create the corresponding step sequence
 # returns the sequence plus a list of any format errors encountered
 def readSequence ( file ):
@@ -107,11 +113,16 @@ def readSequence ( file ):
                     if len(setfields) != int(tokens[1]):
                         errs.append('incorrect field count at line %d: "%s" (inferring)' % (linecount, line))
             
-            elif line.startswith('='):
+            elif line.startswith('=') or line.startswith('~'):
                 anything = True
                 if len(tokens) < 3:
                     errs.append('empty/incomplete absolute step at line %d: "%s" (skipping)' % (linecount, line))
                     continue
+                
+                # steady state steps are absolute steps with a different type
+                if tokens[0] not in STEADY_TYPES.values() + ['=']:
+                    errs.append('invalid step type at line %d: "%s" (treating as "=")' % (linecount, line))
+                    tokens[0] = '='
 
                 if len(tokens) != len(setfields) + 3:
                     # TODO: possibly try to handle this more helpfully
@@ -131,7 +142,7 @@ def readSequence ( file ):
                     # TODO: again, could maybe be more helpful about this?
                     errs.append('invalid field value for absolute step at line %d: "%s" (skipping)' % (linecount, line))
                 
-                steps.append( {'type':'=', 'n':1, 'start':start, 'end':end,
+                steps.append( {'type':tokens[0], 'n':1, 'start':start, 'end':end,
                                'duration':end - start,
                                'setfields':setfields, 'setvalues': assigns,
                                'outfields':outfields, 'detfields':detfields,
@@ -216,6 +227,86 @@ def readSequence ( file ):
     
     return steps, errs
 
+# a run of absolute steps through a sequence of time points, all setting the same
+# fields, optionally preceded by a steadying step at the first values -- as produced
+# by abcAbsoluteSequence, but held as arrays rather than as a dict per step
+# a series can be shared between sequences (which are otherwise lists of step dicts),
+# so per-job steps such as parameter settings are just list items ahead of it,
+# and writeSequence writes all but its first couple of steps in one go
+class AbsoluteSeries:
+    def __init__ ( self, times, setfields, values, outfields, start=None, outhead=True, steady=1000, steady_method='integrate' ):
+        self.times = np.asarray(times, dtype=float)
+        self.setfields = setfields
+        self.values = np.asarray(values, dtype=float).reshape((len(self.times), len(setfields)))
+        self.outfields = outfields
+        self.outhead = outhead
+        self.steady = steady
+        self.steady_method = steady_method
+        
+        if start is None:
+            if len(self.times) > 1:
+                start = self.times[0] - (self.times[1] - self.times[0])
+            else:
+                start = 0
+        self.starts = np.concatenate(([start], self.times[:-1]))
+    
+    # number of steps, including any steadying
+    def __len__ ( self ):
+        return len(self.times) + (1 if self.steady else 0)
+    
+    # the steps as dicts, optionally just the first count of them
+    def steps ( self, count=None ):
+        if count is None:
+            count = len(self)
+        seq = []
+        
+        if self.steady and count > 0:
+            seq.append( { 'type': STEADY_TYPES.get(self.steady_method, '='), 'n':1,
+                          'start':self.starts[0] - self.steady,
+                          'end': self.starts[0], 'duration': self.steady,
+                          'setfields':self.setfields,
+                          'setvalues': list(self.values[0]),
+                          'outfields': [], 'detfields':[],
+                          'outhead': False, 'dethead':False } )
+        
+        for ii in range(count - len(seq)):
+            seq.append( { 'type': '=', 'n': 1, 'start': self.starts[ii],
+                 'end': self.times[ii], 'duration': self.times[ii] - self.starts[ii],
+                 'setfields': self.setfields,
+                 'setvalues': list(self.values[ii]),
+                 'outfields': self.outfields, 'detfields':[],
+                 'outhead': self.outhead and ii == 0, 'dethead':False } )
+        
+        return seq
+    
+    # write to file, updating the writer state as writeStep would
+    # steps after the first absolute one change no fields or headers,
+    # so they're just rows of the same format
+    def write ( self, file, state ):
+        head = min(len(self), (2 if self.steady else 1))
+        for step in self.steps(head):
+            writeStep(file, step, state)
+        
+        first = len(self.times) - (len(self) - head)
+        if first < len(self.times):
+            fmt = '= %g %g ' + ' '.join(['%g'] * len(self.setfields))
+            rows = np.column_stack((self.starts[first:], self.times[first:], self.values[first:]))
+            file.write(((fmt + '\n') * len(rows)) % tuple(rows.ravel().tolist()))
+
+# number of steps in a sequence
+def stepCount ( seq ):
+    return sum([(len(s) if isinstance(s, AbsoluteSeries) else s['n']) for s in seq])
+
+# a sequence with any series expanded into individual step dicts
+def expand ( seq ):
+    result = []
+    for step in seq:
+        if isinstance(step, AbsoluteSeries):
+            result += step.steps()
+        else:
+            result.append(step)
+    return result
+
 # write step sequence to a file
 # we ensure that the output syntax is correct and the file is
 # self-consistent, but don't properly validate the semantics or
@@ -223,12 +314,8 @@ def readSequence ( file ):
 # be elsewhere
 def writeSequence ( seq, filename=False, comment='' ):
     # default state
-    setfields = None
-    outfields = ['*']
-    detfields = ['*']
-    assigned = False
-    outhead = True
-    dethead = True
+    state = { 'setfields':None, 'outfields':['*'], 'detfields':['*'],
+              'assigned':False, 'outhead':True, 'dethead':True }
 
     if filename:
         file = open(filename, 'w')
@@ -239,77 +326,87 @@ def writeSequence ( seq, filename=False, comment='' ):
     if comment:
         file.write('# %s\n' % str(comment))
     
-    count = sum([s['n'] for s in seq])
+    count = stepCount(seq)
     file.write('@ %d\n' % count)
     
     for step in seq:
-        # make sure the set and output fields are correct
-        if step['outfields'] != outfields:
-            outfields = step['outfields']
-            if outfields == step['detfields']:
-                detfields = step['detfields']
-                file.write('>>> ')
-            else:
-                file.write('> ')
-            if len(outfields) and outfields[0] == '*':
-                file.write('*\n')
-            else:
-                file.write('%d %s\n' % (len(outfields), " ".join(outfields)))
-        elif step['detfields'] != detfields:
-            detfields = step['detfields']
-            if len(detfields) and detfields[0] == '*':
-                file.write('>> *\n')
-            else:
-                file.write('>> %d %s\n' % (len(detfields), " ".join(detfields)))
-    
-        # this is a bit laborious to make the results concise
-        # (the converse would be possible, but wrong)
-        if step['outhead'] != outhead or step['dethead'] != dethead:
-            if step['outhead'] == step['dethead']:
-                if step['outhead']:
-                    file.write('!!!\n')
-                else:
-                    file.write('!0\n')
-            elif step['outhead']:
-                if dethead:
-                    file.write('!0\n')
-                file.write('!\n')
-            else:
-                if outhead:
-                    file.write('!0\n')
-                file.write('!!\n')
-        outhead = False
-        dethead = False
-        
-        if step['setfields'] != setfields:
-            setfields = step['setfields']
-            file.write(': %d %s\n' % (len(setfields), " ".join(setfields)))
-            assigned = False
-        
-        # now write the actual step
-        if step['type'] == '=':
-            assigned = True
-            file.write('= %g %g %s\n' % (step['start'], step['end'],
-                                         " ".join([("%g" % x) for x in step['setvalues']])))
-        elif step['type'] == '+':
-            file.write('+ %g %s\n' % (step['duration'],
-                                      " ".join([("%g" % x) for x in step['setvalues']])))
-        elif step['type'] == '*':
-            if not assigned:
-                print >> sys.stderr, "Warning: multi-step specified for fields without previous assignment"
-            file.write('* %d %g %s\n' % (step['n'], step['duration'],
-                                         " ".join([("%g" % x) for x in step['setvalues']])))
+        if isinstance(step, AbsoluteSeries):
+            step.write(file, state)
         else:
-            # unknown step type, shouldn't happen but...
-            print >> sys.stderr, 'Unknown step type: %s' % step['type']
+            writeStep(file, step, state)
     
     if filename:
         file.close()
 
+# write a single step, preceded by whatever field and header changes it needs
+# relative to the current writer state, which is updated accordingly
+def writeStep ( file, step, state ):
+    # make sure the set and output fields are correct
+    if step['outfields'] != state['outfields']:
+        state['outfields'] = step['outfields']
+        if state['outfields'] == step['detfields']:
+            state['detfields'] = step['detfields']
+            file.write('>>> ')
+        else:
+            file.write('> ')
+        if len(state['outfields']) and state['outfields'][0] == '*':
+            file.write('*\n')
+        else:
+            file.write('%d %s\n' % (len(state['outfields']), " ".join(state['outfields'])))
+    elif step['detfields'] != state['detfields']:
+        state['detfields'] = step['detfields']
+        if len(state['detfields']) and state['detfields'][0] == '*':
+            file.write('>> *\n')
+        else:
+            file.write('>> %d %s\n' % (len(state['detfields']), " ".join(state['detfields'])))
+
+    # this is a bit laborious to make the results concise
+    # (the converse would be possible, but wrong)
+    if step['outhead'] != state['outhead'] or step['dethead'] != state['dethead']:
+        if step['outhead'] == step['dethead']:
+            if step['outhead']:
+                file.write('!!!\n')
+            else:
+                file.write('!0\n')
+        elif step['outhead']:
+            if state['dethead']:
+                file.write('!0\n')
+            file.write('!\n')
+        else:
+            if state['outhead']:
+                file.write('!0\n')
+            file.write('!!\n')
+    state['outhead'] = False
+    state['dethead'] = False
+    
+    if step['setfields'] != state['setfields']:
+        state['setfields'] = step['setfields']
+        file.write(': %d %s\n' % (len(state['setfields']), " ".join(state['setfields'])))
+        state['assigned'] = False
+    
+    # now write the actual step
+    if step['type'] == '=' or step['type'] in STEADY_TYPES.values():
+        state['assigned'] = True
+        file.write('%s %g %g %s\n' % (step['type'], step['start'], step['end'],
+                                      " ".join([("%g" % x) for x in step['setvalues']])))
+    elif step['type'] == '+':
+        file.write('+ %g %s\n' % (step['duration'],
+                                  " ".join([("%g" % x) for x in step['setvalues']])))
+    elif step['type'] == '*':
+        if not state['assigned']:
+            print >> sys.stderr, "Warning: multi-step specified for fields without previous assignment"
+        file.write('* %d %g %s\n' % (step['n'], step['duration'],
+                                     " ".join([("%g" % x) for x in step['setvalues']])))
+    else:
+        # unknown step type, shouldn't happen but...
+        print >> sys.stderr, 'Unknown step type: %s' % step['type']
+
 # create a version of a step sequence containing only explicit, absolute steps
 # (if the supplied sequence does not include any relative steps, it is returned as is)
+# steady state steps are already absolute, so are left alone
 def explicit(seq):   
-    if sum([(s['type'] != '=') for s in seq]) == 0:
+    seq = expand(seq)
+    if sum([(s['type'] in ('+', '*')) for s in seq]) == 0:
         return seq
     
     setfields = []
@@ -326,7 +423,7 @@ def explicit(seq):
             time = step['end']
         
         # easy ones
-        if step['type'] == '=':
+        if step['type'] == '=' or step['type'] in STEADY_TYPES.values():
             result.append(step)
         elif step['type'] == '+':
             dupe = step.copy()
@@ -528,11 +625,14 @@ def makeResetSequence ( reset, timestep=1000, stepcount=100, end=0 ):
     return seq
 
 # generate a steadying period
-def makeSteadySequence ( steady, duration=1000, end=0 ):
+# method may be 'integrate' (plain integration over the whole duration),
+# 'solve' (solve directly for the steady state, with the duration as fallback)
+# or 'settle' (integrate, but stop as soon as the state is steady)
+def makeSteadySequence ( steady, duration=1000, end=0, method='integrate' ):
     if steady == 'none':
         return []
     else:
-        return [{'type':'=', 'n':1, 'start':end-duration, 'end':end,
+        return [{'type':STEADY_TYPES.get(method, '='), 'n':1, 'start':end-duration, 'end':end,
                  'duration':duration, 'setfields':[], 'setvalues':[],
                  'outfields':[], 'detfields':[],
                  'outhead':False, 'dethead':False}]
@@ -581,36 +681,19 @@ def abcParamSequence ( names, values ):
 # generate an input sequence from the specifications used by our
 # abc-sysbio wrapper functions -- assumes that we will use only
 # the coarse output file, and include headers
-def abcAbsoluteSequence ( times, abcInputs, abcOutputs, start=None, outhead=True, steady=1000 ):
-    seq = []
-    if start is None:
-        if len(times) > 1:
-            start = times[0] - (times[1] - times[0])
-        else:
-            start = 0
-    
+# (steady_method is as for makeSteadySequence)
+def abcAbsoluteSequence ( times, abcInputs, abcOutputs, start=None, outhead=True, steady=1000, steady_method='integrate' ):
+    return abcAbsoluteSeries(times, abcInputs, abcOutputs, start, outhead, steady, steady_method).steps()
+
+# the same, as an AbsoluteSeries rather than a list of step dicts
+def abcAbsoluteSeries ( times, abcInputs, abcOutputs, start=None, outhead=True, steady=1000, steady_method='integrate' ):
     setfields = [ x['name'] for x in abcInputs ]
     outfields = [ x['name'] for x in abcOutputs ]
+    values = np.zeros((len(times), len(abcInputs)))
+    for ii in range(len(abcInputs)):
+        values[:, ii] = np.asarray(abcInputs[ii]['points'], dtype=float)[:len(times)]
     
-    if ( steady ):
-        seq.append( { 'type': '=', 'n':1, 'start':start-steady,
-                      'end': start, 'duration': steady,
-                      'setfields':setfields,
-                      'setvalues': [ x['points'][0] for x in abcInputs ],
-                      'outfields': [], 'detfields':[],
-                      'outhead': False, 'dethead':False } )
-    
-    for ii in range(len(times)):
-        seq.append( { 'type': '=', 'n': 1, 'start': start,
-             'end': times[ii], 'duration': times[ii]-start,
-             'setfields': setfields,
-             'setvalues': [ x['points'][ii] for x in abcInputs ],
-             'outfields': outfields, 'detfields':[],
-             'outhead': outhead, 'dethead':False } )
-        outhead = False
-        start = times[ii]
-    
-    return seq
+    return AbsoluteSeries(times, setfields, values, outfields, start, outhead, steady, steady_method)
 
 # run file directly to test input parser
 if __name__ == '__main__':
@@ -624,7 +707,7 @@ if __name__ == '__main__':
         dump_tree = False
     
     if combo:
-        print >> sys.stderr, '%d steps' % sum([s['n'] for s in combo])
+        print >> sys.stderr, '%d steps' % stepCount(combo)
         if dump_tree:
             print >> sys.stderr, '\n------\n\n' + pprint.pformat(combo)
         print >> sys.stderr, '\n------\nPrinting sequence to stdout'
@@ -0,0 +1,231 @@
+# surrogate screening of candidate parameter vectors, so that proposals an emulator
+# is confident would be rejected needn't cost a full simulation
+# the emulator is a Gaussian process over parameter space, fitted to the log distances
+# of every simulation run so far (plus any seeded from earlier runs), and extended
+# incrementally as each batch of simulations finishes
+# a proposal is only simulated if its predicted probability of falling within epsilon
+# is at least PLAUSIBLE -- or, with probability EXPLORE, regardless, so that regions
+# the emulator has wrongly written off still get visited
+# screening only ever rejects: acceptance is always decided by a real simulation
+# -- but since implausible proposals are only simulated with probability EXPLORE,
+# select also returns each proposal's selection probability, by which an importance
+# sampler must divide the weight of any it accepts (as in delayed-acceptance ABC),
+# or the posterior will be biased away from regions the emulator under-rates
+
+import sys
+import numpy
+import numpy.linalg
+import scipy.linalg
+import scipy.stats
+
+# defaults
+PLAUSIBLE = 0.01        # minimum predicted probability of acceptance
+EXPLORE = 0.1           # fraction of implausible proposals simulated anyway
+MIN_POINTS = 50         # simulations needed before any screening
+CAPACITY = 1000         # training points kept, dropping the oldest beyond this
+LENGTH = 0.2            # kernel length scale, relative to the parameter ranges
+NOISE = 1e-4            # nugget, relative to the signal variance
+JITTER = 1e-8           # added to the diagonal if the factorisation fails
+
+# bounds covering most of the prior mass for an abcsmc-style prior triplet
+def prior_bounds( triplet ):
+    if triplet[0] == 1:
+        sd = numpy.sqrt(triplet[2])
+        return triplet[1] - 3 * sd, triplet[1] + 3 * sd
+    elif triplet[0] == 2:
+        return triplet[1], triplet[2]
+    elif triplet[0] == 3:
+        sd = numpy.sqrt(triplet[2])
+        return numpy.exp(triplet[1] - 3 * sd), numpy.exp(triplet[1] + 3 * sd)
+    return triplet[1], triplet[1]
+
+# Gaussian process regression from parameter vectors to one or more outputs, with a
+# squared exponential kernel over the parameters scaled by their ranges and a
+# constant mean -- since the kernel's hyperparameters are fixed apart from the signal
+# variance, the Cholesky factor of the correlation matrix can just be extended as
+# points are added
+class Emulator:
+    def __init__ ( self, lower, upper, length=LENGTH, noise=NOISE, capacity=CAPACITY ):
+        self.lower = numpy.asarray(lower, dtype=float)
+        self.width = numpy.asarray(upper, dtype=float) - self.lower
+        self.width[~(self.width > 0)] = 1
+        self.length = length
+        self.noise = noise
+        self.capacity = capacity
+        self.X = numpy.zeros((0, len(self.lower)))
+        self.Y = None
+        self.L = None
+
+    def __len__ ( self ):
+        return len(self.X)
+
+    def scale ( self, X ):
+        return (numpy.asarray(X, dtype=float) - self.lower) / self.width
+
+    def correlation ( self, A, B ):
+        d2 = numpy.sum((A[:, numpy.newaxis, :] - B[numpy.newaxis, :, :]) ** 2, axis=2)
+        return numpy.exp(-0.5 * d2 / self.length ** 2)
+
+    # add training points X [n x nparams] with outputs Y [n x nout]
+    def add ( self, X, Y ):
+        X = self.scale(X)
+        Y = numpy.atleast_2d(numpy.asarray(Y, dtype=float))
+        if len(X) == 0:
+            return
+
+        old = len(self.X)
+        self.X = numpy.vstack((self.X, X))
+        self.Y = Y if self.Y is None else numpy.vstack((self.Y, Y))
+
+        if len(self.X) > self.capacity:
+            # drop the oldest points in one go, so this doesn't happen every time
+            keep = self.capacity // 2
+            self.X = self.X[-keep:]
+            self.Y = self.Y[-keep:]
+            self.factorise()
+        elif self.L is None:
+            self.factorise()
+        else:
+            self.extend(old)
+
+    # factorise the whole correlation matrix from scratch
+    def factorise ( self ):
+        K = self.correlation(self.X, self.X)
+        jitter = self.noise
+        while True:
+            try:
+                self.L = numpy.linalg.cholesky(K + jitter * numpy.eye(len(K)))
+                return
+            except numpy.linalg.LinAlgError:
+                jitter = max(10 * jitter, JITTER)
+
+    # extend the factor for the points from index old onwards
+    def extend ( self, old ):
+        Xn = self.X[old:]
+        K12 = self.correlation(self.X[:old], Xn)
+        K22 = self.correlation(Xn, Xn) + self.noise * numpy.eye(len(Xn))
+        B = scipy.linalg.solve_triangular(self.L, K12, lower=True).T
+        try:
+            C = numpy.linalg.cholesky(K22 - numpy.dot(B, B.T))
+        except numpy.linalg.LinAlgError:
+            # near-duplicate points, most likely -- start again with more jitter
+            self.factorise()
+            return
+
+        L = numpy.zeros((len(self.X), len(self.X)))
+        L[:old, :old] = self.L
+        L[old:, :old] = B
+        L[old:, old:] = C
+        self.L = L
+
+    # predictive mean and standard deviation of the outputs at X, each [n x nout]
+    def predict ( self, X ):
+        Xs = self.scale(X)
+        mean = numpy.mean(self.Y, axis=0)
+        var = numpy.var(self.Y, axis=0) if len(self.Y) > 1 else numpy.ones(self.Y.shape[1])
+        var[~(var > 0)] = 1
+
+        a = scipy.linalg.solve_triangular(self.L, self.Y - mean, lower=True)
+        v = scipy.linalg.solve_triangular(self.L, self.correlation(self.X, Xs), lower=True)
+
+        mu = mean + numpy.dot(v.T, a)
+        reduction = numpy.maximum(1 + self.noise - numpy.sum(v ** 2, axis=0), self.noise)
+        sd = numpy.sqrt(reduction[:, numpy.newaxis] * var)
+        return mu, sd
+
+# the screening layer for one model, deciding which proposals are worth simulating
+# and learning from the distances of those that are
+class Screen:
+    def __init__ ( self, lower, upper, plausible=PLAUSIBLE, explore=EXPLORE, min_points=MIN_POINTS, **kwargs ):
+        if not explore > 0:
+            raise Exception('surrogate screening needs some exploration, or it may never accept anything')
+        self.emulator = Emulator(lower, upper, **kwargs)
+        self.plausible = plausible
+        self.explore = explore
+        self.min_points = min_points
+        self.screened = 0
+        self.simulated = 0
+        self.explored = 0
+
+    # predicted probability of each proposal being within every component of epsilon
+    def plausibility ( self, params, epsilon ):
+        mu, sd = self.emulator.predict(params)
+        z = (numpy.log(numpy.asarray(epsilon, dtype=float)) - mu) / sd
+        return numpy.prod(scipy.stats.norm.cdf(z), axis=1)
+
+    # which of the proposals to simulate, as a boolean array, and the probability
+    # with which each was selected (1 if plausible, explore if not)
+    def select ( self, params, epsilon ):
+        n = len(params)
+        if (epsilon is None or len(self.emulator) < self.min_points
+                or not numpy.all(numpy.asarray(epsilon) > 0)):
+            self.simulated += n
+            return numpy.ones(n, dtype=bool), numpy.ones(n)
+
+        plausible = self.plausibility(params, epsilon) >= self.plausible
+        explore = ~plausible & (numpy.random.uniform(size=n) < self.explore)
+        keep = plausible | explore
+
+        self.simulated += numpy.sum(keep)
+        self.explored += numpy.sum(explore)
+        self.screened += n - numpy.sum(keep)
+        return keep, numpy.where(plausible, 1.0, self.explore)
+
+    # learn from the distances of some simulated proposals -- each as the list of beta
+    # replicates of the distance components, averaged in log space
+    # failed simulations are treated as a little worse than anything seen so far
+    def update ( self, params, distances ):
+        if len(params) == 0:
+            return
+        with numpy.errstate(all='ignore'):
+            logd = numpy.log(numpy.asarray(distances, dtype=float))
+            finite = numpy.isfinite(logd)
+            known = self.emulator.Y
+            if known is not None and len(known):
+                worst = numpy.max(known, axis=0)
+            elif numpy.any(finite):
+                worst = numpy.max(logd[finite])
+            else:
+                return
+            logd = numpy.where(finite, logd, worst + 1)
+        self.emulator.add(params, numpy.mean(logd, axis=1))
+
+    def report ( self ):
+        total = self.screened + self.simulated
+        rate = 100.0 * self.screened / total if total else 0
+        return 'Surrogate: %d proposals screened out (%.1f%%), %d simulated (%d exploring), trained on %d points' % (self.screened, rate, self.simulated, self.explored, len(self.emulator))
+
+# a screen for a model_bcmd model, bounded by its priors
+def forModel ( model, **kwargs ):
+    bounds = [ prior_bounds(x) for x in model.prior ]
+    return Screen([ b[0] for b in bounds ], [ b[1] for b in bounds ], **kwargs)
+
+# seed a screen from a dsim results file for the same model, recalculating the
+# distance of each job and replicate from its stored traces with the given
+# abcsmc-style distance function -- jobs lacking any of the model's parameters or
+# vars, or recorded at different times, can't be used
+# returns the number of simulations added
+def seed ( screen, filename, model, distancefn, data ):
+    import results
+    res = results.indexed_results(filename)
+
+    if any([ name not in res.params for name in model.initnames ]):
+        print >> sys.stderr, 'surrogate: %s lacks some model parameters, not used' % filename
+        return 0
+    if len(res.columns) - res.t0Index != len(model.times):
+        print >> sys.stderr, 'surrogate: %s has different time points, not used' % filename
+        return 0
+
+    rows = [ res.speciesRows(name) for name in model.vnames ]
+    if any([ len(r) == 0 for r in rows ]) or len(set([ len(r) for r in rows ])) > 1:
+        print >> sys.stderr, 'surrogate: %s lacks some model vars, not used' % filename
+        return 0
+
+    # rows of each species are written in job then rep order, so they line up
+    order = [ res.params.index(name) for name in model.initnames ]
+    params = res.paramValues(rows[0])[:, order]
+    traces = numpy.dstack([ res.traces(r) for r in rows ])
+    dists = [ [ distancefn(traces[ii], data, params[ii], 0) ] for ii in range(len(params)) ]
+
+    screen.update(params, dists)
+    return len(params)
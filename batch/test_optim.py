@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# check that optimisation objectives give the same values whether their
+# simulations are run one at a time or in parallel batches
+# uses the rc example job, so the rc model must have been built
+# run from the batch directory: python -m unittest test_optim
+
+import numpy as np
+import os, os.path
+import shutil
+import tempfile
+import unittest
+
+import optim
+
+JOBFILE = os.path.join(optim.HERE, 'rc_example.optjob')
+PROGRAM = os.path.join(optim.BUILD, 'rc.model')
+
+# synthetic target data -- only the agreement of the distances matters, not their size
+TIMES = [2, 4, 6, 8, 10, 12, 15, 18, 20]
+V = [5, 0, 0, 10, 10, 15, -8, -8, 0]
+VC = [0.8, 0.6, 0.4, 2.0, 4.0, 7.5, 4.2, 1.0, 0.5]
+
+@unittest.skipUnless(os.path.exists(PROGRAM), 'rc model not built')
+class BatchObjectiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test_optim')
+        datafile = os.path.join(self.tmp, 'rc_target.csv')
+        with open(datafile, 'w') as f:
+            print >> f, 't,Vc,V'
+            for row in zip(TIMES, VC, V):
+                print >> f, ','.join([ str(x) for x in row ])
+
+        self.config = dict(optim.CONFIG)
+        self.config.update({ 'jobfile': JOBFILE,
+                             'datafile': datafile,
+                             'build': optim.BUILD,
+                             'work': self.tmp,
+                             'dryrun': False,
+                             'wetrun': False,
+                             'debug': False })
+        optim.process_inputs(self.config)
+
+        # C values around the true one, with R fixed by the job at something
+        # other than the model default
+        self.pp = [ [c] for c in [0.001, 0.003, 0.005, 0.008, 0.02, 0.1] ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def compare(self, steady):
+        self.config['steady'] = steady
+        model = optim.make_model(self.config)
+
+        single = model.optimisable(self.config['distance'])
+        batch = model.batchOptimisable(self.config['distance'], nbatch=4)
+
+        expected = [ single(p) for p in self.pp ]
+        self.assertTrue(all(np.isfinite(expected)))
+
+        for x, y in zip(expected, batch(self.pp)):
+            self.assertAlmostEqual(x, y, places=9)
+
+    def test_unsteadied(self):
+        self.compare(0)
+
+    def test_steadied(self):
+        self.compare(50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+
+# times the batched transforms on a [channels, samples] array against the original
+# one-signal-at-a-time code in reference.py, and checks the coefficients agree
+#
+# usage: python benchmark.py [channels [samples [levels [wavelet]]]]
+
+import sys
+import time
+import numpy as np
+import dwt
+import reference
+
+TOLERANCE = 1e-10
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+def compare(name, new, newtime, old, oldtime):
+    diff = np.max(np.abs(np.asarray(new) - np.asarray(old)))
+    print '%-10s %10.4f %10.4f %8.1fx %12.3g' % (name, oldtime, newtime, oldtime / max(newtime, 1e-9), diff)
+    return diff <= TOLERANCE
+
+def main(channels=16, samples=4096, levels=4, wavelet='db4'):
+    X = np.random.standard_normal((channels, samples))
+    ok = True
+
+    print '%d channels x %d samples, %d levels of %s' % (channels, samples, levels, wavelet)
+    print '%-10s %10s %10s %9s %12s' % ('transform', 'loop (s)', 'batch (s)', 'speedup', 'max diff')
+
+    for ext in ['per', 'sym']:
+        (coefs, length, flag), newtime = timed(dwt.dwt, X, levels, wavelet, ext)
+        start = time.time()
+        old = [ reference.dwt(x, levels, wavelet, ext) for x in X ]
+        oldtime = time.time() - start
+        ok &= compare('dwt ' + ext, coefs, newtime, [ o[0] for o in old ], oldtime)
+
+        inv, newtime = timed(dwt.idwt, coefs, wavelet, length, flag)
+        start = time.time()
+        oldinv = [ reference.idwt(o[0], wavelet, o[1], o[2]) for o in old ]
+        oldtime = time.time() - start
+        ok &= compare('idwt ' + ext, inv, newtime, oldinv, oldtime)
+
+    (coefs, length), newtime = timed(dwt.swt, X, levels, wavelet)
+    start = time.time()
+    old = [ reference.swt(x, levels, wavelet) for x in X ]
+    oldtime = time.time() - start
+    ok &= compare('swt', coefs, newtime, [ o[0] for o in old ], oldtime)
+
+    inv, newtime = timed(dwt.iswt, coefs, levels, wavelet)
+    start = time.time()
+    oldinv = [ reference.iswt(o[0], levels, wavelet) for o in old ]
+    oldtime = time.time() - start
+    ok &= compare('iswt', inv, newtime, oldinv, oldtime)
+
+    if not ok:
+        print 'coefficients differ by more than %g' % TOLERANCE
+    return ok
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    channels = int(args[0]) if len(args) > 0 else 16
+    samples = int(args[1]) if len(args) > 1 else 4096
+    levels = int(args[2]) if len(args) > 2 else 4
+    wavelet = args[3] if len(args) > 3 else 'db4'
+    sys.exit(0 if main(channels, samples, levels, wavelet) else 1)
@@ -3,40 +3,47 @@
 import sys
 import numpy as np
 
+# all the transforms convolve along the last axis, so that a 2-D [channels, samples]
+# array is processed in one go, with b a 1-D filter
+
+# smallest length >= n with no prime factors above 5, for which the FFT is quick
+def fft_len(n):
+    best=1
+    while best < n:
+        best*=2
+    p5=1
+    while p5 < best:
+        p35=p5
+        while p35 < best:
+            m=p35
+            while m < n:
+                m*=2
+            best=min(best,m)
+            p35*=3
+        p5*=5
+    return best
+
 def convfft(a,b):
-    len_c = len(a)+len(b)-1
-    a=np.array(a)
-    b=np.array(b)
-    az=np.zeros(len_c-len(a))
-    bz=np.zeros(len_c-len(b))
-    a=np.append(a,az)
-    b=np.append(b,bz)
-    
-    x=np.fft.fft(a)
-    y=np.fft.fft(b)
-    z=x*y
-    oup=np.fft.ifft(z)
-    return oup
-    
+    a=np.asarray(a)
+    b=np.asarray(b)
+    len_c = a.shape[-1]+len(b)-1
+    len_f = fft_len(len_c)
+
+    x=np.fft.fft(a,len_f,axis=-1)
+    y=np.fft.fft(b,len_f)
+    oup=np.fft.ifft(x*y,axis=-1)
+    return oup[...,:len_c]
+
 
 def convol(a,b):
-    len_c = len(a)+len(b)-1
-    a=np.array(a)
-    b=np.array(b)
-    az=np.zeros(len_c-len(a))
-    bz=np.zeros(len_c-len(b))
-    a=np.append(a,az)
-    b=np.append(b,bz)
-    c=np.zeros(len_c)
-    
-    for i in range(len_c):
-        for j in range(i+1):
-            oup=a[j]*b[i-j]
-            c[i]+=oup
-            
-    return c        
-
-
-
-    
-    
\ No newline at end of file
+    a=np.asarray(a,dtype=float)
+    b=np.asarray(b,dtype=float)
+    len_a=a.shape[-1]
+    len_c = len_a+len(b)-1
+    c=np.zeros(a.shape[:-1]+(len_c,))
+
+    # one pass per filter tap rather than per sample
+    for j in range(len(b)):
+        c[...,j:j+len_a]+=a*b[j]
+
+    return c
@@ -5,226 +5,83 @@ import numpy as np
 import dwt
 from math import sqrt
 
+# sig may be a single signal or a 2-D [channels, samples] array, in which case the
+# thresholds are estimated for each channel separately
+
+# apply thresholds td (one per channel) to coefficients c
+def threshold(c,td,dn_thresh):
+	td=np.asarray(td)[...,np.newaxis]
+	mag=np.abs(c)
+	if dn_thresh == "hard":
+		return np.where(mag <= td,0,c)
+	elif dn_thresh == "soft":
+		return np.where(mag >= td,np.sign(c)*(mag - td),0)
+	return c
+
+# universal threshold for each channel of c
+def visu_threshold(c):
+	sigma=np.median(np.abs(c),axis=-1)
+	return sqrt(2.0 * np.log(c.shape[-1])) * sigma / 0.6745
+
+# SURE threshold for each channel of c, falling back to the universal threshold
+# for sparse coefficients
+def sure_threshold(c):
+	dwt_len=int(c.shape[-1])
+	dwt_med=np.abs(c)
+	sigma=np.median(dwt_med,axis=-1)
+
+	tv=sqrt(2.0 * np.log(dwt_len))
+	te=(np.sum(c**2,axis=-1) - dwt_len)/dwt_len
+	ct=((np.log(dwt_len)/np.log(2))**1.5)/sqrt(dwt_len)
+
+	x_sure=np.sort(dwt_med,axis=-1)**2
+	x_sum=np.sum(x_sure,axis=-1)[...,np.newaxis]
+	risk_vector=(dwt_len - (2 *(np.arange(dwt_len)+1)) + x_sum + (x_sure * np.linspace(dwt_len-1,0,dwt_len)))/dwt_len
+	minindex=risk_vector.argmin(axis=-1)
+	flat=np.reshape(x_sure,(-1,dwt_len))
+	thr=np.sqrt(np.reshape(flat[np.arange(len(flat)),np.ravel(minindex)],np.shape(minindex)))
+
+	td=np.where(te < ct,tv,np.minimum(thr,tv))
+	td=np.where(sigma < 0.00000001,0,td)
+	return td * sigma / 0.6745
+
 def denoise(sig,mode_denoise,nm_dn,J_dn,dn_method,dn_thresh):
-	signal=np.array(sig)
-	sig_size=int(len(signal))
+	signal=np.array(sig,dtype=float)
+	sig_size=int(signal.shape[-1])
 	max_dec=int(np.floor(np.log2(sig_size)))-1
 	if J_dn >= max_dec:
 		J_dn=max_dec
-	
-	if dn_method == "visushrink" or dn_method == "visu":
-		if mode_denoise == "swt":
-			[dwt_output,length]=dwt.swt(signal,J_dn,nm_dn)
-			dwt_len=int(len(dwt_output))
-			dwt_med=np.abs(dwt_output)
-			sigma=np.median(dwt_med)
-			td=sqrt(2.0 * np.log(dwt_len)) * sigma / 0.6745
-			
-			if dn_thresh == "hard":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) <= td:
-						dwt_output[iter]=0
-						
-			elif dn_thresh == "soft":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) >= td:
-						dwt_output[iter]=np.sign(dwt_output[iter])*(np.abs(dwt_output[iter]) - td)
-					else:
-						dwt_output[iter]=0
-			
-			output=dwt.iswt(dwt_output,J_dn,nm_dn)	
-		
-		elif mode_denoise == "per" or mode_denoise == "dwt_per":
+
+	if mode_denoise == "swt":
+		[dwt_output,length]=dwt.swt(signal,J_dn,nm_dn)
+		# detail coefficients of each level, after the approximation
+		levels=[ ((it+1)*length,(it+2)*length) for it in range(J_dn) ]
+	else:
+		if mode_denoise == "per" or mode_denoise == "dwt_per":
 			ext="per"
-			[dwt_output,length,flag]=dwt.dwt(signal,J_dn,nm_dn,ext)
-			dwt_len=int(len(dwt_output))
-			dwt_med=np.abs(dwt_output)
-			sigma=np.median(dwt_med)
-			td=sqrt(2.0 * np.log(dwt_len)) * sigma / 0.6745
-			
-			if dn_thresh == "hard":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) <= td:
-						dwt_output[iter]=0
-						
-			elif dn_thresh == "soft":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) >= td:
-						dwt_output[iter]=np.sign(dwt_output[iter])*(np.abs(dwt_output[iter]) - td)
-					else:
-						dwt_output[iter]=0
-			
-			output=dwt.idwt(dwt_output,nm_dn,length,flag)			
-			
 		else:
 			ext="sym"
-			[dwt_output,length,flag]=dwt.dwt(signal,J_dn,nm_dn,ext)
-			dwt_len=int(len(dwt_output))
-			dwt_med=np.abs(dwt_output)
-			sigma=np.median(dwt_med)
-			td=sqrt(2.0 * np.log(dwt_len)) * sigma / 0.6745
-			
-			if dn_thresh == "hard":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) <= td:
-						dwt_output[iter]=0
-						
-			elif dn_thresh == "soft":
-				for iter in range(dwt_len):
-					if np.abs(dwt_output[iter]) >= td:
-						dwt_output[iter]=np.sign(dwt_output[iter])*(np.abs(dwt_output[iter]) - td)
-					else:
-						dwt_output[iter]=0
-			
-			output=dwt.idwt(dwt_output,nm_dn,length,flag)
-			
-	elif dn_method == "sureshrink" or dn_method == "sure":
-		if mode_denoise == "swt":
-			[dwt_output,length]=dwt.swt(signal,J_dn,nm_dn)
-			for it in range(J_dn):
-				dwt_med=np.abs(dwt_output[(it+1)*length:(it+2)*length])
-				coef=(dwt_output[(it+1)*length:(it+2)*length])
-				sigma=np.median(dwt_med)
-				dwt_len=int(length)
-				
-				if sigma < 0.00000001:
-					td=0
-				else:
-					tv=sqrt(2.0 * np.log(dwt_len))
-					norm1=np.linalg.norm(coef)
-					te=(norm1**2 - dwt_len)/dwt_len
-					ct=((np.log(dwt_len)/np.log(2))**1.5)/sqrt(dwt_len)
-					
-					if te < ct:
-						td = tv
-					else:
-						dwt_med=np.sort(dwt_med)
-						dmlen=int(len(dwt_med))
-						x_sure=dwt_med**2
-						x_sum=np.sum(x_sure)
-						
-						risk_vector=(dmlen - (2 *(np.arange(dmlen)+1)) + x_sum + (x_sure * np.linspace(dmlen-1,0,dmlen)))/dmlen
-						minindex = risk_vector.argmin()
-						thr=sqrt(x_sure[minindex])
-						td=min(thr,tv)
-				
-				td = td * sigma / 0.6745
-				if dn_thresh == "hard":
-					for iter in range(dwt_len):
-						if dwt_med[iter] <= td:
-							dwt_output[iter+(it+1)*length]=0
-				
-				elif dn_thresh == "soft":
-					for iter in range(dwt_len):
-						if dwt_med[iter] >= td:
-							dwt_output[iter+(it+1)*length]=np.sign(dwt_output[iter+(it+1)*length])*(np.abs(dwt_output[iter+(it+1)*length]) - td)
-						else:
-							dwt_output[iter+(it+1)*length]=0
-						
-			output=dwt.iswt(dwt_output,J_dn,nm_dn)		
-		
-		elif mode_denoise == "per" or mode_denoise == "dwt_per":
-			ext="per"
-			[dwt_output,length,flag]=dwt.dwt(signal,J_dn,nm_dn,ext)
-			len1=int(len(dwt_output)/2**J_dn)
-			
-			for it in range(J_dn):
-				dwt_med=np.abs(dwt_output[len1:2*len1])
-				coef=dwt_output[len1:2*len1]
-				sigma=np.median(dwt_med)
-				dwt_len=int(len1)
-				
-				if sigma < 0.00000001:
-					td=0
-				else:
-					tv=sqrt(2.0 * np.log(dwt_len))
-					norm1=np.linalg.norm(coef)
-					te=(norm1**2 - dwt_len)/dwt_len
-					ct=((np.log(dwt_len)/np.log(2))**1.5)/sqrt(dwt_len)
-					
-					if te < ct:
-						td = tv
-					else:
-						dwt_med=np.sort(dwt_med)
-						dmlen=int(len(dwt_med))
-						x_sure=dwt_med**2
-						x_sum=np.sum(x_sure)
-						
-						risk_vector=(dmlen - (2 *(np.arange(dmlen)+1)) + x_sum + (x_sure * np.linspace(dmlen-1,0,dmlen)))/dmlen
-						minindex = risk_vector.argmin()
-						thr=sqrt(x_sure[minindex])
-						td=min(thr,tv)
-				
-				td = td * sigma / 0.6745
-				
-				if dn_thresh == "hard":
-					for iter in range(dwt_len):
-						if dwt_med[iter] <= td:
-							dwt_output[iter+len1]=0
-				
-				elif dn_thresh == "soft":
-					for iter in range(dwt_len):
-						if dwt_med[iter] >= td:
-							dwt_output[iter+len1]=np.sign(dwt_output[iter+len1])*(np.abs(dwt_output[iter+len1]) - td)
-						else:
-							dwt_output[iter+len1]=0
-							
-				
-				len1=int(2*len1)
-			
-			output=dwt.idwt(dwt_output,nm_dn,length,flag)						
-		
+		[dwt_output,length,flag]=dwt.dwt(signal,J_dn,nm_dn,ext)
+		if ext == "per":
+			len1=int(dwt_output.shape[-1]/2**J_dn)
+			levels=[ (len1*2**it,len1*2**(it+1)) for it in range(J_dn) ]
 		else:
-			ext="sym"
-			[dwt_output,length,flag]=dwt.dwt(signal,J_dn,nm_dn,ext)
-			len1=length[0]
-			
-			for it in range(J_dn):
-				dwt_med=np.abs(dwt_output[len1:len1+length[it+1]])
-				coef=dwt_output[len1:len1+length[it+1]]
-				sigma=np.median(dwt_med)
-				dwt_len=int(length[it+1])
-				
-				if sigma < 0.00000001:
-					td=0
-				else:
-					tv=sqrt(2.0 * np.log(dwt_len))
-					norm1=np.linalg.norm(coef)
-					te=(norm1**2 - dwt_len)/dwt_len
-					ct=((np.log(dwt_len)/np.log(2))**1.5)/sqrt(dwt_len)
-					
-					if te < ct:
-						td = tv
-					else:
-						dwt_med=np.sort(dwt_med)
-						dmlen=int(len(dwt_med))
-						x_sure=dwt_med**2
-						x_sum=np.sum(x_sure)
-						
-						risk_vector=(dmlen - (2 *(np.arange(dmlen)+1)) + x_sum + (x_sure * np.linspace(dmlen-1,0,dmlen)))/dmlen
-						minindex = risk_vector.argmin()
-						thr=sqrt(x_sure[minindex])
-						td=min(thr,tv)
-				
-				td = td * sigma / 0.6745
-				
-				if dn_thresh == "hard":
-					for iter in range(dwt_len):
-						if dwt_med[iter] <= td:
-							dwt_output[iter+len1]=0
-				
-				elif dn_thresh == "soft":
-					for iter in range(dwt_len):
-						if dwt_med[iter] >= td:
-							dwt_output[iter+len1]=np.sign(dwt_output[iter+len1])*(np.abs(dwt_output[iter+len1]) - td)
-						else:
-							dwt_output[iter+len1]=0
-							
-				
-				len1=len1+length[it+1]
-			
-			output=dwt.idwt(dwt_output,nm_dn,length,flag)
-																
+			ends=np.cumsum(length[:J_dn+1]).astype(int)
+			levels=zip(ends[:-1],ends[1:])
+
+	if dn_method == "visushrink" or dn_method == "visu":
+		dwt_output=threshold(dwt_output,visu_threshold(dwt_output),dn_thresh)
+
+	elif dn_method == "sureshrink" or dn_method == "sure":
+		for start,end in levels:
+			coef=dwt_output[...,start:end]
+			dwt_output[...,start:end]=threshold(coef,sure_threshold(coef),dn_thresh)
+
+	if mode_denoise == "swt":
+		output=dwt.iswt(dwt_output,J_dn,nm_dn)
+	else:
+		output=dwt.idwt(dwt_output,nm_dn,length,flag)
+
 	return output
 	
 """def main():
@@ -4,6 +4,11 @@ import sys
 import numpy as np
 import filter,misc,convol,sample
 
+# the 1-D transforms work along the last axis, so a 2-D [channels, samples] array
+# is transformed channel by channel in one go, with the coefficients of each channel
+# laid out along its row as for a single signal -- the 2-D (image) transforms are
+# built on the same, treating rows and then columns as batches of signals
+
 def swt2(inpsig,J,nm):
     swtout=np.array([])
     sig=np.array(inpsig)
@@ -15,8 +20,6 @@ def swt2(inpsig,J,nm):
     
     for iter in range(J):
         U=int(2**iter)
-        low_pass=np.array([])
-        high_pass=np.array([])
         if iter>0:
             low_pass=sample.upsamp(lp1,U)
             high_pass=sample.upsamp(hp1,U)
@@ -36,60 +39,16 @@ def swt2(inpsig,J,nm):
         else:
             cols_n=int(np.size(sig,1)+1) 
         
+        signal=misc.per_ext2d(sig,lf/2)
         
+        # filter the rows, then the columns of each result
+        sigL=np.real(convol.convfft(signal,low_pass))[:,lf:][:,0:cols_n]
+        sigH=np.real(convol.convfft(signal,high_pass))[:,lf:][:,0:cols_n]
         
-        signal=np.ndarray(shape=(rows_n+lf,cols_n+lf))
-        
-        signal=misc.per_ext2d(sig,lf/2)
-        len_x=int(np.size(signal,0))
-        len_y=int(np.size(signal,1))
-     
-        sigL=np.ndarray(shape=(rows_n+lf,cols_n))
-        sigH=np.ndarray(shape=(rows_n+lf,cols_n))
-        cA=np.ndarray(shape=(rows_n,cols_n))
-        cH=np.ndarray(shape=(rows_n,cols_n))
-        cV=np.ndarray(shape=(rows_n,cols_n))
-        cD=np.ndarray(shape=(rows_n,cols_n))
-        
-        for i in range(len_x):
-            temp_row=signal[i,0:len_y]
-            oup=np.real(convol.convfft(temp_row,low_pass))
-            oup=oup[lf:]
-            oup=oup[0:cols_n]
-            
-            oup2=np.real(convol.convfft(temp_row,high_pass))
-            oup2=oup2[lf:]
-            oup2=oup2[0:cols_n]
-            
-            sigL[i,:]=oup
-            sigH[i,:]=oup2
-        
-        for j in range(cols_n):
-            temp_row=sigL[0:len_x,j]
-            oup=np.real(convol.convfft(temp_row,low_pass))
-            oup=oup[lf:]
-            oup=oup[0:rows_n]
-            
-            oup2=np.real(convol.convfft(temp_row,high_pass))
-            oup2=oup2[lf:]
-            oup2=oup2[0:rows_n]
-            
-            cA[:,j]=oup
-            cH[:,j]=oup2
-            
-        
-        for j in range(cols_n):
-            temp_row=sigH[0:len_x,j]
-            oup=np.real(convol.convfft(temp_row,low_pass))
-            oup=oup[lf:]
-            oup=oup[0:rows_n]
-            
-            oup2=np.real(convol.convfft(temp_row,high_pass))
-            oup2=oup2[lf:]
-            oup2=oup2[0:rows_n]
-            
-            cV[:,j]=oup
-            cD[:,j]=oup2
+        cA=np.real(convol.convfft(sigL.T,low_pass))[:,lf:][:,0:rows_n].T
+        cH=np.real(convol.convfft(sigL.T,high_pass))[:,lf:][:,0:rows_n].T
+        cV=np.real(convol.convfft(sigH.T,low_pass))[:,lf:][:,0:rows_n].T
+        cD=np.real(convol.convfft(sigH.T,high_pass))[:,lf:][:,0:rows_n].T
         
         sig=cA
         temp_sig2=np.array([])
@@ -238,7 +197,11 @@ def idwt2(dwtop,nm,length,flag):
     cols=int(length[1])
     sum_coef=int(0)
     [lp1,hp1,lp2,hp2]=filter.filtcoef(nm)
-    lf=len(lp1)
+    
+    if int(flag[2])==0:
+        inverse=idwt1
+    else:
+        inverse=idwt1_sym
     
     for iter in range(J):
         rows_n=int(length[2*int(iter)])
@@ -264,64 +227,10 @@ def idwt2(dwtop,nm,length,flag):
         len_x=np.size(cLH,0)
         len_y=np.size(cLH,1)
         
-        if flag[2]==0:
-            cL=np.ndarray(shape=(2*len_x,len_y))
-            cH=np.ndarray(shape=(2*len_x,len_y))
-            t_iter=2*len_x
-        else:
-            cL=np.ndarray(shape=(2*len_x-lf+2,len_y))
-            cH=np.ndarray(shape=(2*len_x-lf+2,len_y))
-            t_iter=2*len_x-lf+2
-        
-        if iter==0:
-            for j in range(len_y):
-                sigLL=cLL[0:len_x,j]
-                sigLH=cLH[0:len_x,j]
-                if int(flag[2])==0:
-                    oup=idwt1(sigLL,sigLH,nm)
-                    cL[:,j]=oup
-                else:
-                    oup=idwt1_sym(sigLL,sigLH,nm)
-                    cL[:,j]=oup
-                    
-        else:
-            rows1=int(np.size(cLH,0))
-            cols1=int(np.size(cLH,1))
-            
-            for j in range(cols1):
-                sigLL=cLL[0:rows1,j]
-                sigLH=cLH[0:rows1,j]
-                if int(flag[2])==0:
-                    oup=idwt1(sigLL,sigLH,nm)
-                    cL[:,j]=oup
-                else:
-                    oup=idwt1_sym(sigLL,sigLH,nm)
-                    cL[:,j]=oup    
-        
-        for j in range(len_y):
-            sigHL=cHL[0:len_x,j]
-            sigHH=cHH[0:len_x,j]
-            if int(flag[2])==0:
-                oup=idwt1(sigHL,sigHH,nm)
-                cH[:,j]=oup
-            else:
-                oup=idwt1_sym(sigHL,sigHH,nm)
-                cH[:,j]=oup    
-        
-        if int(flag[2])==0:
-            signal=np.ndarray(shape=(2*len_x,2*len_y))
-        else:
-            signal=np.ndarray(shape=(2*len_x-lf+2,2*len_y-lf+2))
-        
-        for i in range(t_iter):
-            sigL=cL[i,0:len_y]
-            sigH=cH[i,0:len_y]
-            if int(flag[2])==0:
-                oup=idwt1(sigL,sigH,nm)
-                signal[i,:]=oup
-            else:
-                oup=idwt1_sym(sigL,sigH,nm)
-                signal[i,:]=oup    
+        # reconstruct the columns, then the rows
+        cL=inverse(cLL[0:len_x,0:len_y].T,cLH.T,nm).T
+        cH=inverse(cHL.T,cHH.T,nm).T
+        signal=inverse(cL,cH,nm)
         
         idwt_output=signal
         if iter==0:
@@ -338,79 +247,20 @@ def idwt2(dwtop,nm,length,flag):
                 
         
 def dwt2_sym(signal,name):
-    rows=int(np.size(signal,0))
-    cols=int(np.size(signal,1))
-    [lp1,hp1,lp2,hp2]=filter.filtcoef(name)
-    lf=len(lp1)
-    rows_n=int(np.floor((rows+lf-1)*1.0/2.0))
-    cols_n=int(np.floor((cols+lf-1)*1.0/2.0))
-    
-    lp_dn1=np.ndarray(shape=(rows,cols_n))
-    hp_dn1=np.ndarray(shape=(rows,cols_n))
-    cLL=np.ndarray(shape=(rows_n,cols_n))
-    cLH=np.ndarray(shape=(rows_n,cols_n))
-    cHL=np.ndarray(shape=(rows_n,cols_n))
-    cHH=np.ndarray(shape=(rows_n,cols_n))
-    
-    
-    for i in range(rows):
-        temp_row=signal[i,:]
-        [oup_lp,oup_hp]=dwt1_sym(temp_row,name)
-        lp_dn1[i,:]=oup_lp
-        hp_dn1[i,:]=oup_hp
-    
-    cols=cols_n
+    signal=np.asarray(signal)
+    [lp_dn1,hp_dn1]=dwt1_sym(signal,name)
+    [cLL,cLH]=dwt1_sym(lp_dn1.T,name)
+    [cHL,cHH]=dwt1_sym(hp_dn1.T,name)
     
-    for j in range(cols):
-        temp_row3=lp_dn1[:,j]
-        [oup_lp,oup_hp]=dwt1_sym(temp_row3,name)
-        cLL[:,j]=oup_lp
-        cLH[:,j]=oup_hp
-        
-    for j in range(cols):
-        temp_row5=hp_dn1[:,j]
-        [oup_lp,oup_hp]=dwt1_sym(temp_row5,name)
-        cHL[:,j]=oup_lp
-        cHH[:,j]=oup_hp
-    
-    return cLL,cLH,cHL,cHH        
+    return cLL.T,cLH.T,cHL.T,cHH.T        
 
 def dwt2_per(signal,name):
-    rows=int(np.size(signal,0))
-    cols=int(np.size(signal,1))
-    rows_n=int(np.ceil(rows*1.0/2.0))
-    cols_n=int(np.ceil(cols*1.0/2.0))
-    
-    lp_dn1=np.ndarray(shape=(rows,cols_n))
-    hp_dn1=np.ndarray(shape=(rows,cols_n))
-    cLL=np.ndarray(shape=(rows_n,cols_n))
-    cLH=np.ndarray(shape=(rows_n,cols_n))
-    cHL=np.ndarray(shape=(rows_n,cols_n))
-    cHH=np.ndarray(shape=(rows_n,cols_n))
-    
-    [lp1,hp1,lp2,hp2]=filter.filtcoef(name)
-    
-    for i in range(rows):
-        temp_row=signal[i,:]
-        [oup_lp,oup_hp]=dwt1(temp_row,name)
-        lp_dn1[i,:]=oup_lp
-        hp_dn1[i,:]=oup_hp
+    signal=np.asarray(signal)
+    [lp_dn1,hp_dn1]=dwt1(signal,name)
+    [cLL,cLH]=dwt1(lp_dn1.T,name)
+    [cHL,cHH]=dwt1(hp_dn1.T,name)
     
-    cols=cols_n
-    
-    for j in range(cols):
-        temp_row3=lp_dn1[:,j]
-        [oup_lp,oup_hp]=dwt1(temp_row3,name)
-        cLL[:,j]=oup_lp
-        cLH[:,j]=oup_hp
-        
-    for j in range(cols):
-        temp_row5=hp_dn1[:,j]
-        [oup_lp,oup_hp]=dwt1(temp_row5,name)
-        cHL[:,j]=oup_lp
-        cHH[:,j]=oup_hp
-    
-    return cLL,cLH,cHL,cHH
+    return cLL.T,cLH.T,cHL.T,cHH.T
     
 
 def dwt2(signal,J,nm,ext):
@@ -475,30 +325,31 @@ def dwt2(signal,J,nm,ext):
     
 
 def iswt(swtop,J,nm):
-    N=int(len(swtop)/(J+1))
+    swtop=np.asarray(swtop)
+    N=int(swtop.shape[-1]/(J+1))
     [lpd,hpd,lpr,hpr]=filter.filtcoef(nm)
     low_pass=lpr
     high_pass=hpr
     lf=int(len(low_pass))
     
     for iter in range(J):
-        iswt_output=np.zeros(N)
+        iswt_output=np.zeros(swtop.shape[:-1]+(N,))
         
         if iter==0:
-            appx_sig=swtop[0:N]
-            det_sig=swtop[N:2*N]
+            appx_sig=swtop[...,0:N]
+            det_sig=swtop[...,N:2*N]
         else:
-            det_sig=swtop[(iter+1)*N:(iter+2)*N]
+            det_sig=swtop[...,(iter+1)*N:(iter+2)*N]
         
         value=int(2**(J-1-iter))
         for count in range(value):
-            appx1=appx_sig[count:N:value]
-            det1=det_sig[count:N:value]
+            appx1=appx_sig[...,count:N:value]
+            det1=det_sig[...,count:N:value]
             
-            len1=len(appx1)
+            len1=appx1.shape[-1]
             
-            appx2=appx1[0:len1:2]
-            det2=det1[0:len1:2]
+            appx2=appx1[...,0:len1:2]
+            det2=det1[...,0:len1:2]
             
             U=int(2)
             
@@ -511,16 +362,16 @@ def iswt(swtop,J,nm):
             oup00L=np.real(convol.convfft(cL0,low_pass))
             oup00H=np.real(convol.convfft(cH0,high_pass))
             
-            oup00L=oup00L[lf-1:]
-            oup00L=oup00L[0:len1]
+            oup00L=oup00L[...,lf-1:]
+            oup00L=oup00L[...,0:len1]
             
-            oup00H=oup00H[lf-1:]
-            oup00H=oup00H[0:len1]
+            oup00H=oup00H[...,lf-1:]
+            oup00H=oup00H[...,0:len1]
             
             oup00=oup00L+oup00H
             
-            appx3=appx1[1:len1:2]
-            det3=det1[1:len1:2]
+            appx3=appx1[...,1:len1:2]
+            det3=det1[...,1:len1:2]
             
             cL1=sample.upsamp(appx3,U)
             cH1=sample.upsamp(det3,U)
@@ -531,20 +382,16 @@ def iswt(swtop,J,nm):
             oup01L=np.real(convol.convfft(cL1,low_pass))
             oup01H=np.real(convol.convfft(cH1,high_pass))
             
-            oup01L=oup01L[lf-1:]
-            oup01L=oup01L[0:len1]
+            oup01L=oup01L[...,lf-1:]
+            oup01L=oup01L[...,0:len1]
             
-            oup01H=oup01H[lf-1:]
-            oup01H=oup01H[0:len1]
+            oup01H=oup01H[...,lf-1:]
+            oup01H=oup01H[...,0:len1]
             
             oup01=oup01L+oup01H
             
             oup01=misc.circshift(oup01,-1)
-            index2=int(0)
-            for index in xrange(count,N,value):
-                temp=(oup00[index2]+oup01[index2])*1.0/2.0
-                iswt_output[index]=temp
-                index2+=1
+            iswt_output[...,count:N:value]=(oup00+oup01)*1.0/2.0
             
         appx_sig=iswt_output
     
@@ -555,9 +402,10 @@ def iswt(swtop,J,nm):
             
 
 def swt(sig,J,nm):
-    swtop=np.array([])
-    N=int(len(sig))
+    sig=np.asarray(sig)
+    N=int(sig.shape[-1])
     length=N
+    swtop=[]
     
     [lpd,hpd,lpr,hpr]=filter.filtcoef(nm)
     
@@ -575,55 +423,57 @@ def swt(sig,J,nm):
         cA=np.real(convol.convfft(sig,low_pass))
         cD=np.real(convol.convfft(sig,high_pass))
         
-        cA=cA[len_filt:]
-        cA=cA[0:N]
+        cA=cA[...,len_filt:]
+        cA=cA[...,0:N]
         
-        cD=cD[len_filt:]
-        cD=cD[0:N]
+        cD=cD[...,len_filt:]
+        cD=cD[...,0:N]
         
         sig=cA
+        swtop.insert(0,cD)
         if iter==J-1:
-            swtop=np.append(cD,swtop)
-            swtop=np.append(cA,swtop)
-        else:
-            swtop=np.append(cD,swtop)
-        
+            swtop.insert(0,cA)
     
-    return swtop,length
+    if not swtop:
+        return np.zeros(sig.shape[:-1]+(0,)),length
+    return np.concatenate(swtop,axis=-1),length
             
 
 def idwt1_sym(cA,cD,wname):
     [lpd1,hpd1,lpr1,hpr1]=filter.filtcoef(wname)
-    if len(cA) > len(cD):
-        cA=cA[0:len(cD)]
+    cA=np.asarray(cA)
+    cD=np.asarray(cD)
+    if cA.shape[-1] > cD.shape[-1]:
+        cA=cA[...,0:cD.shape[-1]]
         
     len_lpfilt=int(len(lpr1))
     len_hpfilt=int(len(hpr1))
     lf=len_lpfilt
-    N= 2 * len(cD)
+    N= 2 * cD.shape[-1]
     U=2
 
     cA_up=sample.upsamp(cA,U)
-    cA_up=cA_up[0:len(cA_up)-1]
+    cA_up=cA_up[...,0:cA_up.shape[-1]-1]
     X_lp=np.real(convol.convfft(cA_up,lpr1))
 
     cD_up=sample.upsamp(cD,U)
-    cD_up=cD_up[0:len(cD_up)-1]
+    cD_up=cD_up[...,0:cD_up.shape[-1]-1]
     X_hp=np.real(convol.convfft(cD_up,hpr1))
     
     X=X_lp+X_hp
-    X=X[lf-2:]
-    X=X[:len(X)-lf+2]
+    X=X[...,lf-2:]
+    X=X[...,:X.shape[-1]-lf+2]
     
     return X
 
 def idwt1(cA,cD,wname):
     [lpd1,hpd1,lpr1,hpr1]=filter.filtcoef(wname)
+    cD=np.asarray(cD)
 
     len_lpfilt=int(len(lpr1))
     len_hpfilt=int(len(hpr1))
     len_avg=int(len_lpfilt/2 + len_hpfilt/2)
-    N= 2 * len(cD)
+    N= 2 * cD.shape[-1]
     U=2
 
     cA_up=sample.upsamp(cA,U)
@@ -634,22 +484,22 @@ def idwt1(cA,cD,wname):
     cD_up=misc.per_ext(cD_up,int(len_avg/2))
     X_hp=np.real(convol.convfft(cD_up,hpr1))
     
-    X_lp=X_lp[0:N+len_avg-1]
-    X_lp=X_lp[len_avg-1:]
+    X_lp=X_lp[...,0:N+len_avg-1]
+    X_lp=X_lp[...,len_avg-1:]
 
-    X_hp=X_hp[0:N+len_avg-1]
-    X_hp=X_hp[len_avg-1:]
+    X_hp=X_hp[...,0:N+len_avg-1]
+    X_hp=X_hp[...,len_avg-1:]
     
     X=X_lp+X_hp
     return X
 
 def idwt(dwtop,nm,length,flag):
-
+    dwtop=np.asarray(dwtop)
     J=int(flag[1])
     app_len=int(length[0])
     det_len=int(length[1])
-    app=dwtop[0:app_len]
-    det=dwtop[app_len:2*app_len]
+    app=dwtop[...,0:app_len]
+    det=dwtop[...,app_len:2*app_len]
 
     for i in range(J):
         if int(flag[2]) == 0:
@@ -660,18 +510,17 @@ def idwt(dwtop,nm,length,flag):
         app_len+=det_len
 
         if i < J-1:
-            det_len=length[i+2]
-            det=dwtop[app_len:app_len+det_len]
+            det_len=int(length[i+2])
+            det=dwtop[...,app_len:app_len+det_len]
             app=idwt_output
 
-            if len(app) > len(det):
-                t=len(app)-len(det)
+            if app.shape[-1] > det_len:
+                t=app.shape[-1]-det_len
                 lent=int(np.floor(t * 1.0/2.0))
-                app=app[:lent+len(det)]
-                app=app[lent:]
+                app=app[...,lent:lent+det_len]
     
     zerp=int(flag[0])
-    idwt_output=idwt_output[0:len(idwt_output)-zerp]
+    idwt_output=idwt_output[...,0:idwt_output.shape[-1]-zerp]
     return idwt_output
 
 def dwt1_sym(signal,wname):
@@ -685,14 +534,14 @@ def dwt1_sym(signal,wname):
    
 
     cA_undec=np.real(convol.convfft(signal,lpd))
-    cA_undec=cA_undec[lf:]
-    cA_undec=cA_undec[:len(cA_undec)-lf+1]
+    cA_undec=cA_undec[...,lf:]
+    cA_undec=cA_undec[...,:cA_undec.shape[-1]-lf+1]
     cA=sample.downsamp(cA_undec,D)
 
 
     cD_undec=np.real(convol.convfft(signal,hpd))
-    cD_undec=cD_undec[lf:]
-    cD_undec=cD_undec[:len(cD_undec)-lf+1]
+    cD_undec=cD_undec[...,lf:]
+    cD_undec=cD_undec[...,:cD_undec.shape[-1]-lf+1]
     cD=sample.downsamp(cD_undec,D)
 
     return cA,cD
@@ -702,23 +551,23 @@ def dwt1(signal,wname):
     len_lpfilt=int(len(lpd))
     len_hpfilt=int(len(hpd))
     len_avg=int(len_lpfilt/2 + len_hpfilt/2)
-    len_sig = int( 2 *(np.ceil(len(signal) * 1.0/2.0)))
+    len_sig = int( 2 *(np.ceil(np.shape(signal)[-1] * 1.0/2.0)))
     D=int(2)
 
     signal=misc.per_ext(signal,int(len_avg/2))
    
 
     cA_undec=np.real(convol.convfft(signal,lpd))
-    cA_undec=cA_undec[len_avg-1:]
-    cA_undec=cA_undec[:len(cA_undec)-len_avg+1]
-    cA_undec=cA_undec[1:len_sig]
+    cA_undec=cA_undec[...,len_avg-1:]
+    cA_undec=cA_undec[...,:cA_undec.shape[-1]-len_avg+1]
+    cA_undec=cA_undec[...,1:len_sig]
     cA=sample.downsamp(cA_undec,D)
 
 
     cD_undec=np.real(convol.convfft(signal,hpd))
-    cD_undec=cD_undec[len_avg-1:]
-    cD_undec=cD_undec[:len(cD_undec)-len_avg+1]
-    cD_undec=cD_undec[1:len_sig]
+    cD_undec=cD_undec[...,len_avg-1:]
+    cD_undec=cD_undec[...,:cD_undec.shape[-1]-len_avg+1]
+    cD_undec=cD_undec[...,1:len_sig]
     cD=sample.downsamp(cD_undec,D)
 
     return cA,cD
@@ -727,51 +576,50 @@ def dwt1(signal,wname):
 
 
 def dwt(sig,J,nm,ext):
-    flag=np.array([])
-    dwtout=np.array([])
-    length=np.array([])
-    Max_Iter=int(np.ceil(np.log2(len(sig))))-2
+    sig=np.asarray(sig)
+    Max_Iter=int(np.ceil(np.log2(sig.shape[-1])))-2
     if Max_Iter < J:
         J=Max_Iter
     
-    temp_len=len(sig)
+    temp_len=sig.shape[-1]
 
     if temp_len%2 != 0:
-        temp=sig[temp_len-1]
-        sig=np.append(sig,temp)
-        flag=np.append(flag,1)
+        sig=np.concatenate([sig,sig[...,-1:]],axis=-1)
+        flag=[1]
         temp_len+=1
 
     else:
-        flag=np.append(flag,0)
+        flag=[0]
 
-    length=np.append(length,int(temp_len))
-    flag=np.append(flag,J)
+    length=[temp_len]
+    flag.append(J)
     if ext == 'per':
-        flag=np.append(flag,int(0))
+        flag.append(0)
     else:
-        flag=np.append(flag,int(1))
+        flag.append(1)
         
     orig=sig
+    dwtout=[]
 
     for iter in range(J):
         if ext == 'per':
             [appx,det]=dwt1(orig,nm)
         else:
             [appx,det]=dwt1_sym(orig,nm)
-        dwtout=np.append(det,dwtout)
-        l_temp=int(len(det))
-        length=np.append(l_temp,length)
+        dwtout.insert(0,det)
+        length.insert(0,det.shape[-1])
         if iter==J-1:
-            dwtout=np.append(appx,dwtout)
-            l_temp2=int(len(appx))
-            length=np.append(l_temp2,length)
+            dwtout.insert(0,appx)
+            length.insert(0,appx.shape[-1])
 
         orig=appx
 
+    if dwtout:
+        dwtout=np.concatenate(dwtout,axis=-1)
+    else:
+        dwtout=np.zeros(sig.shape[:-1]+(0,))
 
-
-    return dwtout,length,flag
+    return dwtout,np.array(length,dtype=float),np.array(flag,dtype=float)
 
 """def main():
     x=np.arange(400)
@@ -3,100 +3,53 @@
 import sys
 import numpy as np
 
+# signal extensions and shifts work along the last axis (or both axes for the 2d
+# versions), by indexing rather than growing the array a sample at a time
+
+# periodic extension by a samples at each end, after repeating the last
+# sample if needed to make the length even
 def per_ext(x,a):
-	l=len(x)
-	if l%2 != 0:
-		t=x[l-1]
-		x=np.append(x,t)
-		l=len(x)
-	
-	for i in range(a):
-		post=x[2*i]
-		pre=x[l-1]
-		x=np.append(x,post)
-		x=np.append(pre,x)
-	
-	return x
+	x=np.asarray(x)
+	if x.shape[-1]%2 != 0:
+		x=np.concatenate([x,x[...,-1:]],axis=-1)
+	l=x.shape[-1]
+
+	index=np.arange(-a,l+a) % l
+	return np.take(x,index,axis=-1)
 
+# symmetric extension by a samples at each end, reflecting about the end samples
+# (which are not repeated)
 def symm_ext(x,a):
-	
-	for i in range(a):
-		l=len(x)
-		pre=x[1+i*2]
-		post=x[l-(i+1)*2]
-		x=np.append(x,post)
-		x=np.append(pre,x)
-	
-	return x
+	x=np.asarray(x)
+	l=x.shape[-1]
+	if l < 2:
+		return np.take(x,np.zeros(l+2*a,dtype=int),axis=-1)
 
+	period=2*(l-1)
+	index=np.arange(-a,l+a) % period
+	index=np.where(index >= l, period-index, index)
+	return np.take(x,index,axis=-1)
 
+# rotate left by a samples
 def circshift(x,a):
-	if np.abs(a) > len(x):
-		a=np.sign(a) * (np.abs(a)%len(x))
-		
-	if a < 0:
-		a= (len(x)+a) % len(x)
-	
-	for i in range(a):
-		temp=x[0]
-		x=np.append(x,temp)
-		x=np.delete(x,[0])
-	
-	return x
-	
-def circshift2d(x,a,b):
-	rows=np.size(x,0)
-	cols=np.size(x,1)
-	
-	for i in range(rows):
-		x[i,:]=circshift(x[i,:],a)
-		
-	for j in range(cols):
-		x[:,j]=circshift(x[:,j],b)		
-		
-	return x			
+	x=np.asarray(x)
+	if np.abs(a) > x.shape[-1]:
+		a=np.sign(a) * (np.abs(a)%x.shape[-1])
 
+	if a < 0:
+		a= (x.shape[-1]+a) % x.shape[-1]
 
-def per_ext2d(x,a):
-	rows=np.size(x,0)
-	cols=np.size(x,1)
-	if cols%2 != 0:
-		cols2=int(cols+1)
-	else:
-		cols2=cols
-		
-	if rows%2 != 0:
-		rows2=int(rows+1)
-	else:
-		rows2=rows	
-		
-	
-	temp_vec=np.ndarray(shape=(rows,cols2+2*a))
-	y=np.ndarray(shape=(rows2+2*a,cols2+2*a))
+	return np.roll(x,-int(a),axis=-1)
 
-	for i in range(rows):
-		temp_vec[i,:]=per_ext(x[i,:],a)
-	
-	colx=np.size(temp_vec,1)
-		
+def circshift2d(x,a,b):
+	x=circshift(x,a)
+	return circshift(x.T,b).T
 
-	for j in range(colx):
-		temp=temp_vec[:,j]
-		y[:,j]=per_ext(temp,a)
 
-	return y
+def per_ext2d(x,a):
+	y=per_ext(x,a)
+	return per_ext(y.T,a).T
 
 def symm_ext2d(x,a):
-	rows=np.size(x,0)
-	cols=np.size(x,1)
-
-	y=np.zeros((rows+2*a,cols+2*a))
-	for i in range(rows):
-		
-		y[i+a,:]=symm_ext(x[i,:],a)
-
-	for j in range(cols+2*a):
-		y[:,j]=symm_ext(y[a:rows+a,j],a)
-
-	return y
-
+	y=symm_ext(x,a)
+	return symm_ext(y.T,a).T
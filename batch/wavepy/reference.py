@@ -0,0 +1,379 @@
+#! /usr/bin/env python
+
+# the original sample-by-sample, signal-by-signal implementations of the 1-D
+# transforms, kept as a reference for benchmark.py -- not for general use
+
+import numpy as np
+import filter
+from math import ceil
+
+def convfft(a,b):
+    len_c = len(a)+len(b)-1
+    a=np.array(a)
+    b=np.array(b)
+    az=np.zeros(len_c-len(a))
+    bz=np.zeros(len_c-len(b))
+    a=np.append(a,az)
+    b=np.append(b,bz)
+    
+    x=np.fft.fft(a)
+    y=np.fft.fft(b)
+    z=x*y
+    oup=np.fft.ifft(z)
+    return oup
+
+
+def per_ext(x,a):
+    l=len(x)
+    if l%2 != 0:
+        t=x[l-1]
+        x=np.append(x,t)
+        l=len(x)
+    
+    for i in range(a):
+        post=x[2*i]
+        pre=x[l-1]
+        x=np.append(x,post)
+        x=np.append(pre,x)
+    
+    return x
+
+def symm_ext(x,a):
+    
+    for i in range(a):
+        l=len(x)
+        pre=x[1+i*2]
+        post=x[l-(i+1)*2]
+        x=np.append(x,post)
+        x=np.append(pre,x)
+    
+    return x
+
+def circshift(x,a):
+    if np.abs(a) > len(x):
+        a=np.sign(a) * (np.abs(a)%len(x))
+        
+    if a < 0:
+        a= (len(x)+a) % len(x)
+    
+    for i in range(a):
+        temp=x[0]
+        x=np.append(x,temp)
+        x=np.delete(x,[0])
+    
+    return x
+
+def upsamp(inp,M):
+    x = np.array(inp)
+    M=int(M)
+    N = M * len(x)
+    y=[]
+    
+    for i in range(N):
+        if i%M == 0:
+            y.append(x[i/M])
+        else:
+            y.append(0.0)
+    
+    return y
+
+def downsamp(inp,M):
+    x=np.array(inp)
+    N = int(ceil(len(x) *1.0 / M))
+    y=[]
+    
+    for i in range(N):
+        y.append(x[i*M])
+    
+    return y
+
+def iswt(swtop,J,nm):
+    N=int(len(swtop)/(J+1))
+    [lpd,hpd,lpr,hpr]=filter.filtcoef(nm)
+    low_pass=lpr
+    high_pass=hpr
+    lf=int(len(low_pass))
+    
+    for iter in range(J):
+        iswt_output=np.zeros(N)
+        
+        if iter==0:
+            appx_sig=swtop[0:N]
+            det_sig=swtop[N:2*N]
+        else:
+            det_sig=swtop[(iter+1)*N:(iter+2)*N]
+        
+        value=int(2**(J-1-iter))
+        for count in range(value):
+            appx1=appx_sig[count:N:value]
+            det1=det_sig[count:N:value]
+            
+            len1=len(appx1)
+            
+            appx2=appx1[0:len1:2]
+            det2=det1[0:len1:2]
+            
+            U=int(2)
+            
+            cL0=upsamp(appx2,U)
+            cH0=upsamp(det2,U)
+            
+            cL0=per_ext(cL0,int(lf/2))
+            cH0=per_ext(cH0,int(lf/2))
+            
+            oup00L=np.real(convfft(cL0,low_pass))
+            oup00H=np.real(convfft(cH0,high_pass))
+            
+            oup00L=oup00L[lf-1:]
+            oup00L=oup00L[0:len1]
+            
+            oup00H=oup00H[lf-1:]
+            oup00H=oup00H[0:len1]
+            
+            oup00=oup00L+oup00H
+            
+            appx3=appx1[1:len1:2]
+            det3=det1[1:len1:2]
+            
+            cL1=upsamp(appx3,U)
+            cH1=upsamp(det3,U)
+            
+            cL1=per_ext(cL1,int(lf/2))
+            cH1=per_ext(cH1,int(lf/2))
+            
+            oup01L=np.real(convfft(cL1,low_pass))
+            oup01H=np.real(convfft(cH1,high_pass))
+            
+            oup01L=oup01L[lf-1:]
+            oup01L=oup01L[0:len1]
+            
+            oup01H=oup01H[lf-1:]
+            oup01H=oup01H[0:len1]
+            
+            oup01=oup01L+oup01H
+            
+            oup01=circshift(oup01,-1)
+            index2=int(0)
+            for index in xrange(count,N,value):
+                temp=(oup00[index2]+oup01[index2])*1.0/2.0
+                iswt_output[index]=temp
+                index2+=1
+            
+        appx_sig=iswt_output
+    
+    return iswt_output
+
+def swt(sig,J,nm):
+    swtop=np.array([])
+    N=int(len(sig))
+    length=N
+    
+    [lpd,hpd,lpr,hpr]=filter.filtcoef(nm)
+    
+    for iter in range(J):
+        if iter > 0:
+            M=int(2**iter)
+            low_pass=upsamp(lpd,M)
+            high_pass=upsamp(hpd,M)
+        else:
+            low_pass=lpd
+            high_pass=hpd
+            
+        len_filt=int(len(low_pass))    
+        sig=per_ext(sig,int(len_filt/2))
+        cA=np.real(convfft(sig,low_pass))
+        cD=np.real(convfft(sig,high_pass))
+        
+        cA=cA[len_filt:]
+        cA=cA[0:N]
+        
+        cD=cD[len_filt:]
+        cD=cD[0:N]
+        
+        sig=cA
+        if iter==J-1:
+            swtop=np.append(cD,swtop)
+            swtop=np.append(cA,swtop)
+        else:
+            swtop=np.append(cD,swtop)
+        
+    
+    return swtop,length
+
+def idwt1_sym(cA,cD,wname):
+    [lpd1,hpd1,lpr1,hpr1]=filter.filtcoef(wname)
+    if len(cA) > len(cD):
+        cA=cA[0:len(cD)]
+        
+    len_lpfilt=int(len(lpr1))
+    len_hpfilt=int(len(hpr1))
+    lf=len_lpfilt
+    N= 2 * len(cD)
+    U=2
+
+    cA_up=upsamp(cA,U)
+    cA_up=cA_up[0:len(cA_up)-1]
+    X_lp=np.real(convfft(cA_up,lpr1))
+
+    cD_up=upsamp(cD,U)
+    cD_up=cD_up[0:len(cD_up)-1]
+    X_hp=np.real(convfft(cD_up,hpr1))
+    
+    X=X_lp+X_hp
+    X=X[lf-2:]
+    X=X[:len(X)-lf+2]
+    
+    return X
+
+def idwt1(cA,cD,wname):
+    [lpd1,hpd1,lpr1,hpr1]=filter.filtcoef(wname)
+
+    len_lpfilt=int(len(lpr1))
+    len_hpfilt=int(len(hpr1))
+    len_avg=int(len_lpfilt/2 + len_hpfilt/2)
+    N= 2 * len(cD)
+    U=2
+
+    cA_up=upsamp(cA,U)
+    cA_up=per_ext(cA_up,int(len_avg/2))
+    X_lp=np.real(convfft(cA_up,lpr1))
+
+    cD_up=upsamp(cD,U)
+    cD_up=per_ext(cD_up,int(len_avg/2))
+    X_hp=np.real(convfft(cD_up,hpr1))
+    
+    X_lp=X_lp[0:N+len_avg-1]
+    X_lp=X_lp[len_avg-1:]
+
+    X_hp=X_hp[0:N+len_avg-1]
+    X_hp=X_hp[len_avg-1:]
+    
+    X=X_lp+X_hp
+    return X
+
+def idwt(dwtop,nm,length,flag):
+
+    J=int(flag[1])
+    app_len=int(length[0])
+    det_len=int(length[1])
+    app=dwtop[0:app_len]
+    det=dwtop[app_len:2*app_len]
+
+    for i in range(J):
+        if int(flag[2]) == 0:
+            idwt_output=idwt1(app,det,nm)
+        else:
+            idwt_output=idwt1_sym(app,det,nm)
+            
+        app_len+=det_len
+
+        if i < J-1:
+            det_len=int(length[i+2])
+            det=dwtop[app_len:app_len+det_len]
+            app=idwt_output
+
+            if len(app) > len(det):
+                t=len(app)-len(det)
+                lent=int(np.floor(t * 1.0/2.0))
+                app=app[:lent+len(det)]
+                app=app[lent:]
+    
+    zerp=int(flag[0])
+    idwt_output=idwt_output[0:len(idwt_output)-zerp]
+    return idwt_output
+
+def dwt1_sym(signal,wname):
+    [lpd,hpd,lpr,hpr]=filter.filtcoef(wname)
+    len_lpfilt=int(len(lpd))
+    len_hpfilt=int(len(hpd))
+    lf=len_lpfilt
+    D=int(2)
+
+    signal=symm_ext(signal,int(lf - 1))
+   
+
+    cA_undec=np.real(convfft(signal,lpd))
+    cA_undec=cA_undec[lf:]
+    cA_undec=cA_undec[:len(cA_undec)-lf+1]
+    cA=downsamp(cA_undec,D)
+
+
+    cD_undec=np.real(convfft(signal,hpd))
+    cD_undec=cD_undec[lf:]
+    cD_undec=cD_undec[:len(cD_undec)-lf+1]
+    cD=downsamp(cD_undec,D)
+
+    return cA,cD
+
+def dwt1(signal,wname):
+    [lpd,hpd,lpr,hpr]=filter.filtcoef(wname)
+    len_lpfilt=int(len(lpd))
+    len_hpfilt=int(len(hpd))
+    len_avg=int(len_lpfilt/2 + len_hpfilt/2)
+    len_sig = int( 2 *(np.ceil(len(signal) * 1.0/2.0)))
+    D=int(2)
+
+    signal=per_ext(signal,int(len_avg/2))
+   
+
+    cA_undec=np.real(convfft(signal,lpd))
+    cA_undec=cA_undec[len_avg-1:]
+    cA_undec=cA_undec[:len(cA_undec)-len_avg+1]
+    cA_undec=cA_undec[1:len_sig]
+    cA=downsamp(cA_undec,D)
+
+
+    cD_undec=np.real(convfft(signal,hpd))
+    cD_undec=cD_undec[len_avg-1:]
+    cD_undec=cD_undec[:len(cD_undec)-len_avg+1]
+    cD_undec=cD_undec[1:len_sig]
+    cD=downsamp(cD_undec,D)
+
+    return cA,cD
+
+def dwt(sig,J,nm,ext):
+    flag=np.array([])
+    dwtout=np.array([])
+    length=np.array([])
+    Max_Iter=int(np.ceil(np.log2(len(sig))))-2
+    if Max_Iter < J:
+        J=Max_Iter
+    
+    temp_len=len(sig)
+
+    if temp_len%2 != 0:
+        temp=sig[temp_len-1]
+        sig=np.append(sig,temp)
+        flag=np.append(flag,1)
+        temp_len+=1
+
+    else:
+        flag=np.append(flag,0)
+
+    length=np.append(length,int(temp_len))
+    flag=np.append(flag,J)
+    if ext == 'per':
+        flag=np.append(flag,int(0))
+    else:
+        flag=np.append(flag,int(1))
+        
+    orig=sig
+
+    for iter in range(J):
+        if ext == 'per':
+            [appx,det]=dwt1(orig,nm)
+        else:
+            [appx,det]=dwt1_sym(orig,nm)
+        dwtout=np.append(det,dwtout)
+        l_temp=int(len(det))
+        length=np.append(l_temp,length)
+        if iter==J-1:
+            dwtout=np.append(appx,dwtout)
+            l_temp2=int(len(appx))
+            length=np.append(l_temp2,length)
+
+        orig=appx
+
+
+
+    return dwtout,length,flag
@@ -2,30 +2,19 @@
 
 import sys
 import numpy as np
-from math import ceil
+
+# up and downsampling along the last axis
 
 def upsamp(inp,M):
-    x = np.array(inp)
+    x = np.asarray(inp)
     M=int(M)
-    N = M * len(x)
-    y=[]
-    
-    for i in range(N):
-        if i%M == 0:
-            y.append(x[i/M])
-        else:
-            y.append(0.0)
-    
+    N = M * x.shape[-1]
+    y=np.zeros(x.shape[:-1]+(N,))
+    y[...,::M]=x
+
     return y
 
 
 def downsamp(inp,M):
-    x=np.array(inp)
-    N = int(ceil(len(x) *1.0 / M))
-    y=[]
-    
-    for i in range(N):
-        y.append(x[i*M])
-    
-    return y
-            
\ No newline at end of file
+    x=np.asarray(inp)
+    return x[...,::int(M)]
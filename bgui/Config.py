@@ -53,7 +53,7 @@ PREF_FIELDS = [ 'model_path', 'input_path',
                 
                 'max_inits',
                 
-                'auto_parse']
+                'auto_parse', 'live_plot']
 
 EXTENSIONS = {'model': os.extsep + 'model',
               'modeldef': os.extsep + 'modeldef',
@@ -178,6 +178,7 @@ class Config(object):
         self.output_model_only = True
         
         self.auto_parse = True
+        self.live_plot = True
         self.max_inits = 20
         
         self.presets = FACTORY_PRESETS
@@ -3,10 +3,23 @@
 import sys, os, os.path
 import subprocess
 import tempfile
+import threading
+import Queue
+import time
+
+# how often (s) a Job checks for new lines in a file it is tailing
+TAIL_INTERVAL = 0.05
 
 # invoke the BCMD compiler
 # returns (result, logfile)
 def parse(config):
+    args, logname = parse_args(config)
+    with open(logname, 'w') as stderr:
+        result = subprocess.call(args, stderr=stderr)
+    
+    return result, logname
+
+def parse_args(config):
     args = ['python']
     args.append(os.path.join(config.parser, 'bcmd.py'))
     if config.debug:
@@ -21,29 +34,17 @@ def parse(config):
     args.extend(['-d', config.work])
     args.append(os.path.join(config.model_dir, config.model_src))
     logname = os.path.join(config.work, config.model_name + config.extensions['log'])
-    with open(logname, 'w') as stderr:
-        result = subprocess.call(args, stderr=stderr)
-    
-    return result, logname
+    return args, logname
 
     
 # compile the C file
 # (this uses make, since the Makefile should have been configured with
 # the appropriate compiler details)
 def compile(config):
-    args = ['make']
-    args.append(os.path.join(config.work, config.model_name + config.extensions['model']))
-    if not config.debug:
-        args.append('DEBUG=0')
-    
-    # we must execute make in the proper directory
-    current = os.getcwd()
-    os.chdir(config.home)
-    
     stderr = tempfile.TemporaryFile()
     stdout = tempfile.TemporaryFile()
-    result = subprocess.call(args, stdout=stdout, stderr=stderr)
-    os.chdir(current)
+    # we must execute make in the proper directory
+    result = subprocess.call(compile_args(config), stdout=stdout, stderr=stderr, cwd=config.home)
     
     stdout.seek(0)
     out = stdout.read()
@@ -55,6 +56,13 @@ def compile(config):
     
     return result, out, err
 
+def compile_args(config):
+    args = ['make']
+    args.append(os.path.join(config.work, config.model_name + config.extensions['model']))
+    if not config.debug:
+        args.append('DEBUG=0')
+    return args
+
 # get info on the compiled model
 # TODO: for the moment we assume that the model has been parsed already, should probably check...
 # also maybe run the code internally rather than invoking another instance?
@@ -100,6 +108,16 @@ def graph(config):
 # run the configured model with the configured input and produce
 # the configured outputs...
 def run(config):
+    args = run_args(config)
+    stderr = os.path.join(config.work, config.model_name + config.extensions['stderr'])
+    stdout = os.path.join(config.work, config.model_name + config.extensions['stdout'])
+    
+    with open(stderr, 'w') as err, open(stdout, 'w') as out:
+        result = subprocess.call(args, stderr=err, stdout=out)
+    
+    return result, stdout, stderr
+
+def run_args(config):
     args = [os.path.join(config.work, config.model_name + config.extensions['model'])]
     args.extend(['-i', os.path.join(config.input_dir, config.input_file)])
     
@@ -109,11 +127,120 @@ def run(config):
     if config.detail:
         args.extend(['-d', os.path.join(config.work, config.detail_name)])
     
+    return args
+
+
+# an external command running in the background, with reader threads collecting
+# its output a line at a time, so that the GUI can poll for progress without
+# ever blocking on the process -- stdout and stderr are optionally also copied
+# to the named files as they arrive
+# tail optionally names a file the process writes, whose complete lines are
+# followed in the same way and reported under the stream name 'tail'
+class Job:
+    def __init__(self, args, cwd=None, stdout=None, stderr=None, tail=None):
+        self.queue = Queue.Queue()
+        self.cancelled = False
+        self.process = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.readers = [ self.start_reader(self.read, 'stdout', self.process.stdout, stdout),
+                         self.start_reader(self.read, 'stderr', self.process.stderr, stderr) ]
+        if tail:
+            self.readers.append(self.start_reader(self.follow, 'tail', tail))
+    
+    def start_reader(self, target, *args):
+        reader = threading.Thread(target=target, args=args)
+        reader.daemon = True
+        reader.start()
+        return reader
+    
+    def read(self, name, stream, copy):
+        out = open(copy, 'w') if copy else None
+        try:
+            for line in iter(stream.readline, ''):
+                if out:
+                    out.write(line)
+                self.queue.put((name, line))
+        finally:
+            stream.close()
+            if out:
+                out.close()
+    
+    # the file need not exist yet when the process starts; once the process has
+    # finished, whatever is left is read and any unterminated last line passed on
+    def follow(self, name, filename):
+        f = None
+        partial = ''
+        try:
+            while True:
+                finished = self.process.poll() is not None
+                if f is None and os.path.exists(filename):
+                    f = open(filename, 'r')
+                if f:
+                    for line in iter(f.readline, ''):
+                        if line.endswith('\n'):
+                            self.queue.put((name, partial + line))
+                            partial = ''
+                        else:
+                            partial += line
+                if finished:
+                    break
+                time.sleep(TAIL_INTERVAL)
+            if partial:
+                self.queue.put((name, partial))
+        finally:
+            if f:
+                f.close()
+    
+    # all (stream name, line) pairs received since last asked
+    def lines(self):
+        result = []
+        while True:
+            try:
+                result.append(self.queue.get_nowait())
+            except Queue.Empty:
+                return result
+    
+    # the exit code once the process has finished and all its output is in, otherwise None
+    def poll(self):
+        if any([ reader.is_alive() for reader in self.readers ]):
+            return None
+        return self.process.poll()
+    
+    def cancel(self):
+        if self.process.poll() is None:
+            self.cancelled = True
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+# background equivalents of parse, compile and run below, returning Jobs
+# (run_job tails the coarse output file, if any, so that its rows can be plotted
+# as they arrive, leaving stdout for solver diagnostics as usual)
+def parse_job(config):
+    args, logname = parse_args(config)
+    return Job(args, stderr=logname), logname
+
+def compile_job(config):
+    return Job(compile_args(config), cwd=config.home)
+
+def run_job(config):
     stderr = os.path.join(config.work, config.model_name + config.extensions['stderr'])
     stdout = os.path.join(config.work, config.model_name + config.extensions['stdout'])
-    
-    with open(stderr, 'w') as err, open(stdout, 'w') as out:
-        result = subprocess.call(args, stderr=err, stdout=out)
-    
-    return result, stdout, stderr
-    
\ No newline at end of file
+    coarse = None
+    if config.coarse:
+        # don't let the tail pick up the previous run's results
+        coarse = os.path.join(config.work, config.coarse_name)
+        if os.path.exists(coarse):
+            os.remove(coarse)
+    return Job(run_args(config), stdout=stdout, stderr=stderr, tail=coarse)
+
+# number of steps declared in a BCMD input file, or None if it can't be found
+def step_count(filename):
+    try:
+        with open(filename) as f:
+            for line in f:
+                if line.startswith('@'):
+                    return int(line[1:].split()[0])
+    except (IOError, IndexError, ValueError):
+        pass
+    return None
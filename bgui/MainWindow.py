@@ -27,6 +27,11 @@ import bparser.doc_modeldef as doc_modeldef
 import bparser.doc_sbml as doc_sbml
 import batch.siggen as siggen
 
+# how often (ms) to check on a running build or model, and how many checks
+# between redraws of the live plot
+POLL_INTERVAL = 100
+REDRAW_POLLS = 5
+
 # notes to self:
 #
 # options['defaultextension'] = '.txt'
@@ -89,6 +94,7 @@ class MainWindow(ttk.Frame):
         self.match_state = tk.IntVar()
         self.coarse_state = tk.IntVar()
         self.detail_state = tk.IntVar()
+        self.live_state = tk.IntVar()
         
         # input management pane
         self.generate_name = tk.StringVar()
@@ -142,6 +148,15 @@ class MainWindow(ttk.Frame):
         self.time_contents = {}
         self.data_contents = {}
         
+        # background build/run state
+        self.job = None
+        self.job_done = None
+        self.job_handlers = {}
+        self.job_total = None
+        self.job_rows = 0
+        self.job_polls = 0
+        self.live_plot = None
+        
         self.data_scale = tk.StringVar()
         self.data_offset = tk.StringVar()
         self.data_min = tk.StringVar()
@@ -214,8 +229,16 @@ class MainWindow(ttk.Frame):
         ttk.Label(self.model_panel, text='Input').grid(column=1, row=3, sticky=tk.W)
         ttk.Label(self.model_panel, text='Outputs').grid(column=1, row=6, sticky=tk.W)
     
-        ttk.Button(self.model_panel, text='Build', command=self.action_build).grid(column=3, row=2, sticky=tk.W)
-        ttk.Button(self.model_panel, text='Run', command=self.action_run).grid(column=3, row=4, sticky=tk.W)
+        self.build_button = ttk.Button(self.model_panel, text='Build', command=self.action_build)
+        self.run_button = ttk.Button(self.model_panel, text='Run', command=self.action_run)
+        self.build_button.grid(column=3, row=2, sticky=tk.W)
+        self.run_button.grid(column=3, row=4, sticky=tk.W)
+        
+        self.progress = ttk.Progressbar(self.model_panel, orient=tk.HORIZONTAL)
+        self.progress.grid(column=1, row=5, sticky=(tk.E,tk.W))
+        self.cancel_button = ttk.Button(self.model_panel, text='Cancel', command=self.action_cancel)
+        self.cancel_button.grid(column=3, row=5, sticky=tk.W)
+        self.cancel_button.state(['disabled'])
         
         ttk.Button(self.model_panel, text='Open', command=self.action_open_coarse).grid(column=3, row=8, sticky=tk.W)
         ttk.Button(self.model_panel, text='Open', command=self.action_open_detail).grid(column=3, row=10, sticky=tk.W)
@@ -227,12 +250,14 @@ class MainWindow(ttk.Frame):
         self.match_check = ttk.Checkbutton(self.model_panel, text='As Model', variable=self.match_state)
         self.coarse_check = ttk.Checkbutton(self.model_panel, text='Coarse', variable=self.coarse_state)
         self.detail_check = ttk.Checkbutton(self.model_panel, text='Detailed', variable=self.detail_state)
+        self.live_check = ttk.Checkbutton(self.model_panel, text='Live Plot', variable=self.live_state)
     
         self.debug_check.grid(column=4, row=2, sticky=tk.W)
         self.match_check.grid(column=4, row=4, sticky=tk.W)
         
         self.coarse_check.grid(column=1, row=7, sticky=tk.W)
         self.detail_check.grid(column=1, row=9, sticky=tk.W)
+        self.live_check.grid(column=3, row=7, columnspan=2, sticky=tk.W)
     
         self.load_icon = tk.PhotoImage(file=os.path.join(self.config.resources, 'files-blue.gif'))
         ttk.Button(self.model_panel, image=self.load_icon, command=self.action_choose_model).grid(column=2, row=2, sticky=tk.W)
@@ -743,6 +768,7 @@ class MainWindow(ttk.Frame):
         self.config.match_input = bool(self.match_state.get())
         self.config.coarse = bool(self.coarse_state.get())
         self.config.detail = bool(self.detail_state.get())
+        self.config.live_plot = bool(self.live_state.get())
         self.config.model_name = self.model_name.get()
         self.config.input_file = self.input_name.get()
         self.config.coarse_name = self.coarse_name.get()
@@ -799,6 +825,7 @@ class MainWindow(ttk.Frame):
         self.match_state.set(int(self.config.match_input))
         self.coarse_state.set(int(self.config.coarse))
         self.detail_state.set(int(self.config.detail))
+        self.live_state.set(int(self.config.live_plot))
         self.model_name.set(self.config.model_name)
         self.input_name.set(self.config.input_file)
         self.coarse_name.set(self.config.coarse_name)
@@ -842,32 +869,43 @@ class MainWindow(ttk.Frame):
     # Event handlers
     
     # build the current model from its source
+    # parsing and compilation run in the background, one after the other
     def action_build(self, *args):
+        if self.busy(): return
         self.sync_to_config()
         self.app_log.log('generating C code for %s' % self.model_name.get())
-        self.winfo_toplevel().update_idletasks()
-        result, logfile = Executor.parse(self.config)
-        
-        self.build_log.fromFile(logfile)
         
-        if result:
+        self.build_log.setText('')
+        job, logfile = Executor.parse_job(self.config)
+        self.start_job(job, self.build_parsed, { 'stderr': self.append_to(self.build_log) })
+    
+    def build_parsed(self, result, cancelled):
+        if cancelled:
+            self.app_log.log('build cancelled')
+        elif result:
             self.app_log.log('compilation failed with exit code %d (see build log for details)' % result)
         else:   
             if self.config.auto_parse:
                 self.app_log.log('reading model info %s%s' % (self.model_name.get(), self.config.extensions['parsed']))
                 self.action_parse_info()
             self.app_log.log('compiling %s%s' % (self.model_name.get(), self.config.extensions['model']))
-            self.winfo_toplevel().update_idletasks()
-            result, out, err = Executor.compile(self.config)
-            self.stdout_log.setText(out)
-            self.stderr_log.setText(err)
-            if result:
-                self.app_log.log('compilation failed with exit code %d (check stdout/stderr for more info)' % result)
-            else:
-                self.app_log.log('build complete')
+            
+            self.stdout_log.setText('')
+            self.stderr_log.setText('')
+            self.start_job(Executor.compile_job(self.config), self.build_compiled,
+                           { 'stdout': self.append_to(self.stdout_log), 'stderr': self.append_to(self.stderr_log) })
+    
+    def build_compiled(self, result, cancelled):
+        if cancelled:
+            self.app_log.log('build cancelled')
+        elif result:
+            self.app_log.log('compilation failed with exit code %d (check stdout/stderr for more info)' % result)
+        else:
+            self.app_log.log('build complete')
 
-    # run the current model
+    # run the current model in the background, plotting the coarse output as it arrives
     def action_run(self):
+        if self.busy(): return
         self.sync_to_config()
         
         # running with no output at all is pointless, so check for that
@@ -876,15 +914,126 @@ class MainWindow(ttk.Frame):
             return
         
         self.app_log.log('running %s%s with %s' % (self.config.model_name, self.config.extensions['model'], self.config.input_file))
-        self.winfo_toplevel().update_idletasks()
-        result, out, err = Executor.run(self.config)
-        self.stdout_log.fromFile(out)
-        self.stderr_log.fromFile(err)
-        if result:
+        
+        self.stdout_log.setText('')
+        self.stderr_log.setText('')
+        
+        self.live_plot = None
+        if self.config.live_plot and self.config.coarse:
+            win = tk.Toplevel(self)
+            win.title('Coarse Results: %s (running)' % self.config.model_name)
+            self.live_plot = splt.LivePlot(win, figsize=(10,6))
+            win.lift()
+        
+        total = Executor.step_count(os.path.join(self.config.input_dir, self.config.input_file))
+        self.start_job(Executor.run_job(self.config), self.run_finished,
+                       { 'tail': self.run_output,
+                         'stdout': self.append_to(self.stdout_log),
+                         'stderr': self.append_to(self.stderr_log) },
+                       total if self.config.coarse else None)
+    
+    # a line of coarse output -- rows after the first count towards progress
+    def run_output(self, line):
+        fields = line.rstrip('\n').split('\t')
+        try:
+            row = [ float(x) for x in fields ]
+        except ValueError:
+            if self.live_plot:
+                self.live_plot.reset(fields, x='t', skip=['ERR'])
+            return
+        
+        self.job_rows += 1
+        if self.job_total:
+            self.progress['value'] = min(self.job_rows, self.job_total)
+        if self.live_plot:
+            self.live_plot.add(row)
+    
+    def run_finished(self, result, cancelled):
+        if self.live_plot:
+            self.refresh_live_plot()
+            try:
+                self.live_plot.winfo_toplevel().title('Coarse Results: %s' % self.config.model_name)
+            except tk.TclError:
+                pass
+        
+        if cancelled:
+            self.app_log.log('model run cancelled')
+        elif result:
             self.app_log.log('model returned exit code %d (see stdout/stderr for more info)' % result)
         else:
             self.app_log.log('model run completed')
     
+    # cancel whatever is running in the background
+    def action_cancel(self):
+        if self.job:
+            self.app_log.log('cancelling...')
+            self.job.cancel()
+    
+    # handler copying lines of output as they are into a log pane
+    def append_to(self, pane):
+        return lambda line: pane.log(line, newline=False)
+    
+    def busy(self):
+        if self.job:
+            self.app_log.log('busy -- wait for the current job to finish or cancel it')
+            return True
+        return False
+    
+    # start polling a background Executor job, with handlers for its lines of
+    # output from each stream, calling done(result, cancelled) when it's over
+    # given a total number of output rows to expect, progress is shown against it
+    def start_job(self, job, done, handlers={}, total=None):
+        self.job = job
+        self.job_done = done
+        self.job_handlers = handlers
+        self.job_total = total
+        self.job_rows = 0
+        self.job_polls = 0
+        
+        self.build_button.state(['disabled'])
+        self.run_button.state(['disabled'])
+        self.cancel_button.state(['!disabled'])
+        
+        if total:
+            self.progress.configure(mode='determinate', maximum=total, value=0)
+        else:
+            self.progress.configure(mode='indeterminate', value=0)
+            self.progress.start()
+        
+        self.after(POLL_INTERVAL, self.poll_job)
+    
+    def poll_job(self):
+        job = self.job
+        for stream, line in job.lines():
+            handler = self.job_handlers.get(stream)
+            if handler:
+                handler(line)
+        
+        self.job_polls += 1
+        if self.live_plot and self.job_polls % REDRAW_POLLS == 0:
+            self.refresh_live_plot()
+        
+        result = job.poll()
+        if result is None:
+            self.after(POLL_INTERVAL, self.poll_job)
+            return
+        
+        self.job = None
+        self.progress.stop()
+        self.progress.configure(mode='determinate', value=0)
+        self.build_button.state(['!disabled'])
+        self.run_button.state(['!disabled'])
+        self.cancel_button.state(['disabled'])
+        
+        self.job_done(result, job.cancelled)
+    
+    # the plot window may have been closed by the user, in which case stop updating it
+    def refresh_live_plot(self):
+        try:
+            self.live_plot.refresh()
+        except tk.TclError:
+            self.live_plot = None
+    
     # parse the model info file and stick the results in the info panel
     def action_parse_info(self):
         self.sync_to_config()
@@ -1393,7 +1542,7 @@ class MainWindow(ttk.Frame):
 
     def action_plot_coarse(self):
         file = os.path.join(self.config.work, self.config.coarse_name)
-        dict = inputs.readCSV(file, wrap_timeseries=False)
+        dict = inputs.readCSV(file, wrap_timeseries=False, lazy=True)
         
         chooser = chx.AxisChooser(self, fields=dict.keys() + [''], title='Configure Plot')
         
@@ -1421,7 +1570,7 @@ class MainWindow(ttk.Frame):
     
     def action_plot_detail(self):
         file = os.path.join(self.config.work, self.config.detail_name)
-        dict = inputs.readCSV(file, wrap_timeseries=False)
+        dict = inputs.readCSV(file, wrap_timeseries=False, lazy=True)
         
         chooser = chx.AxisChooser(self, fields=dict.keys() + [''], title='Configure Plot')
         
@@ -4,6 +4,7 @@ import sys, os, os.path
 
 import Tkinter as tk
 import ttk
+import numpy as np
 
 import matplotlib
 matplotlib.use('TkAgg')
@@ -29,6 +30,56 @@ class SimplePlot(tk.Frame):
         self.canvas.show()
         self.canvas.get_tk_widget().grid(row=1, column=1, sticky=(tk.W, tk.N, tk.E, tk.S))
 
+# a plot of several fields against one of them (or against row index), extended
+# as rows of values arrive -- for watching model output while it is produced
+# rows are collected by add, but only drawn on refresh, so that can be throttled
+class LivePlot(SimplePlot):
+
+    def __init__(self, parent, autogrid=True, figsize=(6, 4)):
+        SimplePlot.__init__(self, parent, autogrid, figsize)
+        self.fields = []
+        self.rows = []
+        self.lines = []
+        self.dirty = False
+    
+    # start again with a new set of fields, plotting all but those in skip against x
+    def reset(self, fields, x=None, skip=[]):
+        self.fields = fields
+        self.rows = []
+        self.xindex = fields.index(x) if x in fields else None
+        self.yindices = [ ii for ii in range(len(fields)) if ii != self.xindex and fields[ii] not in skip ]
+        
+        self.subplot.clear()
+        self.subplot.set_xlabel(x if self.xindex is not None else 'Index')
+        self.lines = [ self.subplot.plot([], [], label=fields[ii])[0] for ii in self.yindices ]
+        if self.lines:
+            self.subplot.legend(loc='best', fontsize='small')
+        self.dirty = True
+    
+    # rows that don't match the current fields are ignored
+    def add(self, row):
+        if len(row) == len(self.fields):
+            self.rows.append(row)
+            self.dirty = True
+    
+    def refresh(self):
+        if not self.dirty:
+            return
+        
+        data = np.array(self.rows).reshape((len(self.rows), len(self.fields)))
+        if self.xindex is None:
+            x = np.arange(len(data))
+        else:
+            x = data[:, self.xindex]
+        
+        for ii in range(len(self.lines)):
+            self.lines[ii].set_data(x, data[:, self.yindices[ii]])
+        
+        self.subplot.relim()
+        self.subplot.autoscale_view()
+        self.canvas.draw()
+        self.dirty = False
+
 # simple test driver
 if __name__ == '__main__':
     root = tk.Tk()
@@ -13,6 +13,7 @@ import pprint
 import logger
 import ast
 import codegen
+import numpygen
 import info
 
 # default compiler configuration
@@ -25,12 +26,14 @@ CONFIG = { 'modelpath': ['.', 'models' ],
            'name' : None,
            'unused' : True,
            'graph' : None,
+           'pyfile' : None,
            'graph-exclude-unused': False,
            'graph-exclude-init': False,
            'graph-exclude-self': True,
            'graph-exclude-clusters': False,
            'graph-exclude-params':False,
            'independent' : 't',
+           'sens' : [],
            'input-makes-intermed':True }
 
 # these are effectively constants
@@ -41,6 +44,7 @@ MODEL_EXT = '.model'
 TREE_EXT = '.tree'
 COMPILE_EXT = '.bcmpl'
 GRAPHVIZ_EXT = '.gv'
+PYTHON_EXT = '_ensemble.py'
 
 DUMMY_SOURCE = '##\n'
 
@@ -103,12 +107,14 @@ def process_args():
     ap.add_argument('-t', '--tree', help='write parse tree to file (default: <modelname>.tree)', nargs='?', default=None, const='', metavar='FILE')
     ap.add_argument('-p', '--processed', help='write compilation data to file (default: <modelname>.bcmpl)', nargs='?', default=None, const='', metavar='FILE')
     ap.add_argument('-G', '--graph', help='write dependency structure in GraphViz format (default: <modelname>.gv)', nargs='?', default=None, const='', metavar='FILE')
+    ap.add_argument('-P', '--python', help='also write a NumPy ensemble module (default: <modelname>_ensemble.py)', nargs='?', default=None, const='', metavar='FILE')
     ap.add_argument('-U', '--graphxunused', help='exclude apparently unused elements from graph output', action='store_true')
     ap.add_argument('-N', '--graphxinit', help='exclude initialisation dependencies from graph output', action='store_true')
     ap.add_argument('-C', '--graphxclust', help='exclude clustering from graph output', action='store_true')
     ap.add_argument('-S', '--graphself', help='include direct circular dependencies in graph output', action='store_false')
     ap.add_argument('-v', '--verbose', help='set level of detail logged to stderr (0-7, default: 3)', metavar='LEVEL', type=int)
     ap.add_argument('-Y', '--yacc', help='run a dummy parse to rebuild parse tables', action='store_true')
+    ap.add_argument('-s', '--sens', help='generate forward sensitivities to the listed parameters (comma-separated)', metavar='PARAMS')
     # ... add further options here as needed ...
     
     ap.add_argument('file', nargs='+', help='one or more model description files to be compiled')
@@ -144,11 +150,15 @@ def process_args():
     config['unused'] = args.unused
     config['debug'] = args.debug
     config['graph'] = args.graph
+    config['pyfile'] = args.python
     config['graph-exclude-unused'] = args.graphxunused
     config['graph-exclude-init'] = args.graphxinit
     config['graph-exclude-self'] = args.graphself
     config['graph-exclude-clusters'] = args.graphxclust
     
+    if args.sens:
+        config['sens'] = [ x.strip() for x in args.sens.split(',') if x.strip() ]
+    
     if args.verbose is not None:
         logger.verbosity = args.verbose
     return config
@@ -242,6 +252,20 @@ def write_graph(config, model):
     	except IOError as e:
     	    logger.error("Error writing file ({0}): {1}".format(e.errno, e.strerror))
 
+# write the vectorised NumPy version of the model, if so specified
+def write_python(config, model):
+    if not config['pyfile'] is None:
+        if config['pyfile'] == '':
+            config['pyfile'] = config['name'] + PYTHON_EXT
+        pyPath = os.path.join(config['outdir'], config['pyfile'])
+        logger.message("Attempting to write NumPy module to " + pyPath)
+        try:
+            stream = open(pyPath, 'w')
+            stream.write(numpygen.generateSource(model, config))
+            stream.close()
+        except IOError as e:
+            logger.error("Error writing file ({0}): {1}".format(e.errno, e.strerror))
+
 #----------------------------------------------------------------------------
 
 # main entry point of this compiler script
@@ -260,6 +284,7 @@ if __name__ == '__main__':
     info.logModelInfo(processed, config)
     write_comp(config, processed)
     write_graph(config, processed)
+    write_python(config, processed)
     
     source = codegen.generateSource(processed, config)
     
@@ -45,8 +45,13 @@ def generateSource(model, config, template_dir=TEMPLATE_DIR):
 def generateModelVars(model, config):
     diffcount = len(model['diffs'])
     algcount = len(model['algs'])
-    symcount = len(model['symlist'])
     varcount = diffcount + algcount
+    
+    # sensitivity symbols are appended after all the model's own
+    sens = sensParams(model, config)
+    sensfields = sensFields(model)
+    sensnames = sensSymbols(sens, sensfields)
+    symcount = len(model['symlist']) + len(sensnames)
     src = '/* Model-specific constants and statics */\n'
     src = src + 'const char* MODEL_NAME = "' + config['name'] + '";\n'
     
@@ -68,7 +73,22 @@ def generateModelVars(model, config):
     src = src + 'const unsigned int SYMBOL_COUNT = ' + str(symcount) + ';\n\n'
     
     src = src + 'static char* SYMBOLS[' + str(symcount) + '] = \n{\n'
-    src = src + formatArray(model['symlist'])
+    src = src + formatArray(model['symlist'] + sensnames)
+    src = src + '};\n\n'
+    
+    src = src + 'const unsigned int SENS_COUNT = ' + str(len(sens)) + ';\n'
+    src = src + 'const unsigned int SENS_OFFSET = ' + str(len(model['symlist'])) + ';\n'
+    src = src + 'const unsigned int SENS_FIELD_COUNT = ' + str(len(sensfields)) + ';\n\n'
+    
+    # (C doesn't allow empty arrays, so include a dummy entry if there are no sensitivities)
+    indices = [ model['symbols'][name]['index'] for name in sens ] or [-1]
+    src = src + 'static int SENS_PARAMS[' + str(len(indices)) + '] = \n{\n'
+    src = src + formatArray(indices, width=10, quote='')
+    src = src + '};\n\n'
+    
+    indices = [ model['symbols'][name]['index'] for name in sensfields ]
+    src = src + 'static int SENS_FIELDS[' + str(len(indices)) + '] = \n{\n'
+    src = src + formatArray(indices, width=10, quote='')
     src = src + '};\n\n'
     
     src = src + 'static char* ROOTS[' + str(varcount) + '] = \n{\n'
@@ -89,6 +109,30 @@ def generateModelVars(model, config):
     
     return src
 
+# get the list of parameters for which forward sensitivities are requested,
+# dropping (with a warning) any that don't make sense
+# both ordinary parameters and state variables are allowed -- in the
+# latter case the sensitivity is to the variable's initial value
+def sensParams(model, config):
+    result = []
+    for name in config.get('sens', []):
+        if name in result:
+            continue
+        if name not in model['params'] and name not in model['roots']:
+            logger.warn('Sensitivity requested for unknown or unsuitable symbol: ' + name)
+            continue
+        result.append(name)
+    return result
+
+# all the quantities whose sensitivities are computed: the state variables
+# (in the same order as Y) followed by the intermediates
+def sensFields(model):
+    return model['diffs'] + model['algs'] + model['intermeds']
+
+# names of the sensitivity symbols, in storage order (by parameter, then field)
+def sensSymbols(sens, fields):
+    return [ 'd%s/d%s' % (field, param) for param in sens for field in fields ]
+
 # generate segment for embedded C chunks
 # (by just pasting them all together -- this stuff is not checked)
 def generateEmbeds(model):
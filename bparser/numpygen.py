@@ -0,0 +1,353 @@
+import re
+import logger
+
+# generate a Python module from a parsed model, with the model functions written
+# as vectorised NumPy code operating on a whole ensemble of parameter sets at once
+# -- each row of the arrays is one member of the ensemble, so RPAR is
+# [n_ensemble, SYMBOL_COUNT] and y is [n_ensemble, VAR_COUNT]
+# the layout and function names mirror the generated C (see codegen.py), and
+# the resulting module is driven by batch/ensemble.py; embedded C chunks can't
+# be translated, so any functions they define need supplying via EXTERNAL,
+# and sensitivities are not supported
+
+# C maths functions and their NumPy equivalents
+FUNCTIONS = { 'exp':'np.exp', 'exp2':'np.exp2', 'expm1':'np.expm1',
+              'log':'np.log', 'log10':'np.log10', 'log2':'np.log2', 'log1p':'np.log1p',
+              'sqrt':'np.sqrt', 'cbrt':'np.cbrt', 'pow':'np.power', 'hypot':'np.hypot',
+              'fabs':'np.abs', 'abs':'np.abs', 'floor':'np.floor', 'ceil':'np.ceil',
+              'round':'np.round', 'trunc':'np.trunc', 'fmod':'np.fmod',
+              'fmin':'np.minimum', 'fmax':'np.maximum', 'min':'np.minimum', 'max':'np.maximum',
+              'sin':'np.sin', 'cos':'np.cos', 'tan':'np.tan',
+              'asin':'np.arcsin', 'acos':'np.arccos', 'atan':'np.arctan', 'atan2':'np.arctan2',
+              'sinh':'np.sinh', 'cosh':'np.cosh', 'tanh':'np.tanh' }
+
+INDENT = '    '
+
+def generateSource(model, config):
+    if model['embeds']:
+        logger.warn('Embedded C code cannot be included in the NumPy module; any functions it defines must be supplied via EXTERNAL')
+
+    if config['unused']:
+        targets = model['assigned']
+    else:
+        targets = list(model['assigned'] - model['unused'])
+
+    src = generateModelVars(model, config)
+    src = src + generateModelInit(model, config, targets)
+    src = src + generateParamUpdate(model, config, targets)
+    src = src + generateSaveY(model, config)
+    src = src + generateCarryForward(model, config)
+    src = src + generateRHS(model, config, targets)
+    src = src + generateConstraints(model, config)
+    return src
+
+# generate the module header and model constants
+def generateModelVars(model, config):
+    roots = model['diffs'] + model['algs']
+
+    src = '# NumPy ensemble module for model %s, generated by bcmd -- do not edit\n' % config['name']
+    src = src + '# source files: ' + ', '.join(config['sources']) + '\n\n'
+    src = src + 'from __future__ import division\n'
+    src = src + 'import numpy as np\n\n'
+
+    src = src + 'MODEL_NAME = %r\n' % config['name']
+    src = src + 'MODEL_VERSION = %r\n' % (model['version'] or '(version not specified)')
+    src = src + 'DIAGONAL = %d\n\n' % (model['diagonal'] and 1 or 0)
+
+    src = src + 'DIFF_EQ_COUNT = %d\n' % len(model['diffs'])
+    src = src + 'ALGEBRAIC_COUNT = %d\n' % len(model['algs'])
+    src = src + 'VAR_COUNT = %d\n' % len(roots)
+    src = src + 'SYMBOL_COUNT = %d\n' % len(model['symlist'])
+    src = src + 'INTERMEDIATE_COUNT = %d\n\n' % len(model['intermeds'])
+
+    src = src + 'SYMBOLS = %s\n\n' % formatList(model['symlist'])
+    src = src + 'ROOTS = %s\n\n' % formatList(roots)
+    src = src + 'INTERMEDIATES = %s\n\n' % formatList(model['intermeds'])
+    src = src + 'PARAMS = %s\n\n' % formatList(model['params'])
+
+    src = src + '# positions in RPAR of the state variables and intermediates\n'
+    src = src + 'ROOT_INDICES = %s\n' % formatList([ model['symbols'][name]['index'] for name in roots ])
+    src = src + 'INTERMEDIATE_INDICES = %s\n\n' % formatList([ model['symbols'][name]['index'] for name in model['intermeds'] ])
+
+    src = src + 'DEFAULT_FIELDS = %s\n\n' % formatList([0] + [ model['symbols'][name]['index'] for name in model['outputs'] ])
+
+    # mass matrix as in the C version: identity for differential equations,
+    # zero for algebraics, plus any auxiliary terms
+    src = src + 'MASS = np.zeros((VAR_COUNT, VAR_COUNT))\n'
+    src = src + 'MASS[range(DIFF_EQ_COUNT), range(DIFF_EQ_COUNT)] = 1\n'
+    if not model['diagonal']:
+        idy = 0
+        for item in model['diffs']:
+            for aux in model['auxiliaries'][item]:
+                if aux[1] not in model['diffs']:
+                    logger.error('Error: auxiliary term not in diffs: ' + aux[1])
+                else:
+                    idx = model['diffs'].index(aux[1])
+                    src = src + "MASS[%d, %d] = %s\t\t# auxiliary diff eqn term: %s' : %s %s'\n" % (idy, idx, aux[0], item, aux[0], aux[1])
+            idy = idy + 1
+
+    unknown = sorted([ name for name in model['functions'] if name not in FUNCTIONS ])
+    src = src + '\n# vectorised implementations of any non-standard functions used by the model\n'
+    src = src + '# (eg those defined in embedded C), which must be filled in before use: '
+    src = src + (', '.join(unknown) or 'none required') + '\n'
+    src = src + 'EXTERNAL = {}\n'
+    for name in unknown:
+        logger.warn('Function %s has no NumPy equivalent, it must be supplied via EXTERNAL' % name)
+
+    return src
+
+# generate the model initialisation function
+def generateModelInit(model, config, targets):
+    src = '''
+# Create the parameter array for an ensemble of n, initialised with any values
+# known at compile time, and the corresponding state array
+# (NB: these may be overwritten by runtime values)
+def model_init(n):
+    RPAR = np.zeros((n, SYMBOL_COUNT))
+'''
+    for kind in ('independent', 'dependent'):
+        assigns = model['assignments'][kind]
+        for ii in range(len(assigns['names'])):
+            name = assigns['names'][ii]
+            if name in targets:
+                expr = assigns['exprs'][ii]
+                idx = model['symbols'][name]['index']
+                src = src + INDENT + 'RPAR[:, %d] = %s' % (idx, str_i_expr(expr['i_expr'], model))
+                src = src + '\t\t# ' + name + '=' + expr['expr'] + '\n'
+
+    src = src + '\n    constrain_params(RPAR)\n'
+    src = src + '    return RPAR, carry_forward(RPAR)\n'
+    return src
+
+# generate param_update function
+def generateParamUpdate(model, config, targets):
+    src = '''
+# Propagate parameter changes to any dependent parameters
+def param_update(RPAR, Y):
+'''
+    step = model['assignments']['step']
+    count = 0
+    if len(step) > 0:
+        for ii in range(len(step['names'])):
+            name = step['names'][ii]
+            if name not in targets: continue
+            expr = step['exprs'][ii]
+            idx = model['symbols'][name]['index']
+            src = src + INDENT + 'RPAR[:, %d] = %s' % (idx, str_i_expr(expr['i_expr'], model, 'step'))
+            src = src + '\t\t# ' + name + '=' + expr['expr'] + '\n'
+            count = count + 1
+
+    if not count:
+        src = src + '    # no parameters to update for this model\n    pass\n'
+    return src
+
+def generateSaveY(model, config):
+    return '''
+# Copy y values into corresponding columns of RPAR
+def save_y(RPAR, y):
+    RPAR[:, ROOT_INDICES] = y
+'''
+
+def generateCarryForward(model, config):
+    return '''
+# Return a state array with values from the corresponding columns of RPAR
+def carry_forward(RPAR):
+    return RPAR[:, ROOT_INDICES].copy()
+'''
+
+# generate right hand side function
+def generateRHS(model, config, targets):
+    src = '''
+# right hand side of main equation system, for the whole ensemble
+# t may be a scalar or one value per member; intermediates are saved in RPAR
+def rhs(t, y, RPAR):
+    # independent variable is always stored in RPAR[:, 0]
+    RPAR[:, 0] = t
+
+    constrain_y(y, RPAR)
+    constrain_params(RPAR)
+
+'''
+    runtime = model['assignments']['runtime']
+    if len(runtime['names']) > 0:
+        lhs = model['diffs'] + model['algs']
+        src = src + '    # calculate dependent parameters and intermediate variables\n'
+        src = src + '    INTERMEDIATES = np.zeros((y.shape[0], INTERMEDIATE_COUNT))\n'
+        for ii in range(len(runtime['names'])):
+            name = runtime['names'][ii]
+            if name in lhs: continue
+            if name not in targets: continue
+            expr = runtime['exprs'][ii]
+            idx = model['intermeds'].index(name)
+            src = src + INDENT + 'INTERMEDIATES[:, %d] = %s' % (idx, str_i_expr(expr['i_expr'], model, 'solve'))
+            src = src + '\t\t# ' + name + '=' + expr['expr'] + '\n'
+
+        src = src + '''
+    constrain_intermediates(INTERMEDIATES, y, RPAR)
+    RPAR[:, INTERMEDIATE_INDICES] = INTERMEDIATES
+
+    constrain_params(RPAR)
+
+'''
+    else:
+        src = src + '    # no dependent parameters or intermediates required for this model\n\n'
+
+    src = src + '    # calculate output variables\n'
+    src = src + '    f = np.empty(y.shape)\n'
+
+    idy = 0
+    for name in model['diffs']:
+        # as in the C, assume the right expression is always the first in the list
+        expr = model['symbols'][name]['diffs'][0]
+        src = src + "    # " + name + "' = " + expr['expr'] + '\n'
+        src = src + '    f[:, %d] = %s\n' % (idy, str_i_expr(expr['i_expr'], model, 'solve'))
+        idy = idy + 1
+
+    for name in model['algs']:
+        expr = model['symbols'][name]['algs'][0]
+        src = src + '    # ' + name + ' = ' + expr['expr'] + '\n'
+        src = src + '    f[:, %d] = %s\n' % (idy, str_i_expr(expr['i_expr'], model, 'solve'))
+        idy = idy + 1
+
+    src = src + '    return f\n'
+    return src
+
+# bounds are applied elementwise, leaving members within them unchanged
+def generateBound(target, name, constraint, model, context):
+    if constraint['kind'] != 'bound':
+        return '    # TODO: handle soft bound on ' + name + '\n'
+
+    src = '    # hard bound on ' + name + '\n'
+    src = src + '    bound = %s\n' % str_i_expr(constraint['i_expr'], model, context)
+    src = src + '    %s = np.where(%s %s bound, bound, %s)\n' % (target, target, constraint['test'], target)
+    return src
+
+def generateConstraints(model, config):
+    src = '''
+# Enforce constraints on parameters/intermediates (if any).
+def constrain_params(RPAR):
+'''
+    targets = model['symbols'].keys()
+    if not config['unused']:
+        targets = list(set(targets) - model['unused'])
+
+    body = ''
+    for name in targets:
+        sym = model['symbols'][name]
+        for constraint in sym['constraints']:
+            body = body + generateBound('RPAR[:, %d]' % sym['index'], name, constraint, model, 'init')
+    src = src + (body or '    pass\n')
+
+    src = src + '''
+def constrain_intermediates(INTERMEDIATES, y, RPAR):
+'''
+    targets = model['intermeds']
+    if not config['unused']:
+        targets = list(set(targets) - model['unused'])
+
+    body = ''
+    for name in targets:
+        idx = model['intermeds'].index(name)
+        sym = model['symbols'][name]
+        for constraint in sym['constraints']:
+            body = body + generateBound('INTERMEDIATES[:, %d]' % idx, name, constraint, model, 'solve')
+    src = src + (body or '    pass\n')
+
+    src = src + '''
+def constrain_y(y, RPAR):
+'''
+    targets = model['diffs'] + model['algs']
+
+    body = ''
+    for name in targets:
+        idx = targets.index(name)
+        sym = model['symbols'][name]
+        for constraint in sym['constraints']:
+            body = body + generateBound('y[:, %d]' % idx, name, constraint, model, 'solve')
+    src = src + (body or '    pass\n')
+
+    return src
+
+
+# convert an i_expr tuple into a NumPy expression with the appropriate data context
+# (contexts are as for codegen.str_i_expr)
+# the literal fragments are C, so this splits them into tokens, maps function names,
+# and rewrites each conditional '(cond ? yes : no)' as 'np.where(cond, yes, no)'
+def str_i_expr(i_expr, model, context='init'):
+    tokens = []
+    for item in i_expr:
+        if item[0] == 'literal':
+            text = item[1].strip()
+            if text in ('?', ':'):
+                tokens.append((text, text))
+            else:
+                for part in re.split(r'([()])', item[1]):
+                    if part in ('(', ')'):
+                        tokens.append((part, part))
+                    elif part:
+                        tokens.append(('literal', part))
+        elif item[0] == 'symbol':
+            tokens.append(('symbol', str_i_symbol(item[1], model, context)))
+        else:
+            logger.error('unknown item |%s| in i_expr' % str(item))
+            tokens.append(('symbol', 'ERROR_IN_IEXPR'))
+
+    expr, pos = convert_tokens(tokens, 0)
+    if pos < len(tokens):
+        logger.error('unbalanced parentheses in i_expr |%s|' % str(i_expr))
+    return expr
+
+# convert tokens up to the end of the current parenthesised group, returning the
+# result and the position after the group's closing parenthesis
+def convert_tokens(tokens, pos):
+    parts = [ '' ]
+    while pos < len(tokens):
+        kind, text = tokens[pos]
+        pos = pos + 1
+
+        if kind == '(':
+            inner, pos = convert_tokens(tokens, pos)
+            parts[-1] = parts[-1] + '(' + inner + ')'
+        elif kind == ')':
+            break
+        elif kind in ('?', ':'):
+            parts.append('')
+        elif kind == 'literal' and re.match(r'^\s*[A-Za-z_]\w*\s*$', text) \
+             and pos < len(tokens) and tokens[pos][0] == '(':
+            name = text.strip()
+            parts[-1] = parts[-1] + FUNCTIONS.get(name, 'EXTERNAL[%r]' % name)
+        else:
+            parts[-1] = parts[-1] + text
+
+    if len(parts) == 3:
+        return 'np.where(%s, %s, %s)' % tuple(parts), pos
+    elif len(parts) != 1:
+        logger.error('malformed conditional in i_expr')
+    return ''.join(parts), pos
+
+# map a symbol appropriately for the given context
+def str_i_symbol(name, model, context):
+    if name in model['params']:
+        return 'RPAR[:, %d]' % model['symbols'][name]['index']
+    elif name in model['roots']:
+        if context == 'solve':
+            return 'y[:, %d]' % (model['diffs'] + model['algs']).index(name)
+        elif context == 'step':
+            return 'Y[:, %d]' % (model['diffs'] + model['algs']).index(name)
+        else:
+            return 'RPAR[:, %d]' % model['symbols'][name]['index']
+    elif name in model['intermeds']:
+        if context == 'solve':
+            return 'INTERMEDIATES[:, %d]' % model['intermeds'].index(name)
+        else:
+            return 'RPAR[:, %d]' % model['symbols'][name]['index']
+    else:
+        logger.error('unknown symbol |%s| in i_expr' % name)
+        return 'ERROR_IN_IEXPR'
+
+# format a list literal, wrapping long lines
+def formatList(items, width=8):
+    if len(items) <= width:
+        return repr(list(items))
+    lines = [ ', '.join([ repr(x) for x in items[ii:ii+width] ]) for ii in range(0, len(items), width) ]
+    return '[ ' + ',\n  '.join(lines) + ' ]'
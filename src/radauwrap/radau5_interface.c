@@ -462,6 +462,66 @@ double* radau5_getMassMatrix ()
     return mass;
 }
 
+/* Continuous output */
+double radau5_dense ( unsigned int i, double x, double* cont, int* lrc )
+{
+    /* Fortran indices count from 1 */
+    int ii = (int) i + 1;
+    return CONTR5 ( &ii, &x, cont, lrc );
+}
+
+/* State snapshots */
+int radau5_write_state ( FILE* file )
+{
+    unsigned int sizes[4];
+    
+    if ( ! file || ! y )
+        return -1;
+    
+    sizes[0] = N_VARS;
+    sizes[1] = N_DOUBLE_PARAMS;
+    sizes[2] = (unsigned int) lwork;
+    sizes[3] = (unsigned int) liwork;
+    
+    if ( fwrite(sizes, sizeof(unsigned int), 4, file) != 4
+         || fwrite(&h, sizeof(double), 1, file) != 1
+         || fwrite(y, sizeof(double), N_VARS, file) != N_VARS
+         || fwrite(rpar, sizeof(double), N_DOUBLE_PARAMS, file) != N_DOUBLE_PARAMS
+         || fwrite(rtol, sizeof(double), N_VARS, file) != N_VARS
+         || fwrite(atoler, sizeof(double), N_VARS, file) != N_VARS
+         || fwrite(work, sizeof(double), lwork, file) != lwork
+         || fwrite(iwork, sizeof(int), liwork, file) != liwork )
+        return -1;
+    
+    return 0;
+}
+
+int radau5_read_state ( FILE* file )
+{
+    unsigned int sizes[4];
+    
+    if ( ! file || ! y )
+        return -1;
+    
+    if ( fread(sizes, sizeof(unsigned int), 4, file) != 4
+         || sizes[0] != N_VARS
+         || sizes[1] != N_DOUBLE_PARAMS
+         || sizes[2] != (unsigned int) lwork
+         || sizes[3] != (unsigned int) liwork )
+        return -1;
+    
+    if ( fread(&h, sizeof(double), 1, file) != 1
+         || fread(y, sizeof(double), N_VARS, file) != N_VARS
+         || fread(rpar, sizeof(double), N_DOUBLE_PARAMS, file) != N_DOUBLE_PARAMS
+         || fread(rtol, sizeof(double), N_VARS, file) != N_VARS
+         || fread(atoler, sizeof(double), N_VARS, file) != N_VARS
+         || fread(work, sizeof(double), lwork, file) != lwork
+         || fread(iwork, sizeof(int), liwork, file) != liwork )
+        return -1;
+    
+    return 0;
+}
+
 /* Invocation */
 int radau5_solve ( double startx, double endx, double* starty,
                    RadauRHS rhs, RadauOut out )
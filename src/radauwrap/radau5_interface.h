@@ -4,6 +4,8 @@
 #ifndef RADAU5_INTERFACE_H
 #define RADAU5_INTERFACE_H
 
+#include <stdio.h>
+
 /* Function to calculate the value of the system at a given time point */
 typedef void (*RadauRHS)(int* N, double* X, double* Y, double* F, double* RPAR, int* IPAR);
 
@@ -72,6 +74,23 @@ extern double* radau5_getAbsoluteTolerances ();
 /* As above, but also note that this may legitimately be NULL. */
 extern double* radau5_getMassMatrix();
 
+/* Evaluate the continuous output polynomial for variable i (numbered
+   from 0) at x, given the cont and lrc arguments passed to the output
+   function. This is only valid during an output callback, for x within
+   the step just completed. */
+extern double radau5_dense ( unsigned int i, double x, double* cont, int* lrc );
+
+/* Save and restore the complete solver state -- variables, parameters,
+   current step size, tolerances (which RADAU5 rescales in place on each
+   call) and work arrays -- to and from an already open
+   binary file. The array sizes are written along with the data, and
+   reading fails if they do not match the current allocation, so the
+   interface must already have been set up identically by radau5_alloc.
+   
+   Both return 0 if successful, -1 on failure. */
+extern int radau5_write_state ( FILE* file );
+extern int radau5_read_state ( FILE* file );
+
 #endif
 
 